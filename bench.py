@@ -0,0 +1,305 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import data
+import ffmpeg_utils
+import tuning
+from hash_demo import get_video_hash, hash_many
+
+# ============================================================
+# BENCHMARK SETTINGS
+# ============================================================
+
+# (label, width, height, seconds) for the synthetic sources
+DEFAULT_SOURCES = [
+    ("360p_10s", 640, 360, 10),
+    ("720p_10s", 1280, 720, 10),
+    ("1080p_30s", 1920, 1080, 30),
+]
+
+PRESETS = ["fast", "medium", "slow"]
+
+DEFAULT_SEED = 1234
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+
+# getrusage counts block I/O in 512-byte units
+BLOCK_SIZE = 512
+
+
+def _block_io():
+    """Bytes read/written from storage by this process and by its reaped children
+
+    /proc/self/io leaves out the ffmpeg children, which do most of an
+    encode's I/O, so both come from getrusage instead.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_inblock * BLOCK_SIZE, own.ru_oublock * BLOCK_SIZE,
+            children.ru_inblock * BLOCK_SIZE, children.ru_oublock * BLOCK_SIZE)
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def measure(func, *args, **kwargs):
+    """Run func and return (result, metrics)
+
+    CPU time and bytes read/written cover this process and every
+    ffmpeg/ffprobe child it reaped (the child_* fields are the children's share).
+    Peak RSS is the high-water mark so far (getrusage can't reset it), so
+    compare it across runs of the same scenario rather than within one run.
+    """
+    own_before, children_before = _cpu_seconds()
+    io_before = _block_io()
+    start = time.perf_counter()
+
+    result = func(*args, **kwargs)
+
+    wall = time.perf_counter() - start
+    own_after, children_after = _cpu_seconds()
+    io_after = _block_io()
+    own_read, own_write, child_read, child_write = (after - before for after, before in zip(io_after, io_before))
+    metrics = {
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(own_after - own_before, 3),
+        "child_cpu_seconds": round(children_after - children_before, 3),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "child_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        "bytes_read": own_read + child_read,
+        "bytes_written": own_write + child_write,
+        "child_bytes_read": child_read,
+        "child_bytes_written": child_write,
+    }
+    return result, metrics
+
+
+def folder_bytes(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file() and entry.name.endswith(".mp4"))
+
+
+# ============================================================
+# SYNTHETIC SOURCES
+# ============================================================
+
+def make_source(path, width, height, seconds, fps=30):
+    """Generate a test clip with ffmpeg's lavfi testsrc + sine generators"""
+    cmd = [
+        "ffmpeg",
+        "-f", "lavfi", "-i", f"testsrc=size={width}x{height}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k",
+        "-shortest",
+        "-y", path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"could not build {path}: {result.stderr[-500:]}")
+    return path
+
+
+def build_sources(folder, specs=DEFAULT_SOURCES):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for label, width, height, seconds in specs:
+        path = os.path.join(folder, f"{label}.mp4")
+        if not os.path.exists(path):
+            make_source(path, width, height, seconds)
+        paths.append(path)
+    return paths
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+        return result.stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+# ============================================================
+# SCENARIOS
+# ============================================================
+
+def bench_variation(sources, workdir, reencode, preset=None, seed=DEFAULT_SEED):
+    """create_variation on every source with one fixed preset"""
+    random.seed(seed)
+    out_dir = os.path.join(workdir, f"variation_{'reencode' if reencode else 'copy'}_{preset or 'any'}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    def run():
+        created = 0
+        for source in sources:
+            params = ffmpeg_utils.random_variation_params(reencode=reencode)
+            if preset:
+                params["preset"] = preset
+            output = os.path.join(out_dir, os.path.basename(source))
+            if ffmpeg_utils.create_variation(source, output, reencode=reencode, params=params, compute_hash=False):
+                created += 1
+        return created
+
+    created, metrics = measure(run)
+    metrics["videos"] = created
+    metrics["output_bytes"] = folder_bytes(out_dir)
+    return metrics
+
+
+def bench_hashing(files):
+    """Serial streaming hash vs the thread-pool batch API"""
+    total = sum(os.path.getsize(path) for path in files)
+    _, serial = measure(lambda: [get_video_hash(path) for path in files])
+    _, pooled = measure(hash_many, files)
+    _, mapped = measure(lambda: [get_video_hash(path, use_mmap=True) for path in files])
+    for metrics in (serial, pooled, mapped):
+        metrics["input_bytes"] = total
+        metrics["mb_per_second"] = round(total / 1e6 / metrics["wall_seconds"], 1) if metrics["wall_seconds"] else None
+    return {"serial": serial, "hash_many": pooled, "mmap": mapped}
+
+
+def bench_registry(workdir, entries=100000, seed=DEFAULT_SEED):
+    """Batched inserts plus id/hash lookups against a scratch registry"""
+    rng = random.Random(seed)
+    registry = data.HashRegistry(os.path.join(workdir, "bench_registry.db"))
+    rows = [(f"bench_{i:07d}.mp4", "%064x" % rng.getrandbits(256)) for i in range(entries)]
+
+    _, insert = measure(lambda: [registry.add_many(rows[i:i + 1000]) for i in range(0, entries, 1000)])
+    probes = [rows[rng.randrange(entries)] for _ in range(10000)]
+    _, lookup_id = measure(lambda: [registry.get(video_id) for video_id, _ in probes])
+    _, lookup_hash = measure(lambda: [registry.has_hash(hash_value) for _, hash_value in probes])
+    index = data.DedupIndex(registry)
+    _, dedup = measure(lambda: [hash_value in index for _, hash_value in probes])
+    registry.close()
+    return {"entries": entries, "insert": insert, "lookup_by_id": lookup_id, "lookup_by_hash": lookup_hash, "dedup_index": dedup}
+
+
+def bench_batch(sources_dir, workdir, reencode, jobs, variations=3, seed=DEFAULT_SEED):
+    """Full batch_create_variations run against a scratch registry"""
+    random.seed(seed)
+    out_dir = os.path.join(workdir, f"batch_{'reencode' if reencode else 'copy'}_j{jobs}")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    results, metrics = measure(
+        ffmpeg_utils.batch_create_variations,
+        sources_dir, out_dir, variations_per_video=variations, reencode=reencode, jobs=jobs
+    )
+    metrics["videos"] = len(results)
+    metrics["output_bytes"] = folder_bytes(out_dir)
+    metrics["videos_per_minute"] = round(len(results) / metrics["wall_seconds"] * 60, 2) if metrics["wall_seconds"] else None
+    return metrics
+
+
+def run_suite(workdir, seed=DEFAULT_SEED, jobs=(1, 0), quick=False):
+    specs = DEFAULT_SOURCES[:1] if quick else DEFAULT_SOURCES
+    sources_dir = os.path.join(workdir, "sources")
+    sources = build_sources(sources_dir, specs)
+    # Keep every persistent store out of the production data/ folder (the
+    # output cache already defaults to a folder next to each output folder)
+    data.use_registry(os.path.join(workdir, "batch_registry.db"))
+    data.use_probe_cache(os.path.join(workdir, "probe_cache.db"))
+    data.use_fingerprint_cache(os.path.join(workdir, "fingerprints.db"))
+    tuning.model_path = os.path.join(workdir, "speed_model.json")
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "sources": [{"label": label, "width": w, "height": h, "seconds": sec} for label, w, h, sec in specs],
+        "variation": {"copy": bench_variation(sources, workdir, reencode=False, seed=seed)},
+        "hashing": bench_hashing(sources),
+        "registry": bench_registry(workdir, entries=10000 if quick else 100000, seed=seed),
+        "batch": {},
+    }
+    for preset in PRESETS:
+        report["variation"][f"reencode_{preset}"] = bench_variation(sources, workdir, reencode=True, preset=preset, seed=seed)
+    for job_count in jobs:
+        report["batch"][f"copy_j{job_count}"] = bench_batch(sources_dir, workdir, reencode=False, jobs=job_count, seed=seed)
+        report["batch"][f"reencode_j{job_count}"] = bench_batch(sources_dir, workdir, reencode=True, jobs=job_count, seed=seed)
+    return report
+
+
+# ============================================================
+# COMPARISON
+# ============================================================
+
+def _flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline_path, current_path, threshold=0.10):
+    """Print wall/CPU changes between two result files, flagging regressions"""
+    with open(baseline_path) as f:
+        baseline = _flatten(json.load(f))
+    with open(current_path) as f:
+        current = _flatten(json.load(f))
+
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        if not name.endswith(("wall_seconds", "cpu_seconds", "child_cpu_seconds")):
+            continue
+        before, after = baseline[name], current[name]
+        if not before:
+            continue
+        change = (after - before) / before
+        flag = ""
+        if change > threshold:
+            flag = "  << REGRESSION"
+            regressions += 1
+        print(f"{name:55s} {before:10.3f} -> {after:10.3f} ({change:+.1%}){flag}")
+    return regressions
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the video variation pipeline")
+    parser.add_argument("-o", "--output", help="Result JSON path (default: bench_results/<timestamp>.json)")
+    parser.add_argument("-w", "--workdir", help="Scratch folder (default: a temp dir, removed afterwards)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help=f"Random seed (default: {DEFAULT_SEED})")
+    parser.add_argument("--quick", action="store_true", help="One small source and a smaller registry")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare) else 0)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="video_bench_")
+    try:
+        report = run_suite(workdir, seed=args.seed, quick=args.quick)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join("bench_results", f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved benchmark results to {output}")
@@ -0,0 +1,413 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+
+from data import DedupIndex, SQLiteJobQueue, get_registry
+from data.job_queue import DEFAULT_LEASE_SECONDS
+from engine import JobCancelled, JobTimeout
+from hash_demo import file_fingerprint, find_duplicate_files
+from ffmpeg_utils import (
+    create_variation,
+    encoder_thread_budget,
+    get_video_files,
+    plan_variation_jobs,
+    probe_many,
+    setup_logging,
+    staging_path,
+)
+
+# ============================================================
+# CLUSTER SETTINGS
+# ============================================================
+#
+# One coordinator plans a batch and publishes its jobs to a shared queue;
+# any number of workers (on any host that sees the same input/output
+# paths) claim jobs under a lease, renew it with heartbeats while ffmpeg
+# runs, and report each output's hash back. The coordinator writes those
+# results to the central registry. A worker that dies stops heartbeating,
+# its lease runs out and the job is handed to someone else.
+#
+# Queue backends (open_queue):
+#   path/to/jobs.db      SQLite file on a disk every node mounts
+#   tcp://host:port      a QueueServer fronting a coordinator-local SQLite file
+
+DEFAULT_PORT = 8765
+
+# Seconds an idle worker waits before asking for work again
+IDLE_POLL_SECONDS = 2.0
+
+# Seconds between the coordinator's result collection passes
+COLLECT_POLL_SECONDS = 2.0
+
+# Queue methods a TCP client may call
+QUEUE_METHODS = {"publish", "claim", "heartbeat", "complete", "fail", "requeue_expired", "counts"}
+
+
+# ============================================================
+# TCP QUEUE BACKEND
+# ============================================================
+
+class QueueServer(socketserver.ThreadingTCPServer):
+    """Serves a queue backend over TCP as JSON lines
+
+    Request:  {"method": "claim", "args": ["worker-1", 60]}
+    Response: {"ok": true, "result": ...} or {"ok": false, "error": "..."}
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, backend, host="127.0.0.1", port=DEFAULT_PORT):
+        self.backend = backend
+        super().__init__((host, port), QueueRequestHandler)
+
+
+class QueueRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                method = request["method"]
+                if method not in QUEUE_METHODS:
+                    raise ValueError(f"unknown method: {method}")
+                result = getattr(self.server.backend, method)(*request.get("args", []))
+                response = {"ok": True, "result": result}
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+
+class TCPJobQueue:
+    """Client for a QueueServer with the same interface as SQLiteJobQueue"""
+
+    def __init__(self, host, port=DEFAULT_PORT, timeout=30.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def _call(self, method, *args):
+        with self.lock:
+            # One reconnect covers a server restart between calls
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+                        self.reader = self.sock.makefile("rb")
+                    self.sock.sendall((json.dumps({"method": method, "args": args}) + "\n").encode())
+                    line = self.reader.readline()
+                    if not line:
+                        raise ConnectionError("queue server closed the connection")
+                    break
+                except OSError:
+                    self._disconnect()
+                    if attempt:
+                        raise
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def publish(self, jobs):
+        return self._call("publish", [list(job) for job in jobs])
+
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        claimed = self._call("claim", worker, lease_seconds)
+        return tuple(claimed) if claimed else None
+
+    def heartbeat(self, job_id, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        return self._call("heartbeat", job_id, worker, lease_seconds)
+
+    def complete(self, job_id, worker, result):
+        return self._call("complete", job_id, worker, result)
+
+    def fail(self, job_id, worker, error):
+        return self._call("fail", job_id, worker, error)
+
+    def requeue_expired(self):
+        return self._call("requeue_expired")
+
+    def counts(self):
+        return self._call("counts")
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+
+def open_queue(url):
+    """SQLiteJobQueue for a file path, TCPJobQueue for tcp://host:port"""
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://"):].rpartition(":")
+        return TCPJobQueue(host or "127.0.0.1", int(port or DEFAULT_PORT))
+    return SQLiteJobQueue(url)
+
+
+# ============================================================
+# COORDINATOR
+# ============================================================
+
+class Coordinator:
+    """Publishes a batch to the queue and registers the results
+
+    Needs the queue's SQLite file directly (not a TCP client), since it
+    is the one place results are read back from.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.dedup = DedupIndex(get_registry())
+        self.registered = 0
+        self.duplicates = 0
+
+    def submit(self, input_folder, output_folder, variations_per_video=3, reencode=False, use_filter=False, use_audio=False, timeout=None):
+        """Plan every variation of the folder's sources and queue them
+
+        Returns:
+            number of jobs newly queued (jobs already queued are kept)
+        """
+        os.makedirs(output_folder, exist_ok=True)
+        sources = get_video_files(input_folder)
+        duplicates = find_duplicate_files(sources)
+        if duplicates:
+            logging.info(f"Skipped {len(duplicates)} duplicate sources")
+        probes = probe_many([path for path in sources if path not in duplicates])
+        sources = [path for path, info in probes.items() if info is not None]
+        planned = plan_variation_jobs(sources, os.path.abspath(output_folder), variations_per_video, reencode=reencode, use_filter=use_filter, use_audio=use_audio)
+        options = {"reencode": reencode, "use_filter": use_filter, "use_audio": use_audio, "timeout": timeout}
+        added = self.queue.publish([
+            (os.path.basename(job["output_path"]), dict(job, input_path=os.path.abspath(job["input_path"]), options=options))
+            for job in planned
+        ])
+        logging.info(f"Queued {added} of {len(planned)} jobs from {len(sources)} sources")
+        return added
+
+    def collect_once(self):
+        """Register any newly finished results; returns the queue counts"""
+        self.queue.requeue_expired()
+        finished = self.queue.unregistered_results()
+        if finished:
+            with get_registry().writer() as writer:
+                for job_id, result in finished:
+                    if self.dedup.is_duplicate(result["hash"], video_id=job_id):
+                        logging.warning(f"  ⚠ DUPLICATE DETECTED: {result['path']}")
+                        self.duplicates += 1
+                        continue
+                    self.dedup.add(result["hash"])
+                    writer.add(job_id, result["hash"], result.get("fingerprint"))
+                    self.registered += 1
+            self.queue.mark_registered([job_id for job_id, _ in finished])
+        return self.queue.counts()
+
+    def collect(self, poll_interval=COLLECT_POLL_SECONDS):
+        """Register results until no job is queued or leased
+
+        Returns:
+            final queue counts
+        """
+        last = None
+        while True:
+            counts = self.collect_once()
+            if counts != last:
+                logging.info("Queue: " + ", ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+                last = counts
+            if not counts.get("queued") and not counts.get("leased"):
+                return counts
+            time.sleep(poll_interval)
+
+
+# ============================================================
+# WORKER
+# ============================================================
+
+class Worker:
+    """Claims jobs from a queue and runs them until stopped"""
+
+    def __init__(self, queue, worker_id=None, jobs=1, lease_seconds=DEFAULT_LEASE_SECONDS, exit_when_idle=False):
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.jobs = max(1, jobs)
+        self.lease_seconds = lease_seconds
+        self.exit_when_idle = exit_when_idle
+        self.stop_event = threading.Event()
+        self.completed = 0
+        self.failed = 0
+        self._attempts = itertools.count(1)
+
+    def _heartbeat(self, job_id, done):
+        # Renew well before the lease can lapse
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                    logging.warning(f"Lost lease on {job_id}; its result will be discarded")
+                    return
+            except Exception as e:
+                logging.warning(f"Heartbeat for {job_id} failed: {e}")
+
+    def process(self, job_id, payload):
+        """Run one claimed job and report it back to the queue
+
+        Never raises: any error is reported with queue.fail() so the job is
+        retried elsewhere instead of killing this worker's thread.
+        """
+        # Own temp file per attempt: after a lease expires, this worker and
+        # the job's new owner may both still be writing
+        temp_path = staging_path(payload["output_path"], tag=f"{self.worker_id}.{next(self._attempts)}")
+        try:
+            self._run(job_id, payload, temp_path)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            self.failed += 1
+            logging.warning(f"✗ {job_id}: {error}")
+            try:
+                self.queue.fail(job_id, self.worker_id, error)
+            except Exception as report_error:
+                logging.warning(f"Could not report failure of {job_id}: {report_error}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _run(self, job_id, payload, temp_path):
+        options = payload["options"]
+        output_path = payload["output_path"]
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = create_variation(
+                payload["input_path"], temp_path,
+                reencode=options["reencode"], use_filter=options["use_filter"], use_audio=options["use_audio"],
+                params=payload["params"], threads=encoder_thread_budget(self.jobs), timeout=options.get("timeout"),
+            )
+            error = None if result and result["hash"] else "ffmpeg failed"
+        except (JobTimeout, JobCancelled) as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if error:
+            self.queue.fail(job_id, self.worker_id, error)
+            self.failed += 1
+            logging.warning(f"✗ {job_id}: {error}")
+            return
+        # Only the lease holder may publish the output
+        if not self.queue.heartbeat(job_id, self.worker_id, self.lease_seconds):
+            logging.warning(f"{job_id} finished after its lease was reassigned; output discarded")
+            return
+        os.replace(temp_path, output_path)
+        result["path"] = output_path
+        result["fingerprint"] = file_fingerprint(output_path)
+        if self.queue.complete(job_id, self.worker_id, result):
+            self.completed += 1
+            logging.info(f"✓ {job_id} {result['hash'][:16]}...")
+        else:
+            logging.warning(f"{job_id} finished after its lease was reassigned; result not reported")
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                claimed = self.queue.claim(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logging.warning(f"Claim failed: {e}")
+                self.stop_event.wait(IDLE_POLL_SECONDS)
+                continue
+            if claimed is None:
+                if self.exit_when_idle:
+                    return
+                self.stop_event.wait(IDLE_POLL_SECONDS)
+                continue
+            self.process(*claimed)
+
+    def run(self):
+        logging.info(f"Worker {self.worker_id} running {self.jobs} job(s) at a time")
+        threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(self.jobs)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1.0)
+        except KeyboardInterrupt:
+            logging.info("Stopping after current jobs...")
+            self.stop()
+            for thread in threads:
+                thread.join()
+        logging.info(f"Worker {self.worker_id}: {self.completed} done, {self.failed} failed")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distribute variation jobs across machines")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    coordinate = sub.add_parser("coordinate", help="Queue a batch and register results as workers finish them")
+    coordinate.add_argument("input", help="Input folder with source videos")
+    coordinate.add_argument("output", help="Output folder for variations (same path on every worker)")
+    coordinate.add_argument("--queue", required=True, help="SQLite queue file")
+    coordinate.add_argument("--serve", metavar="HOST:PORT", help="Also serve the queue to workers over TCP")
+    coordinate.add_argument("-n", "--number", type=int, default=3, help="Variations per video (default: 3)")
+    coordinate.add_argument("-r", "--reencode", action="store_true", help="Re-encode videos (slower but deeper uniqueness)")
+    coordinate.add_argument("-f", "--filter", action="store_true", help="Apply visual filters (re-encodes video, copies audio)")
+    coordinate.add_argument("-a", "--audio", action="store_true", help="Apply audio variations (re-encodes audio, copies video)")
+    coordinate.add_argument("-t", "--timeout", type=float, default=None, help="Kill any ffmpeg job running longer than this many seconds")
+
+    work = sub.add_parser("work", help="Claim and run jobs")
+    work.add_argument("--queue", required=True, help="SQLite queue file or tcp://host:port")
+    work.add_argument("-j", "--jobs", type=int, default=1, help="Jobs run at once on this machine (default: 1)")
+    work.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, help=f"Lease seconds (default: {DEFAULT_LEASE_SECONDS:g})")
+    work.add_argument("--exit-when-idle", action="store_true", help="Exit once the queue is empty")
+
+    serve = sub.add_parser("serve", help="Serve a SQLite queue over TCP")
+    serve.add_argument("--queue", required=True, help="SQLite queue file")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+
+    args = parser.parse_args()
+
+    if args.command == "coordinate":
+        os.makedirs(args.output, exist_ok=True)
+        setup_logging(args.output)
+        queue = SQLiteJobQueue(args.queue)
+        coordinator = Coordinator(queue)
+        coordinator.submit(args.input, args.output, args.number, reencode=args.reencode, use_filter=args.filter, use_audio=args.audio, timeout=args.timeout)
+        if args.serve:
+            host, _, port = args.serve.rpartition(":")
+            server = QueueServer(queue, host or "127.0.0.1", int(port))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            logging.info(f"Serving queue on tcp://{host or '127.0.0.1'}:{port}")
+        counts = coordinator.collect()
+        logging.info(f"Registered {coordinator.registered}, duplicates {coordinator.duplicates}, failed {counts.get('failed', 0)}")
+    elif args.command == "work":
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s', datefmt='%H:%M:%S')
+        Worker(open_queue(args.queue), jobs=args.jobs, lease_seconds=args.lease, exit_when_idle=args.exit_when_idle).run()
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s', datefmt='%H:%M:%S')
+        server = QueueServer(SQLiteJobQueue(args.queue), args.host, args.port)
+        logging.info(f"Serving {args.queue} on tcp://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
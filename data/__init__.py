@@ -1,14 +1,69 @@
-import json, os
+import os
+
+from .registry import HashRegistry, RegistryWriter, db_path
+from .dedup import BloomFilter, DedupIndex
+from .probe_cache import ProbeCache, probe_cache_path
+from .job_queue import SQLiteJobQueue
+from .fingerprints import FingerprintCache, fingerprints_path
+from .output_cache import OutputCache, default_cache_root
 
 hashes_path = os.path.join(os.path.dirname(__file__), "hashes.json")
 
+_registry = None
+_probe_cache = None
+_fingerprints = None
+_output_caches = {}
+
+def get_registry():
+    """Shared registry, migrating hashes.json on first use"""
+    global _registry
+    if _registry is None:
+        _registry = HashRegistry(db_path, json_path=hashes_path)
+    return _registry
+
+def use_registry(path):
+    """Point the shared registry at another database (benchmarks, tests)"""
+    global _registry
+    _registry = HashRegistry(path)
+    return _registry
+
 def load_hashes():
-    try:
-        with open(hashes_path, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return dict(get_registry().items())
     
 def save_hashes(hashes_dict):
-    with open(hashes_path, "w") as f:
-        json.dump(hashes_dict, f)
+    get_registry().replace_all(hashes_dict)
+
+def get_probe_cache():
+    """Shared ffprobe result cache"""
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = ProbeCache(probe_cache_path)
+    return _probe_cache
+
+def use_probe_cache(path):
+    """Point the shared probe cache at another database (benchmarks, tests)"""
+    global _probe_cache
+    _probe_cache = ProbeCache(path)
+    return _probe_cache
+
+def get_fingerprint_cache():
+    """Shared cache of sampled/full file digests"""
+    global _fingerprints
+    if _fingerprints is None:
+        _fingerprints = FingerprintCache(fingerprints_path)
+    return _fingerprints
+
+def use_fingerprint_cache(path):
+    """Point the shared fingerprint cache at another database (benchmarks, tests)"""
+    global _fingerprints
+    _fingerprints = FingerprintCache(path)
+    return _fingerprints
+
+def get_output_cache(root, max_bytes=None):
+    """Shared content-addressed output cache under root (max_bytes resizes it)"""
+    root = os.path.abspath(root)
+    if root not in _output_caches:
+        _output_caches[root] = OutputCache(root)
+    if max_bytes is not None:
+        _output_caches[root].max_bytes = max_bytes
+    return _output_caches[root]
@@ -0,0 +1,99 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter for hex digests (or any string)
+
+    Bit positions come from double hashing over the digest bytes, so
+    SHA-256 hex strings are never re-hashed.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        try:
+            raw = bytes.fromhex(key)
+        except ValueError:
+            raw = b""
+        if len(raw) < 16:
+            raw = hashlib.sha256(key.encode()).digest()
+        h1 = int.from_bytes(raw[:8], "little")
+        h2 = int.from_bytes(raw[8:16], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupIndex:
+    """O(1) duplicate checks against this batch and the whole registry
+
+    Hashes seen in the current batch live in a set. Registry hashes sit
+    behind a Bloom filter that is built on the first lookup; only filter
+    hits go to the indexed registry query, so misses never touch disk.
+    """
+
+    def __init__(self, registry=None, error_rate=0.01):
+        self.registry = registry
+        self.error_rate = error_rate
+        self.seen = set()
+        self._bloom = None
+        self._lock = threading.RLock()
+
+    def _registry_filter(self):
+        with self._lock:
+            if self._bloom is None:
+                bloom = BloomFilter(len(self.registry), self.error_rate)
+                for _, hash_value in self.registry.items():
+                    bloom.add(hash_value)
+                self._bloom = bloom
+        return self._bloom
+
+    def in_registry(self, hash_value):
+        if self.registry is None:
+            return False
+        return hash_value in self._registry_filter() and self.registry.has_hash(hash_value)
+
+    def is_duplicate(self, hash_value, video_id=None):
+        """Like `in`, but a registry entry under video_id itself doesn't count
+
+        Regenerating an output under its old name (e.g. a resumed job)
+        isn't a duplicate of its own earlier registration.
+        """
+        if hash_value in self.seen:
+            return True
+        if not self.in_registry(hash_value):
+            return False
+        return any(owner != video_id for owner in self.registry.find_by_hash(hash_value))
+
+    def add(self, hash_value):
+        self.seen.add(hash_value)
+
+    def claim(self, hash_value, video_id=None):
+        """Atomic is_duplicate + add for indexes shared between threads
+
+        Returns:
+            True if hash_value was new (and is now recorded), False if a duplicate
+        """
+        with self._lock:
+            if self.is_duplicate(hash_value, video_id=video_id):
+                return False
+            self.add(hash_value)
+            return True
+
+    def __contains__(self, hash_value):
+        return hash_value in self.seen or self.in_registry(hash_value)
+
+    def __len__(self):
+        return len(self.seen)
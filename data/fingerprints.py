@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import threading
+
+from .registry import BUSY_TIMEOUT_MS
+
+fingerprints_path = os.path.join(os.path.dirname(__file__), "fingerprints.db")
+
+
+class FingerprintCache:
+    """Persistent per-file sampled and full content digests
+
+    Like the probe cache, entries are keyed by absolute path and only
+    served while size and mtime still match, so rescanning an unchanged
+    library costs one stat per file.
+    """
+
+    def __init__(self, path=fingerprints_path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " sample TEXT,"
+                " sha256 TEXT)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, path, size, mtime_ns):
+        """Return {"sample": ..., "sha256": ...} (either may be None) or None if stale"""
+        row = self._connect().execute(
+            "SELECT sample, sha256 FROM fingerprints WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (os.path.abspath(path), size, mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"sample": row[0], "sha256": row[1]}
+
+    def put(self, path, size, mtime_ns, sample=None, sha256=None):
+        """Store digests, keeping ones already known for the same file version"""
+        path = os.path.abspath(path)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO fingerprints (path, size, mtime_ns, sample, sha256) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(path) DO UPDATE SET"
+                "  sample = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns"
+                "                THEN COALESCE(excluded.sample, sample) ELSE excluded.sample END,"
+                "  sha256 = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns"
+                "                THEN COALESCE(excluded.sha256, sha256) ELSE excluded.sha256 END,"
+                "  size = excluded.size, mtime_ns = excluded.mtime_ns",
+                (path, size, mtime_ns, sample, sha256)
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import threading
+import time
+
+from .registry import BUSY_TIMEOUT_MS
+
+# Seconds a claimed job stays owned without a heartbeat
+DEFAULT_LEASE_SECONDS = 60.0
+
+# Claims per job (first run plus retries) before it is marked failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class SQLiteJobQueue:
+    """Job queue in a SQLite file that every node can open
+
+    Workers claim jobs under a lease and keep it alive with heartbeats.
+    When a lease runs out (the worker crashed or lost the disk), the next
+    claim puts the job back in the queue, until it has run out of attempts.
+
+    Uses a rollback journal instead of WAL, because WAL's shared memory
+    doesn't work across hosts on a network filesystem.
+
+    Statuses: queued -> leased -> done | failed (done -> registered once
+    the coordinator has written the result to the registry)
+    """
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=DELETE")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " worker TEXT,"
+                " lease_expires REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " result TEXT,"
+                " error TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, lease_expires)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode, so claim() can take the write lock up front
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    def publish(self, jobs):
+        """Queue (job_id, payload) pairs; ids already in the queue are left alone
+
+        Returns:
+            number of jobs added
+        """
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (job_id, payload, status, updated_at) VALUES (?, ?, 'queued', ?)",
+                [(job_id, json.dumps(payload), now) for job_id, payload in jobs]
+            )
+            return conn.total_changes - before
+
+    def requeue_expired(self):
+        """Return jobs with lapsed leases to the queue (or fail them)
+
+        Returns:
+            number of jobs requeued
+        """
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired', worker = NULL, updated_at = ?"
+                " WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, lease_expires = NULL, updated_at = ?"
+                " WHERE status = 'leased' AND lease_expires < ?",
+                (now, now)
+            )
+            return cursor.rowcount
+
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Lease the oldest queued job to worker
+
+        Returns:
+            (job_id, payload) or None if nothing is queued
+        """
+        self.requeue_expired()
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT job_id, payload FROM jobs WHERE status = 'queued' ORDER BY rowid LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE job_id = ?",
+                (worker, now + lease_seconds, now, row[0])
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extend worker's lease; False means the job was taken away"""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE job_id = ? AND worker = ? AND status = 'leased'",
+                (now + lease_seconds, now, job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, result):
+        """Store a finished job's result; False if worker no longer owned it"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, lease_expires = NULL, updated_at = ?"
+                " WHERE job_id = ? AND worker = ? AND status = 'leased'",
+                (json.dumps(result), time.time(), job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        """Give a job back after an error; it is retried until max_attempts"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+                " worker = NULL, lease_expires = NULL, error = ?, updated_at = ?"
+                " WHERE job_id = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, error, time.time(), job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def unregistered_results(self):
+        """(job_id, result) for finished jobs not yet written to the registry"""
+        rows = self._connect().execute("SELECT job_id, result FROM jobs WHERE status = 'done' ORDER BY rowid").fetchall()
+        return [(job_id, json.loads(result)) for job_id, result in rows]
+
+    def mark_registered(self, job_ids):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE jobs SET status = 'registered', updated_at = ? WHERE job_id = ? AND status = 'done'",
+                [(time.time(), job_id) for job_id in job_ids]
+            )
+
+    def counts(self):
+        """dict of status -> number of jobs"""
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return dict(rows.fetchall())
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
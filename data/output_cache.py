@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from .registry import BUSY_TIMEOUT_MS
+
+CACHE_DIR_NAME = ".output_cache"
+
+# Bytes of cached outputs kept before the least recently used are dropped
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+
+# Linux ioctl for reflink copies (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+
+def default_cache_root(output_folder):
+    """Cache folder on the same filesystem as output_folder
+
+    Hits are only cheap (reflink or hardlink) when cache and outputs share
+    a filesystem, so the cache sits next to the output folder, or inside
+    it when the output folder is itself a mount point.
+    """
+    output_folder = os.path.abspath(output_folder)
+    if os.path.ismount(output_folder):
+        return os.path.join(output_folder, CACHE_DIR_NAME)
+    return os.path.join(os.path.dirname(output_folder), CACHE_DIR_NAME)
+
+
+def link_file(src, dst):
+    """Make dst share src's data as cheaply as possible
+
+    Reflink first (copy-on-write, so editing one never touches the other),
+    then a hardlink (same inode: don't edit outputs in place), then a copy.
+
+    Returns:
+        "reflink", "hardlink" or "copy"
+    """
+    temp = dst + ".tmp"
+    try:
+        import fcntl
+        with open(src, "rb") as fin, open(temp, "wb") as fout:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        os.replace(temp, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        if os.path.exists(temp):
+            os.remove(temp)
+    try:
+        os.link(src, temp)
+        os.replace(temp, dst)
+        return "hardlink"
+    except OSError:
+        if os.path.exists(temp):
+            os.remove(temp)
+    shutil.copyfile(src, temp)
+    os.replace(temp, dst)
+    return "copy"
+
+
+class OutputCache:
+    """Content-addressed store of finished outputs
+
+    Keys come from make_key (source digest + every job parameter + ffmpeg
+    version), so a hit is the exact file the job would produce. Files
+    live under root/<key[:2]>/<key>.mp4 with a small SQLite index that
+    tracks size, output hash and last use for LRU eviction.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "index.db")
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outputs ("
+                " key TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " hash TEXT,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outputs_last_used ON outputs(last_used)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(source_digest, params, ffmpeg_version, options=None):
+        """Stable key for one job's output"""
+        material = {
+            "source": source_digest,
+            "params": params,
+            "ffmpeg": ffmpeg_version,
+            "options": options or {},
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.mp4")
+
+    def serve(self, key, output_path):
+        """Link a cached output to output_path
+
+        Returns:
+            {"hash": ..., "method": ...} on a hit, None on a miss
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT hash FROM outputs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        cached = self._file(key)
+        try:
+            method = link_file(cached, output_path)
+        except OSError:
+            # Index entry whose file was deleted by hand
+            with conn:
+                conn.execute("DELETE FROM outputs WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE outputs SET last_used = ? WHERE key = ?", (time.time(), key))
+        return {"hash": row[0], "method": method}
+
+    def put(self, key, filepath, hash_value=None):
+        """Store a finished output under key (no-op if already cached)"""
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM outputs WHERE key = ?", (key,)).fetchone():
+            return
+        cached = self._file(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        link_file(filepath, cached)
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO outputs (key, size, hash, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, os.path.getsize(cached), hash_value, now, now)
+            )
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used outputs until the cache fits max_bytes
+
+        Returns:
+            number of outputs removed
+        """
+        with self._evict_lock:
+            conn = self._connect()
+            excess = self.total_bytes() - self.max_bytes
+            removed = 0
+            if excess <= 0:
+                return 0
+            for key, size in conn.execute("SELECT key, size FROM outputs ORDER BY last_used").fetchall():
+                if excess <= 0:
+                    break
+                try:
+                    os.remove(self._file(key))
+                except FileNotFoundError:
+                    pass
+                with conn:
+                    conn.execute("DELETE FROM outputs WHERE key = ?", (key,))
+                excess -= size
+                removed += 1
+            return removed
+
+    def total_bytes(self):
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .registry import BUSY_TIMEOUT_MS
+
+probe_cache_path = os.path.join(os.path.dirname(__file__), "probe_cache.db")
+
+# Entries kept before the least recently used ones are dropped
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class ProbeCache:
+    """Persistent cache of parsed ffprobe output
+
+    Entries are keyed by absolute path and only served while the file's
+    size and mtime still match, so edited or replaced files are re-probed.
+    """
+
+    def __init__(self, path=probe_cache_path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " info TEXT NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_probes_last_used ON probes(last_used)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _stat_key(filepath):
+        st = os.stat(filepath)
+        return os.path.abspath(filepath), st.st_size, st.st_mtime_ns
+
+    def get(self, filepath):
+        """Return cached probe info, or None if missing or stale"""
+        try:
+            path, size, mtime_ns = self._stat_key(filepath)
+        except OSError:
+            return None
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT info FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE probes SET last_used = ? WHERE path = ?", (time.time(), path))
+        return json.loads(row[0])
+
+    def put(self, filepath, info):
+        try:
+            path, size, mtime_ns = self._stat_key(filepath)
+        except OSError:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, info, last_used) VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, json.dumps(info), time.time())
+            )
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            with conn:
+                conn.execute(
+                    "DELETE FROM probes WHERE path IN (SELECT path FROM probes ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM probes").fetchone()[0]
@@ -0,0 +1,249 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+db_path = os.path.join(os.path.dirname(__file__), "hashes.db")
+
+# How long a writer waits on another process holding the lock (ms)
+BUSY_TIMEOUT_MS = 30000
+
+# Fingerprint columns used by the fast integrity tiers (see hash_demo.file_fingerprint)
+FINGERPRINT_COLUMNS = ("size", "mtime_ns", "inode", "sample")
+
+
+class HashRegistry:
+    """SQLite-backed video_id -> hash registry
+
+    Runs in WAL mode so readers never block the writer and several
+    processes can share the file. Lookups by video id and by hash are
+    both indexed, and writes touch only the rows that changed.
+    """
+
+    def __init__(self, path=db_path, json_path=None):
+        self.path = path
+        self._local = threading.local()
+        self._setup()
+        if json_path:
+            self.migrate_json(json_path)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _setup(self):
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS videos ("
+                " video_id TEXT PRIMARY KEY,"
+                " hash TEXT NOT NULL,"
+                " registered_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_hash ON videos(hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_registered ON videos(registered_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # Databases from before fingerprints gain the columns in place
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(videos)")}
+            for column, kind in zip(FINGERPRINT_COLUMNS, ("INTEGER", "INTEGER", "INTEGER", "TEXT")):
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE videos ADD COLUMN {column} {kind}")
+
+    def migrate_json(self, json_path):
+        """Import a legacy hashes.json once; later calls are no-ops
+
+        Returns:
+            number of entries imported
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if row or not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, "r") as f:
+                legacy = json.load(f)
+        except ValueError as e:
+            print(f"Error: could not migrate {json_path}: {e}")
+            return 0
+        now = time.time()
+        with conn:
+            # Existing rows win: they were written after the JSON file
+            conn.executemany(
+                "INSERT OR IGNORE INTO videos (video_id, hash, registered_at) VALUES (?, ?, ?)",
+                [(video_id, hash_value, now) for video_id, hash_value in legacy.items()]
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (json_path,))
+        print(f"Migrated {len(legacy)} entries from {json_path}")
+        return len(legacy)
+
+    def get(self, video_id):
+        """Return the hash for video_id, or None"""
+        row = self._connect().execute("SELECT hash FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_record(self, video_id):
+        """Return {"hash", "size", "mtime_ns", "inode", "sample"} for video_id, or None
+
+        Fingerprint fields are None for videos registered without them.
+        """
+        row = self._connect().execute(
+            "SELECT hash, size, mtime_ns, inode, sample FROM videos WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("hash",) + FINGERPRINT_COLUMNS, row))
+
+    def set_fingerprint(self, video_id, fingerprint):
+        """Refresh the stored fingerprint after a full hash confirmed the file"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE videos SET size = ?, mtime_ns = ?, inode = ?, sample = ? WHERE video_id = ?",
+                tuple(fingerprint.get(column) for column in FINGERPRINT_COLUMNS) + (video_id,)
+            )
+
+    def find_by_hash(self, hash_value):
+        """Return every video_id registered with this hash"""
+        rows = self._connect().execute("SELECT video_id FROM videos WHERE hash = ?", (hash_value,))
+        return [row[0] for row in rows]
+
+    def has_hash(self, hash_value):
+        row = self._connect().execute("SELECT 1 FROM videos WHERE hash = ? LIMIT 1", (hash_value,)).fetchone()
+        return row is not None
+
+    def add(self, video_id, hash_value, fingerprint=None):
+        self.add_many([(video_id, hash_value, fingerprint)])
+
+    def add_many(self, entries):
+        """Insert or update entries in one transaction
+
+        Each entry is (video_id, hash) or (video_id, hash, fingerprint dict);
+        re-registering a video replaces any fingerprint it had.
+        """
+        now = time.time()
+        rows = []
+        for video_id, hash_value, *rest in entries:
+            fingerprint = (rest[0] if rest else None) or {}
+            rows.append((video_id, hash_value, now) + tuple(fingerprint.get(column) for column in FINGERPRINT_COLUMNS))
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO videos (video_id, hash, registered_at, size, mtime_ns, inode, sample)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def replace_all(self, hashes_dict):
+        """Make the registry hold exactly hashes_dict (legacy save_hashes)"""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM videos")
+            conn.executemany(
+                "INSERT INTO videos (video_id, hash, registered_at) VALUES (?, ?, ?)",
+                [(video_id, hash_value, now) for video_id, hash_value in hashes_dict.items()]
+            )
+
+    def items(self):
+        """Yield (video_id, hash) pairs in registration order without loading them all"""
+        cursor = self._connect().execute("SELECT video_id, hash FROM videos ORDER BY registered_at, rowid")
+        for row in cursor:
+            yield row[0], row[1]
+
+    def iter_entries(self, pattern=None, hash_prefix=None, offset=0, limit=None, batch_size=1000):
+        """Lazily yield (video_id, hash) in registration order, a page at a time
+
+        Pages are fetched by keyset (registered_at, rowid), so no cursor stays
+        open between batches and deep pages cost the same as the first.
+
+        Args:
+            pattern: Glob on video_id, e.g. "clip_*"
+            hash_prefix: Only hashes starting with this hex prefix
+            offset: Entries to skip
+            limit: Maximum entries to yield (None = all)
+        """
+        filters, args = [], []
+        if pattern:
+            filters.append("video_id GLOB ?")
+            args.append(pattern)
+        if hash_prefix:
+            filters.append("hash GLOB ?")
+            args.append(hash_prefix.lower() + "*")
+        conn = self._connect()
+        last = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            where = list(filters)
+            page_args = list(args)
+            if last is not None:
+                where.append("(registered_at > ? OR (registered_at = ? AND rowid > ?))")
+                page_args.extend([last[0], last[0], last[1]])
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            sql = "SELECT video_id, hash, registered_at, rowid FROM videos"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += " ORDER BY registered_at, rowid LIMIT ? OFFSET ?"
+            rows = conn.execute(sql, page_args + [size, offset if last is None else 0]).fetchall()
+            if not rows:
+                return
+            for video_id, hash_value, _, _ in rows:
+                yield video_id, hash_value
+            last = (rows[-1][2], rows[-1][3])
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < size:
+                return
+
+    def writer(self, batch_size=100):
+        return RegistryWriter(self, batch_size=batch_size)
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def __contains__(self, video_id):
+        return self.get(video_id) is not None
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RegistryWriter:
+    """Buffers registrations and commits them in small batches
+
+    Use as a context manager; anything still buffered is committed on exit,
+    so a crash loses at most one batch.
+    """
+
+    def __init__(self, registry, batch_size=100):
+        self.registry = registry
+        self.batch_size = batch_size
+        self.pending = []
+        self.written = 0
+
+    def add(self, video_id, hash_value, fingerprint=None):
+        self.pending.append((video_id, hash_value, fingerprint))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.registry.add_many(self.pending)
+            self.written += len(self.pending)
+            self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
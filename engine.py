@@ -0,0 +1,194 @@
+import asyncio
+import concurrent.futures
+import subprocess
+import threading
+from collections import deque
+
+# ============================================================
+# ASYNC PROCESS ENGINE
+# ============================================================
+#
+# Every ffmpeg/ffprobe call goes through one asyncio loop running on a
+# background thread. The loop owns the child processes, so it can enforce
+# per-call timeouts and kill every running child on cancel, while the sync
+# facade (AsyncEngine.run) keeps the existing blocking functions working
+# from any thread.
+
+# Upper bound on child processes running at once across the whole program
+DEFAULT_MAX_CONCURRENCY = 32
+
+# Seconds between SIGTERM and SIGKILL when stopping a child
+KILL_GRACE_SECONDS = 3.0
+
+# Bytes per stdout read when streaming output to a callback
+STDOUT_CHUNK_SIZE = 1024 * 1024
+
+# Default timeout for ffprobe calls (ffmpeg jobs default to no timeout)
+PROBE_TIMEOUT = 60.0
+
+
+class JobCancelled(Exception):
+    """Raised when work is stopped by AsyncEngine.cancel_all"""
+
+
+class JobTimeout(Exception):
+    """Raised when a process runs longer than its timeout"""
+
+
+class ProcessResult:
+    def __init__(self, returncode, stdout, stderr):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class AsyncEngine:
+    """asyncio subprocess runner with timeouts, bounded concurrency and cancellation"""
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="ffmpeg-engine", daemon=True)
+        self.thread.start()
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        # Callbacks (hashing, disk writes, progress parsing) run here, so the
+        # loop thread only moves bytes and timeouts/cancels stay responsive
+        self.callbacks = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="engine-callback")
+        self.cancelled = threading.Event()
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    # ---------------- async API ----------------
+
+    async def run_async(self, cmd, timeout=None, on_stderr_line=None, on_stdout_chunk=None, capture_stdout=True):
+        """Run cmd and return a ProcessResult
+
+        Args:
+            timeout: Seconds before the process is killed and JobTimeout raised
+            on_stderr_line: Called with each stderr line (str) as it arrives;
+                stderr then holds only the last 50 lines
+            on_stdout_chunk: Called with each stdout chunk (bytes) as it arrives
+            capture_stdout: Keep stdout in the result (ignored with on_stdout_chunk)
+
+        Callbacks run in order on the engine's callback pool, never on the
+        loop thread, so a slow one only holds back its own process.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            if self.cancelled.is_set():
+                raise JobCancelled()
+            want_stdout = capture_stdout or on_stdout_chunk is not None
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE if want_stdout else subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    self._communicate(process, on_stderr_line, on_stdout_chunk), timeout
+                )
+            except asyncio.TimeoutError:
+                await self._kill(process)
+                raise JobTimeout(f"timed out after {timeout}s: {cmd[0]}")
+            except asyncio.CancelledError:
+                await self._kill(process)
+                raise
+            return ProcessResult(process.returncode, stdout, stderr)
+
+    async def _communicate(self, process, on_stderr_line, on_stdout_chunk):
+        loop = asyncio.get_running_loop()
+
+        async def read_stdout():
+            if process.stdout is None:
+                return b""
+            if on_stdout_chunk is None:
+                return await process.stdout.read()
+            while True:
+                chunk = await process.stdout.read(STDOUT_CHUNK_SIZE)
+                if not chunk:
+                    return b""
+                await loop.run_in_executor(self.callbacks, on_stdout_chunk, chunk)
+
+        async def read_stderr():
+            if on_stderr_line is None:
+                return (await process.stderr.read()).decode(errors="replace")
+            tail = deque(maxlen=50)
+            while True:
+                line = await process.stderr.readline()
+                if not line:
+                    return "".join(tail)
+                text = line.decode(errors="replace")
+                tail.append(text)
+                await loop.run_in_executor(self.callbacks, on_stderr_line, text)
+
+        stdout, stderr = await asyncio.gather(read_stdout(), read_stderr())
+        await process.wait()
+        return stdout, stderr
+
+    async def _kill(self, process):
+        if process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    # ---------------- sync facade ----------------
+
+    def run(self, cmd, timeout=None, on_stderr_line=None, on_stdout_chunk=None, capture_stdout=True):
+        """Blocking wrapper around run_async, safe to call from any thread
+
+        Raises:
+            JobCancelled if cancel_all was called before or during the run
+            JobTimeout if the process exceeded timeout
+        """
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        future = asyncio.run_coroutine_threadsafe(
+            self.run_async(cmd, timeout, on_stderr_line, on_stdout_chunk, capture_stdout), self.loop
+        )
+        with self._lock:
+            self._futures.add(future)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise JobCancelled()
+        finally:
+            with self._lock:
+                self._futures.discard(future)
+
+    def cancel_all(self):
+        """Stop all running processes and refuse new ones until reset()"""
+        self.cancelled.set()
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def reset(self):
+        self.cancelled.clear()
+
+    def shutdown(self):
+        self.cancel_all()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=KILL_GRACE_SECONDS + 1)
+        self.callbacks.shutdown(wait=False)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Shared engine used by the ffmpeg/ffprobe helpers"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncEngine()
+        return _engine
@@ -1,12 +1,22 @@
-import subprocess
 import os
+import json
+import shutil
+import struct
 import random
 import string
 import argparse
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
-from hash_demo import get_video_hash
+from hash_demo import HashingWriter, cached_file_hash, file_fingerprint, find_duplicate_files, fingerprint_many, get_video_hash, hash_many
+import mp4_meta
+from manifest import JobManifest
+from progress import BatchTelemetry, ProgressParser, format_eta
+from engine import PROBE_TIMEOUT, JobCancelled, JobTimeout, get_engine
+import tuning
+from data import OutputCache, default_cache_root
 
 # ============================================================
 # LOGGING SETUP
@@ -33,18 +43,18 @@ def setup_logging(output_folder):
 # HELPER FUNCTIONS
 # ============================================================
 
-def random_string(length=8):
+def random_string(length=8, rng=random):
     """Generate random alphanumeric string"""
     characters = string.ascii_letters + string.digits
-    return ''.join(random.choices(characters, k=length))
+    return ''.join(rng.choices(characters, k=length))
 
 
-def random_date():
-    """Generate random date within past 30 days"""
-    days_ago = random.randint(1, 30)
-    hours = random.randint(0, 23)
-    minutes = random.randint(0, 59)
-    date = datetime.now() - timedelta(days=days_ago, hours=hours, minutes=minutes)
+def random_date(rng=random, now=None):
+    """Generate random date within the 30 days before now (default: the current time)"""
+    days_ago = rng.randint(1, 30)
+    hours = rng.randint(0, 23)
+    minutes = rng.randint(0, 59)
+    date = (now or datetime.now()) - timedelta(days=days_ago, hours=hours, minutes=minutes)
     return date.strftime("%Y-%m-%dT%H:%M:%S.000000Z")
 
 def random_transform():
@@ -67,8 +77,12 @@ def random_transform():
 # VIDEO INFO FUNCTIONS
 # ============================================================
 
-def get_video_info(filepath):
-    """Get video metadata using ffprobe"""
+# ffprobe is mostly process startup, so probing many files is spread over threads
+DEFAULT_PROBE_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+
+
+def run_ffprobe(filepath):
+    """Run ffprobe and return its parsed JSON (None if it failed)"""
     cmd = [
         "ffprobe",
         "-v", "quiet",
@@ -77,11 +91,139 @@ def get_video_info(filepath):
         "-show_streams",
         filepath
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    try:
+        result = get_engine().run(cmd, timeout=PROBE_TIMEOUT)
+    except JobTimeout as e:
+        print(f"Error: ffprobe {e}")
+        return None
     if result.returncode != 0:
         print(f"Error: {result.stderr}")
         return None
-    return result.stdout
+    return json.loads(result.stdout)
+
+
+# Containers mp4_meta.probe can read without starting ffprobe
+NATIVE_PROBE_EXTENSIONS = {".mp4", ".m4v", ".mov"}
+
+
+def probe_file(filepath):
+    """ffprobe-style info, read natively from the MP4 header when possible
+
+    Anything the native parser can't handle (other containers, fragmented
+    or damaged files) goes to ffprobe instead.
+    """
+    if os.path.splitext(filepath)[1].lower() in NATIVE_PROBE_EXTENSIONS:
+        try:
+            return mp4_meta.probe(filepath)
+        except (mp4_meta.MP4Error, struct.error, IndexError, ValueError, OSError):
+            pass
+    return run_ffprobe(filepath)
+
+
+def get_video_info(filepath, use_cache=True):
+    """Get video metadata (native MP4 header parse, else ffprobe)
+
+    Parsed results are kept in the probe cache and reused until the
+    file's size or mtime changes.
+    """
+    if not use_cache:
+        return probe_file(filepath)
+    from data import get_probe_cache
+    cache = get_probe_cache()
+    info = cache.get(filepath)
+    if info is None:
+        info = probe_file(filepath)
+        if info is not None:
+            cache.put(filepath, info)
+    return info
+
+
+def probe_many(filepaths, max_workers=DEFAULT_PROBE_WORKERS):
+    """Probe many files, in parallel and only for cache misses
+
+    Returns:
+        dict of filepath -> parsed ffprobe info (None if probing failed)
+    """
+    from data import get_probe_cache
+    cache = get_probe_cache()
+    infos = {}
+    misses = []
+    for filepath in filepaths:
+        info = cache.get(filepath)
+        infos[filepath] = info
+        if info is None:
+            misses.append(filepath)
+    
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses)))) as pool:
+            for filepath, info in zip(misses, pool.map(probe_file, misses)):
+                infos[filepath] = info
+                if info is not None:
+                    cache.put(filepath, info)
+    return infos
+
+
+def summarize_probe(info):
+    """Pull the commonly used fields out of ffprobe info"""
+    if not info:
+        return None
+    fmt = info.get("format", {})
+    streams = info.get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"), {})
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), {})
+    
+    fps = None
+    rate = video.get("avg_frame_rate") or video.get("r_frame_rate")
+    if rate and "/" in rate:
+        num, den = rate.split("/")
+        if float(den):
+            fps = float(num) / float(den)
+    
+    def _number(value, cast=float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return None
+    
+    return {
+        "duration": _number(fmt.get("duration")),
+        "size": _number(fmt.get("size"), int),
+        "bit_rate": _number(fmt.get("bit_rate"), int),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "fps": fps,
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "tags": fmt.get("tags", {}),
+    }
+
+
+def get_keyframe_times(filepath, timeout=None):
+    """Presentation times (seconds) of the first video stream's keyframes
+
+    Reads packet flags only, so nothing is decoded.
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        filepath
+    ]
+    result = get_engine().run(cmd, timeout=timeout)
+    if result.returncode != 0:
+        print(f"Error: {result.stderr}")
+        return []
+    times = []
+    for line in result.stdout.decode(errors="replace").splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                times.append(float(pts))
+            except ValueError:
+                continue
+    return sorted(times)
 
 
 def get_video_files(folder_path):
@@ -94,11 +236,34 @@ def get_video_files(folder_path):
     return video_files
 
 
+def iter_video_files(folder_path, recursive=True):
+    """Yield mp4 files under a folder as they are found
+
+    Walks with os.scandir (one directory open at a time, no full listing
+    held in memory) and skips hidden files such as staging outputs.
+    """
+    pending = [folder_path]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending.append(entry.path)
+                    elif entry.name.endswith(".mp4") and entry.is_file():
+                        yield entry.path
+        except OSError as e:
+            print(f"Error reading {current}: {e}")
+
+
 # ============================================================
 # VIDEO PROCESSING FUNCTIONS
 # ============================================================
 
-def copy_video(input_path, output_path):
+def copy_video(input_path, output_path, timeout=None):
     """Copy video with new container"""
     cmd = [
         "ffmpeg",
@@ -107,16 +272,30 @@ def copy_video(input_path, output_path):
         "-y",
         output_path
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Error: {result.stderr}")
+    returncode, log = run_ffmpeg(cmd, timeout=timeout)
+    if returncode != 0:
+        print(f"Error: {log}")
         return False
     print(f"Created: {output_path}")
     return True
 
 
-def modify_metadata(input_path, output_path, title, comment):
+def write_metadata_native(input_path, output_path, tags, creation_time=None):
+    """Rewrite MP4 tags without ffmpeg (see mp4_meta); False if unsupported"""
+    try:
+        mp4_meta.write_metadata(input_path, output_path, tags, creation_time=creation_time)
+        return True
+    except (mp4_meta.MP4Error, OSError, ValueError, struct.error):
+        return False
+
+
+def modify_metadata(input_path, output_path, title, comment, timeout=None):
     """Copy video with custom metadata"""
+    # Fast path: edit the tags in place, falling back to an ffmpeg remux
+    if write_metadata_native(input_path, output_path, {"title": title, "comment": comment}):
+        print(f"Created: {output_path}")
+        return True
+    
     cmd = [
         "ffmpeg",
         "-i", input_path,
@@ -126,97 +305,537 @@ def modify_metadata(input_path, output_path, title, comment):
         "-y",
         output_path
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Error: {result.stderr}")
+    returncode, log = run_ffmpeg(cmd, timeout=timeout)
+    if returncode != 0:
+        print(f"Error: {log}")
         return False
     print(f"Created: {output_path}")
     return True
 
 
-def create_variation(input_path, output_path, reencode=False, use_filter=False, use_audio=False):
+def plan_streams(reencode=False, use_filter=False, use_audio=False):
+    """Decide per stream whether to encode or stream-copy
+
+    Video encoding is by far the most expensive part, so video is only
+    encoded for a full re-encode or a visual filter, and audio only for a
+    full re-encode or an audio filter. Everything else is copied.
+    
+    Returns:
+        dict with "video" and "audio" set to an encoder name or "copy"
+    """
+    return {
+        "video": "libx264" if reencode or use_filter else "copy",
+        "audio": "aac" if reencode or use_audio else "copy",
+    }
+
+
+def describe_plan(plan):
+    return f"video={plan['video']} audio={plan['audio']}"
+
+
+def random_variation_params(reencode=False, use_filter=False, use_audio=False, rng=random, now=None):
+    """Draw every random setting for one variation up front
+
+    Drawing in the calling thread keeps the random sequence identical
+    no matter how many jobs later run in parallel.
+
+    Args:
+        rng: Random source (a seeded random.Random for reproducible params)
+        now: Reference time for the creation date (default: the current time)
+    """
+    title = f"vid_{random_string(rng=rng)}"
+    comment = random_string(16, rng=rng)
+    date = random_date(rng=rng, now=now)
+    author = f"user_{random_string(6, rng=rng)}"
+    params = {
+        "title": title,
+        "comment": comment,
+        "date": date,
+        "author": author,
+        "description": f"Video created on {date[:10]}",
+        "copyright": f"Copyright {rng.randint(2020, 2026)}",
+        "artist": f"creator_{random_string(6, rng=rng)}",
+        "crf": None,
+        "preset": None,
+        "filter": None,
+        "audio": None,
+        "audio_bitrate": None,
+        "plan": plan_streams(reencode, use_filter, use_audio),
+    }
+
+    plan = params["plan"]
+    if plan["video"] != "copy":
+        params["crf"] = rng.randint(20, 28)
+        preset_options = ["fast", "medium", "slow"]
+        params["preset"] = rng.choice(preset_options)
+        if use_filter:
+            params["filter"] = random_filter(rng)
+    if plan["audio"] != "copy":
+        if use_audio:
+            params["audio"] = random_audio(rng)
+        params["audio_bitrate"] = rng.choice([128, 160, 192])
+
+    return params
+
+
+# Seeded runs without a reference date count back from a day drawn from
+# this window by the seed, so a rerun on any later day draws the same
+# params (and so hits the output cache)
+SEEDED_REFERENCE_START = datetime(2024, 1, 1)
+SEEDED_REFERENCE_DAYS = 730
+
+
+def seeded_reference(seed):
+    """Stable default reference date for a seed"""
+    days = random.Random(f"{seed}:reference").randrange(SEEDED_REFERENCE_DAYS)
+    return SEEDED_REFERENCE_START + timedelta(days=days)
+
+
+def seeded_variation_params(seed, job_key, reencode=False, use_filter=False, use_audio=False, reference=None):
+    """Reproducible params for one job: the same seed and job key always give the same draw
+
+    Each job gets its own generator, so the result doesn't depend on which
+    other jobs are planned or in what order.
+
+    Args:
+        seed: Batch seed
+        job_key: Stable name of the job (e.g. "clip_var_002")
+        reference: Date the creation dates count back from (default:
+            seeded_reference(seed), the same on every day)
+    """
+    if reference is None:
+        reference = seeded_reference(seed)
+    rng = random.Random(f"{seed}:{job_key}")
+    return random_variation_params(reencode, use_filter, use_audio, rng=rng, now=reference)
+
+
+def run_ffmpeg(cmd, on_progress=None, timeout=None):
+    """Run an ffmpeg command on the async engine, optionally reporting live progress
+
+    Args:
+        cmd: Full ffmpeg command
+        on_progress: Called with each parsed -progress snapshot (see progress.ProgressParser)
+        timeout: Seconds before ffmpeg is killed and engine.JobTimeout raised
+    Returns:
+        (returncode, ffmpeg's log output)
+    """
+    if on_progress is None:
+        result = get_engine().run(cmd, timeout=timeout, capture_stdout=False)
+        return result.returncode, result.stderr
+    
+    cmd = [cmd[0], "-progress", "pipe:2", "-nostats"] + cmd[1:]
+    parser = ProgressParser(on_progress)
+    result = get_engine().run(cmd, timeout=timeout, on_stderr_line=parser.feed, capture_stdout=False)
+    return result.returncode, parser.log()
+
+
+_ffmpeg_version = None
+
+
+def ffmpeg_version():
+    """First line of `ffmpeg -version` (None if it can't be run), read once per process"""
+    global _ffmpeg_version
+    if _ffmpeg_version is None:
+        try:
+            result = get_engine().run(["ffmpeg", "-version"], timeout=PROBE_TIMEOUT)
+            lines = result.stdout.decode(errors="replace").splitlines()
+            _ffmpeg_version = lines[0] if result.returncode == 0 and lines else ""
+        except (OSError, JobTimeout):
+            _ffmpeg_version = ""
+    return _ffmpeg_version or None
+
+
+def output_cache_key(input_path, params, stream_hash=False, segment_seconds=None):
+    """OutputCache key for a job: source content, every parameter and the ffmpeg build"""
+    options = {"stream_hash": stream_hash}
+    if params["plan"]["video"] != "copy" and segment_seconds:
+        options["segment_seconds"] = segment_seconds
+    return OutputCache.make_key(cached_file_hash(input_path), params, ffmpeg_version(), options)
+
+
+def create_variation(input_path, output_path, reencode=False, use_filter=False, use_audio=False, compute_hash=True, params=None, threads=None, stream_hash=False, on_progress=None, timeout=None, segment_seconds=None, cache=None):
     """Create video with randomized metadata and encoding
     
     Args:
         input_path: Source video file
         output_path: Output video file
         reencode: If True, fully re-encode (slower but deeper uniqueness)
-        use_filter: if True apply random visual filter (requires reencode=True)
+        use_filter: If True apply random visual filter (re-encodes video only)
+        use_audio: If True apply random audio filter (re-encodes audio only)
+        compute_hash: If False, leave "hash" as None so the caller can hash in bulk
+        params: Pre-drawn settings from random_variation_params (drawn here if None)
+        threads: libx264 thread budget for this job (None lets x264 decide)
+        stream_hash: If True, pipe ffmpeg's output through Python and hash it
+            while writing (fragmented MP4), so the file is never re-read
+        on_progress: Called with live ffmpeg progress snapshots (frame, fps, speed, ...)
+        timeout: Seconds before ffmpeg is killed (raises engine.JobTimeout)
+        segment_seconds: If set, sources at least twice this long have their
+            video encoded in keyframe-aligned chunks of about this length in
+            parallel (see create_variation_segmented)
+        cache: data.OutputCache; an identical earlier job is linked into place
+            instead of running ffmpeg, and new outputs are added to it
     Returns:
         dict with path, hash, title or None if failed
     """
-    # Generate random metadata
-    title = f"vid_{random_string()}"
-    comment = random_string(16)
-    date = random_date()
-    author = f"user_{random_string(6)}"
-    description = f"Video created on {date[:10]}"
-    copyright_text = f"Copyright {random.randint(2020, 2026)}"
-    artist = f"creator_{random_string(6)}"
+    # Copy-mode jobs may never start a process, so check for cancel up front
+    if get_engine().cancelled.is_set():
+        raise JobCancelled()
+    if params is None:
+        params = random_variation_params(reencode, use_filter, use_audio)
+    
+    if cache is not None:
+        key = output_cache_key(input_path, params, stream_hash, segment_seconds)
+        hit = cache.serve(key, output_path)
+        if hit:
+            print(f"Cache hit ({hit['method']}): {output_path}")
+            video_hash = hit["hash"] or (get_video_hash(output_path) if compute_hash else None)
+            result = report_variation(output_path, params, video_hash)
+            result["cached"] = hit["method"]
+            return result
+        result = create_variation(input_path, output_path, reencode, use_filter, use_audio, compute_hash, params, threads, stream_hash, on_progress, timeout, segment_seconds)
+        if result:
+            cache.put(key, output_path, result["hash"])
+        return result
+    
+    if segment_seconds and params["plan"]["video"] != "copy":
+        duration = (summarize_probe(get_video_info(input_path)) or {}).get("duration") or 0
+        if duration >= 2 * segment_seconds:
+            return create_variation_segmented(input_path, output_path, params, segment_seconds, compute_hash=compute_hash, threads=threads, stream_hash=stream_hash, on_progress=on_progress, timeout=timeout)
     
     # Build ffmpeg command
-    cmd = [
-        "ffmpeg",
-        "-i", input_path,
-        "-metadata", f"title={title}",
-        "-metadata", f"comment={comment}",
-        "-metadata", f"creation_time={date}",
-        "-metadata", f"author={author}",
-        "-metadata", f"description={description}",
-        "-metadata", f"copyright={copyright_text}",
-        "-metadata", f"artist={artist}",
-    ]
+    cmd = ["ffmpeg", "-i", input_path] + metadata_args(params)
     
-    # Add encoding and filtering settings
-    filter_info = None
-    if reencode:
-        crf = random.randint(20, 28)
-        preset_options = ["fast", "medium", "slow"]
-        preset = random.choice(preset_options)
-
+    # Add encoding and filtering settings, stream by stream
+    plan = params["plan"]
+    if plan["video"] != "copy" or plan["audio"] != "copy":
         # Add visual filter if requested
-        if use_filter:
-            filter_info = random_filter()
-            cmd.extend(["-vf", filter_info["filter_string"]])
+        if params["filter"]:
+            cmd.extend(["-vf", params["filter"]["filter_string"]])
         
         # Add audio filter if requested
-        if use_audio:
-            audio_info = random_audio()
-            cmd.extend(["-af", audio_info["filter_string"]])
+        if params["audio"]:
+            cmd.extend(["-af", params["audio"]["filter_string"]])
         
-        cmd.extend([
-            "-c:v", "libx264",
-            "-crf", str(crf),
-            "-preset", preset,
-            "-c:a", "aac",
-            "-b:a", f"{random.choice([128, 160, 192])}k"
-        ])
+        cmd.extend(encoder_args(params, threads))
     else:
+        # Metadata-only job: rewrite the tags natively unless the output must be streamed
+        if not stream_hash:
+            tags = {key: params[key] for key in ("title", "comment", "author", "description", "copyright", "artist")}
+            if write_metadata_native(input_path, output_path, tags, creation_time=params["date"]):
+                video_hash = get_video_hash(output_path) if compute_hash else None
+                return report_variation(output_path, params, video_hash)
         cmd.extend(["-c", "copy"])
     
+    if stream_hash:
+        video_hash = run_ffmpeg_hashed(cmd, output_path, on_progress=on_progress, timeout=timeout)
+        if video_hash:
+            return report_variation(output_path, params, video_hash)
+        print(f"Error creating {output_path}")
+        return None
+    
     cmd.extend(["-y", output_path])
     
     # Run ffmpeg
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    
-    # Check result
-    if os.path.exists(output_path):
-        video_hash = get_video_hash(output_path)
-        mode = "re-encoded" if reencode else "copied"
-        print(f"Created ({mode}): {output_path}")
-        print(f"  Title:  {title}")
-        print(f"  Author: {author}")
-        if reencode:
-            print(f"  CRF:    {crf}, Preset: {preset}")
-        if filter_info:
-            print(f" Filter: B={filter_info['brightness']}, C={filter_info['contrast']}, S={filter_info['saturation']}, G={filter_info['gamma']}")
-        if use_audio:
-            print(f" Audio: Vol={audio_info['volume']}, Tempo={audio_info['tempo']}")
-        print(f"  Hash:   {video_hash[:16]}...")
-        return {"path": output_path, "hash": video_hash, "title": title}
-    else:
-        print(f"Error creating {output_path}")
+    returncode, log = run_ffmpeg(cmd, on_progress, timeout=timeout)
+    
+    # ffmpeg creates the output before encoding, so a failed run leaves a partial file
+    if returncode != 0 or not os.path.exists(output_path):
+        print(f"Error creating {output_path}: {log}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    video_hash = get_video_hash(output_path) if compute_hash else None
+    return report_variation(output_path, params, video_hash)
+
+
+def run_ffmpeg_hashed(cmd, output_path, on_progress=None, timeout=None):
+    """Run an ffmpeg command (without its output file) writing MP4 to a pipe
+
+    The stream is teed to output_path and SHA-256 as it arrives. A pipe
+    can't be seeked back to write the moov box, so the MP4 is fragmented.
+    
+    Returns:
+        hex digest, or None if ffmpeg failed (the partial file is removed)
+    """
+    cmd = cmd + [
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4",
+        "pipe:1"
+    ]
+    cmd = [cmd[0], "-progress", "pipe:2", "-nostats"] + cmd[1:]
+    parser = ProgressParser(on_progress)
+    writer = HashingWriter(output_path)
+    try:
+        result = get_engine().run(cmd, timeout=timeout, on_stderr_line=parser.feed, on_stdout_chunk=writer.write)
+    except (JobTimeout, JobCancelled):
+        writer.close()
+        os.remove(output_path)
+        raise
+    writer.close()
+    
+    if result.returncode != 0 or writer.written == 0:
+        print(f"Error: {parser.log()}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
         return None
+    return writer.hexdigest()
+
+
+# Threads per chunk encoder in segmented mode (x264 scales best at a few threads)
+SEGMENT_ENCODER_THREADS = 2
+
+
+def choose_segment_times(keyframes, segment_seconds):
+    """Keyframe times to cut at, roughly every segment_seconds"""
+    cuts = []
+    target = segment_seconds
+    for time_point in keyframes:
+        if time_point >= target:
+            cuts.append(time_point)
+            target = time_point + segment_seconds
+    return cuts
+
+
+def create_variation_segmented(input_path, output_path, params, segment_seconds, compute_hash=True, threads=None, stream_hash=False, on_progress=None, timeout=None):
+    """Encode one variation's video as parallel keyframe-aligned chunks
+
+    1. The source video is stream-copied into chunks that start on keyframes
+    2. Each chunk is encoded with the variation's exact filter, CRF and preset
+    3. The encoded chunks are joined with the concat demuxer (no re-encode),
+       while audio and metadata come from the original source in that same
+       final pass, so audio is processed in one continuous piece
+    
+    Args:
+        params: random_variation_params dict (video must be encoded)
+        segment_seconds: Target chunk length
+        threads: Total thread budget for this variation, split between chunk
+            encoders (None = all cores)
+    Returns:
+        create_variation-style result, or None if any step failed
+    """
+    keyframes = get_keyframe_times(input_path, timeout=timeout)
+    cuts = choose_segment_times(keyframes, segment_seconds)
+    if not cuts:
+        # Too few keyframes to split, so encode in one piece
+        return create_variation(input_path, output_path, params=params, compute_hash=compute_hash, threads=threads, stream_hash=stream_hash, on_progress=on_progress, timeout=timeout)
+    
+    budget = threads or os.cpu_count() or 1
+    workers = max(1, min(len(cuts) + 1, budget // SEGMENT_ENCODER_THREADS))
+    chunk_threads = max(1, budget // workers)
+    work_dir = os.path.join(os.path.dirname(output_path) or ".", f".{os.path.basename(output_path).lstrip('.')}.segments")
+    os.makedirs(work_dir, exist_ok=True)
+    
+    try:
+        # 1. Split at the keyframes (a hair early, so rounding can't skip one)
+        source_pattern = os.path.join(work_dir, "source_%04d.mp4")
+        split_cmd = [
+            "ffmpeg", "-i", input_path,
+            "-map", "0:v:0", "-c", "copy",
+            "-f", "segment",
+            "-segment_times", ",".join(f"{max(cut - 0.001, 0):.6f}" for cut in cuts),
+            "-segment_format", "mp4",
+            "-reset_timestamps", "1",
+            "-y", source_pattern
+        ]
+        returncode, log = run_ffmpeg(split_cmd, timeout=timeout)
+        sources = sorted(os.path.join(work_dir, name) for name in os.listdir(work_dir) if name.startswith("source_"))
+        if returncode != 0 or not sources:
+            print(f"Error splitting {input_path}: {log}")
+            return None
+        
+        # 2. Encode chunks in parallel, reporting summed progress
+        done_seconds = [0.0] * len(sources)
+        
+        def encode_chunk(index):
+            chunk_path = os.path.join(work_dir, f"encoded_{index:04d}.mp4")
+            cmd = ["ffmpeg", "-i", sources[index], "-map", "0:v:0", "-fps_mode", "passthrough"]
+            if params["filter"]:
+                cmd.extend(["-vf", params["filter"]["filter_string"]])
+            cmd.extend(["-c:v", params["plan"]["video"], "-crf", str(params["crf"]), "-preset", params["preset"], "-threads", str(chunk_threads)])
+            cmd.extend(["-y", chunk_path])
+            
+            def chunk_progress(snapshot):
+                if snapshot.get("out_seconds") is not None:
+                    done_seconds[index] = snapshot["out_seconds"]
+                on_progress(dict(snapshot, out_seconds=sum(done_seconds)))
+            
+            returncode, log = run_ffmpeg(cmd, chunk_progress if on_progress else None, timeout=timeout)
+            if returncode != 0 or not os.path.exists(chunk_path):
+                print(f"Error encoding chunk {index} of {output_path}: {log}")
+                return None
+            return chunk_path
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(encode_chunk, range(len(sources))))
+        if not all(chunks):
+            return None
+        
+        # 3. Join video losslessly; take audio and tags from the source
+        list_path = os.path.join(work_dir, "chunks.txt")
+        with open(list_path, "w") as f:
+            for chunk in chunks:
+                f.write(f"file '{os.path.basename(chunk)}'\n")
+        cmd = [
+            "ffmpeg",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", input_path,
+            "-map", "0:v:0", "-map", "1:a:0?",
+        ] + metadata_args(params)
+        if params["audio"]:
+            cmd.extend(["-af", params["audio"]["filter_string"]])
+        # Chunks are already encoded, so the final pass only copies video
+        cmd.extend(encoder_args(dict(params, plan=dict(params["plan"], video="copy"))))
+        
+        if stream_hash:
+            video_hash = run_ffmpeg_hashed(cmd, output_path, timeout=timeout)
+            return report_variation(output_path, params, video_hash) if video_hash else None
+        
+        cmd.extend(["-y", output_path])
+        returncode, log = run_ffmpeg(cmd, timeout=timeout)
+        if returncode != 0 or not os.path.exists(output_path):
+            print(f"Error creating {output_path}: {log}")
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return None
+        video_hash = get_video_hash(output_path) if compute_hash else None
+        return report_variation(output_path, params, video_hash)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def create_variations_single_decode(input_path, output_paths, params_list, has_audio=True, compute_hash=True, threads=None, on_progress=None, timeout=None):
+    """Re-encode several variations of one source with a single ffmpeg run
+
+    The source is decoded once and fanned out with split/asplit into one
+    encoder per output, each with its own metadata, CRF, preset and filters.
+    
+    Args:
+        input_path: Source video file
+        output_paths: One output file per variation
+        params_list: Matching random_variation_params dicts (video must be encoded)
+        has_audio: Whether the source has an audio stream to carry over
+        threads: libx264 thread budget per output encoder
+        on_progress: Called with live ffmpeg progress snapshots for the whole run
+        timeout: Seconds before ffmpeg is killed (raises engine.JobTimeout)
+    Returns:
+        list of create_variation-style results (None for failed outputs)
+    """
+    count = len(output_paths)
+    graph = []
+    
+    # Video: split once, then apply each output's own filter
+    video_labels = [f"v{i}" for i in range(count)]
+    graph.append("[0:v]split=" + str(count) + "".join(f"[{label}]" for label in video_labels))
+    video_maps = []
+    for i, params in enumerate(params_list):
+        if params["filter"]:
+            graph.append(f"[v{i}]{params['filter']['filter_string']}[vo{i}]")
+            video_maps.append(f"[vo{i}]")
+        else:
+            video_maps.append(f"[v{i}]")
+    
+    # Audio: only worth a split when some output filters it
+    audio_maps = ["0:a?"] * count
+    if has_audio and any(params["audio"] for params in params_list):
+        audio_labels = [f"a{i}" for i in range(count)]
+        graph.append("[0:a]asplit=" + str(count) + "".join(f"[{label}]" for label in audio_labels))
+        for i, params in enumerate(params_list):
+            if params["audio"]:
+                graph.append(f"[a{i}]{params['audio']['filter_string']}[ao{i}]")
+                audio_maps[i] = f"[ao{i}]"
+            else:
+                audio_maps[i] = f"[a{i}]"
+    
+    cmd = ["ffmpeg", "-i", input_path, "-filter_complex", ";".join(graph)]
+    for output_path, params, video_map, audio_map in zip(output_paths, params_list, video_maps, audio_maps):
+        cmd.extend(["-map", video_map, "-map", audio_map])
+        cmd.extend(metadata_args(params))
+        cmd.extend(encoder_args(params, threads))
+        cmd.extend(["-y", output_path])
+    
+    # Run ffmpeg
+    returncode, log = run_ffmpeg(cmd, on_progress, timeout=timeout)
+    
+    # A failed run may have left every output partially written
+    results = []
+    for output_path, params in zip(output_paths, params_list):
+        if returncode == 0 and os.path.exists(output_path):
+            video_hash = get_video_hash(output_path) if compute_hash else None
+            results.append(report_variation(output_path, params, video_hash))
+        else:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            results.append(None)
+    if returncode != 0:
+        print(f"Error creating {', '.join(output_paths)}: {log}")
+    return results
+
+
+def metadata_args(params):
+    """ffmpeg -metadata options for one variation's tags"""
+    return [
+        "-metadata", f"title={params['title']}",
+        "-metadata", f"comment={params['comment']}",
+        "-metadata", f"creation_time={params['date']}",
+        "-metadata", f"author={params['author']}",
+        "-metadata", f"description={params['description']}",
+        "-metadata", f"copyright={params['copyright']}",
+        "-metadata", f"artist={params['artist']}",
+    ]
+
+
+def encoder_args(params, threads=None):
+    """ffmpeg codec options for one variation, following its stream plan"""
+    plan = params["plan"]
+    if plan["video"] == "copy":
+        args = ["-c:v", "copy"]
+    else:
+        args = [
+            "-c:v", plan["video"],
+            "-crf", str(params["crf"]),
+            "-preset", params["preset"],
+        ]
+        if threads:
+            args.extend(["-threads", str(threads)])
+    if plan["audio"] == "copy":
+        args.extend(["-c:a", "copy"])
+    else:
+        args.extend([
+            "-c:a", plan["audio"],
+            "-b:a", f"{params['audio_bitrate']}k"
+        ])
+    return args
+
+
+def report_variation(output_path, params, video_hash=None):
+    """Print one variation's settings and return its result dict"""
+    filter_info = params["filter"]
+    audio_info = params["audio"]
+    plan = params["plan"]
+    if plan["video"] != "copy" and plan["audio"] != "copy":
+        mode = "re-encoded"
+    elif plan["video"] != "copy":
+        mode = "video re-encoded"
+    elif plan["audio"] != "copy":
+        mode = "audio re-encoded"
+    else:
+        mode = "copied"
+    # Build the report first so parallel jobs don't interleave lines
+    lines = [
+        f"Created ({mode}): {output_path}",
+        f"  Title:  {params['title']}",
+        f"  Author: {params['author']}",
+    ]
+    if plan["video"] != "copy":
+        lines.append(f"  CRF:    {params['crf']}, Preset: {params['preset']}")
+    if filter_info:
+        lines.append(f" Filter: B={filter_info['brightness']}, C={filter_info['contrast']}, S={filter_info['saturation']}, G={filter_info['gamma']}")
+    if audio_info:
+        lines.append(f" Audio: Vol={audio_info['volume']}, Tempo={audio_info['tempo']}")
+    if video_hash:
+        lines.append(f"  Hash:   {video_hash[:16]}...")
+    print("\n".join(lines))
+    return {"path": output_path, "hash": video_hash, "title": params["title"]}
 
 
 # ============================================================
@@ -224,70 +843,544 @@ def create_variation(input_path, output_path, reencode=False, use_filter=False,
 # ============================================================
 
 def is_duplicate_hash(new_hash, hash_list):
-    """Check if hash already exists"""
+    """Check if hash already exists
+
+    hash_list can be any container; pass a set or data.DedupIndex for O(1) checks.
+    """
     return new_hash in hash_list
 
 
-def batch_create_variations(input_folder, output_folder, variations_per_video=3, reencode=False, use_filter=False, use_audio=False):
-    """Create multiple variations from all videos in a folder"""
+def default_jobs(reencode=False):
+    """Pick a worker count for the machine
+
+    Copy jobs are I/O bound and barely use a core each, so they get one
+    worker per core (capped). Re-encode jobs get a few cores apiece.
+    """
+    cores = os.cpu_count() or 1
+    if reencode:
+        return max(1, cores // 4)
+    return min(cores, 8)
+
+
+def encoder_thread_budget(jobs):
+    """Split the cores between parallel encodes so jobs x threads ~= cores"""
+    if jobs <= 1:
+        return None
+    cores = os.cpu_count() or 1
+    return max(1, cores // jobs)
+
+
+def plan_variation_jobs(source_videos, output_folder, variations_per_video, reencode=False, use_filter=False, use_audio=False, seed=None, reference=None, name_prefix=""):
+    """Expand sources into an ordered job list with pre-drawn parameters
+
+    With a seed, every job's params come from seeded_variation_params keyed
+    by its output name, so the same seed reproduces the same jobs.
+    name_prefix is put in front of every output name (e.g. to keep sources
+    with the same filename from different folders apart).
+    """
+    jobs = []
+    for video_path in source_videos:
+        filename = os.path.basename(video_path)
+        name_without_ext = os.path.splitext(filename)[0]
+        
+        for i in range(variations_per_video):
+            job_key = f"{name_prefix}{name_without_ext}_var_{i+1:03d}"
+            if seed is None:
+                params = random_variation_params(reencode, use_filter, use_audio)
+            else:
+                params = seeded_variation_params(seed, job_key, reencode, use_filter, use_audio, reference=reference)
+            jobs.append({
+                "input_path": video_path,
+                "output_path": f"{output_folder}/{job_key}.mp4",
+                "params": params,
+            })
+    return jobs
+
+
+def apply_manifest(manifest, planned):
+    """Line planned jobs up with the output folder's job manifest
+
+    New jobs are recorded as planned. Jobs the manifest already has get
+    back the params they were first planned with, so a resumed run
+    produces the same outputs.
+    
+    Returns:
+        list of (job, state) for jobs the manifest has as done
+    """
+    done = []
+    for job in planned:
+        job_id = os.path.basename(job["output_path"])
+        state = manifest.get(job_id)
+        if state is None:
+            manifest.record_plan(job_id, job)
+            continue
+        job["params"] = state["params"]
+        if state["status"] == "done":
+            done.append((job, state))
+    return done
+
+
+def output_cache_enabled(use_cache, seed):
+    """Whether the output cache can be used for a run with this seed"""
+    if use_cache and seed is None:
+        logging.warning("Output cache disabled: without a seed every job draws new params, so no output could ever be reused")
+        return False
+    return use_cache
+
+
+# Plan files written by a dry run (batch_create_variations(dry_run=True))
+PLAN_NAME = "batch_plan.json"
+PLAN_VERSION = 1
+
+
+def save_plan(path, plan):
+    """Write a plan atomically (temp file + rename)"""
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(temp, path)
+
+
+def load_plan(path):
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path}: unsupported plan version {plan.get('version')}")
+    return plan
+
+
+def staging_path(output_path, tag=None):
+    """Hidden temp name an output is written to before its atomic rename
+
+    Args:
+        tag: Extra name part (e.g. worker and attempt) so writers that may
+            overlap on the same output never share a temp file
+    """
+    folder, filename = os.path.split(output_path)
+    name, ext = os.path.splitext(filename)
+    if tag:
+        name = f"{name}.{tag}"
+    return os.path.join(folder, f".{name}.part{ext}")
+
+
+def _timed(func, *args, **kwargs):
+    started = time.time()
+    outcome = func(*args, **kwargs)
+    return outcome, started, time.time() - started
+
+
+def run_variation_jobs(jobs, reencode=False, use_filter=False, use_audio=False, max_workers=1, single_decode=False, audio_sources=None, stream_hash=False, compute_hash=False, on_result=None, telemetry=None, timeout=None, segment_seconds=None, cache=None):
+    """Run planned jobs on a worker pool
+
+    Every output is written to a staging file and atomically renamed into
+    place once ffmpeg succeeds, so a crash never leaves a partial output
+    under its final name.
+    
+    Args:
+        single_decode: If True (re-encode only), run one ffmpeg per source that
+            decodes once and writes all of that source's variations
+        audio_sources: Set of source paths known to have audio (None = assume all)
+        stream_hash: Hash each output while ffmpeg writes it (see create_variation)
+        compute_hash: Hash each output in its worker as soon as it is written
+        on_result: Called as on_result(index, result, started, elapsed) on the
+            calling thread as each job finishes
+        telemetry: progress.BatchTelemetry keyed by job index, fed live ffmpeg progress
+        timeout: Per-process timeout in seconds; a job that hits it counts as failed
+        segment_seconds: Encode long sources as parallel chunks (see create_variation)
+        cache: data.OutputCache to serve repeat jobs from (not used with single_decode)
+    Returns:
+        list of create_variation results in job order (None for failed jobs)
+    """
+    plan = plan_streams(reencode, use_filter, use_audio)
+    threads = encoder_thread_budget(max_workers) if plan["video"] != "copy" else None
+    total = len(jobs)
+    results = [None] * total
+    done = 0
+    
+    # Each task covers one or more job indices
+    tasks = []
+    if single_decode and plan["video"] != "copy":
+        groups = {}
+        for index, job in enumerate(jobs):
+            groups.setdefault(job["input_path"], []).append(index)
+        for input_path, indices in groups.items():
+            has_audio = audio_sources is None or input_path in audio_sources
+            # The process runs one encoder per output, so share this slot's threads
+            per_output = max(1, threads // len(indices)) if threads else None
+            tasks.append((indices, create_variations_single_decode, (
+                input_path,
+                [staging_path(jobs[i]["output_path"]) for i in indices],
+                [jobs[i]["params"] for i in indices],
+            ), {"has_audio": has_audio, "compute_hash": compute_hash, "threads": per_output, "timeout": timeout}))
+    else:
+        for index, job in enumerate(jobs):
+            tasks.append(([index], create_variation, (job["input_path"], staging_path(job["output_path"])), {
+                "reencode": reencode, "use_filter": use_filter, "use_audio": use_audio,
+                "compute_hash": compute_hash, "params": job["params"], "threads": threads,
+                "stream_hash": stream_hash, "timeout": timeout, "segment_seconds": segment_seconds,
+                "cache": cache,
+            }))
+    
+    def run_task(indices, func, args, kwargs):
+        # Jobs still queued when the batch is cancelled are skipped
+        if get_engine().cancelled.is_set():
+            return [None] * len(indices) if len(indices) > 1 else None, time.time(), 0.0
+        if telemetry:
+            for index in indices:
+                telemetry.job_started(index)
+            
+            def on_progress(snapshot):
+                for index in indices:
+                    telemetry.job_progress(index, snapshot)
+            kwargs = dict(kwargs, on_progress=on_progress)
+        started = time.time()
+        try:
+            return _timed(func, *args, **kwargs)
+        except JobTimeout as e:
+            logging.warning(f"  ⏱ {os.path.basename(jobs[indices[0]]['output_path'])}: {e}")
+        except JobCancelled:
+            pass
+        failed = [None] * len(indices) if len(indices) > 1 else None
+        return failed, started, time.time() - started
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(run_task, indices, func, args, kwargs): indices for indices, func, args, kwargs in tasks}
+        for future in as_completed(futures):
+            indices = futures[future]
+            outcome, started, elapsed = future.result()
+            if len(indices) == 1 and not isinstance(outcome, list):
+                outcome = [outcome]
+            for index, result in zip(indices, outcome):
+                final_path = jobs[index]["output_path"]
+                temp_path = staging_path(final_path)
+                if result:
+                    os.replace(temp_path, final_path)
+                    result["path"] = final_path
+                elif os.path.exists(temp_path):
+                    os.remove(temp_path)
+                results[index] = result
+                if telemetry:
+                    telemetry.job_finished(index, ok=bool(result))
+                if on_result:
+                    on_result(index, result, started, elapsed)
+                done += 1
+                progress = (done / total) * 100
+                eta = f" ETA {format_eta(telemetry.snapshot()['eta_seconds'])}" if telemetry else ""
+                logging.info(f"[{done}/{total}] ({progress:.1f}%){eta} {os.path.basename(final_path)} [{describe_plan(jobs[index]['params']['plan'])}]")
+    
+    return results
+
+
+def create_source_variations(video_path, output_folder, variations_per_video=3, reencode=False, use_filter=False, use_audio=False, jobs=1, dedup=None, timeout=None, name_prefix=""):
+    """Create, dedup and register the variations of a single source
+
+    The building block for long-running services that get sources one at a
+    time instead of as a folder snapshot.
+    
+    Args:
+        dedup: Shared data.DedupIndex (a fresh one over the registry if None;
+            services should pass one so the registry is only scanned once)
+        name_prefix: Put in front of every output name (see plan_variation_jobs)
+    Returns:
+        list of unique results that were registered
+    """
+    from data import DedupIndex, get_registry
+    if dedup is None:
+        dedup = DedupIndex(get_registry())
+    
+    planned = plan_variation_jobs([video_path], output_folder, variations_per_video, reencode=reencode, use_filter=use_filter, use_audio=use_audio, name_prefix=name_prefix)
+    outcomes = run_variation_jobs(planned, reencode=reencode, use_filter=use_filter, use_audio=use_audio, max_workers=jobs, compute_hash=True, timeout=timeout)
+    
+    results = []
+    fingerprints = fingerprint_many(result["path"] for result in outcomes if result and result["hash"])
+    with get_registry().writer() as writer:
+        for result in outcomes:
+            if not result or not result["hash"]:
+                continue
+            video_id = os.path.basename(result["path"])
+            if not dedup.claim(result["hash"], video_id=video_id):
+                logging.warning(f"  ⚠ DUPLICATE DETECTED: {result['path']}")
+                continue
+            writer.add(video_id, result["hash"], fingerprints.get(result["path"]))
+            results.append(result)
+    return results
+
+
+def batch_create_variations(input_folder, output_folder, variations_per_video=3, reencode=False, use_filter=False, use_audio=False, jobs=1, single_decode=False, stream_hash=False, resume=False, progress_callback=None, timeout=None, deadline=None, min_speed=None, segment_seconds=None, dedupe_sources=True, seed=None, reference=None, use_cache=False, cache_bytes=None, cache_dir=None, dry_run=False, plan_path=None, from_plan=None):
+    """Create multiple variations from all videos in a folder
+
+    Args:
+        jobs: Parallel ffmpeg processes (0 picks a count from the CPU cores)
+        single_decode: Decode each source once for all of its re-encoded variations
+        stream_hash: Hash outputs while ffmpeg writes them instead of re-reading
+            them afterwards (not combined with single_decode)
+        resume: Reuse the output folder's job manifest, skipping jobs whose
+            output still matches the recorded hash
+        progress_callback: Called with batch telemetry snapshots (fraction,
+            ETA, throughput) from worker threads while jobs run
+        timeout: Per-job ffmpeg timeout in seconds (None = no limit)
+        deadline: Wall-clock seconds the batch should finish in; presets (then
+            CRF) are stepped down using the measured speed model until it fits
+        min_speed: Minimum realtime factor each re-encode must reach
+        segment_seconds: Split sources longer than twice this into keyframe-aligned
+            chunks encoded in parallel (not combined with single_decode)
+        dedupe_sources: Skip sources that are byte-identical copies of an
+            earlier source in the folder
+        seed: Derive every job's params from this seed (reproducible runs)
+        reference: datetime creation dates count back from in seeded runs
+        use_cache: Serve jobs identical to earlier ones (same source content,
+            params and ffmpeg build) from the output cache, and cache new outputs.
+            Needs a seed: unseeded params never repeat, so it is turned off without one
+        cache_bytes: Output cache size limit (default: data.output_cache.DEFAULT_MAX_BYTES)
+        cache_dir: Output cache folder (default: data.default_cache_root(output_folder),
+            on the output filesystem so hits are links, not copies)
+        dry_run: Probe and plan only: estimate each job's CPU time, wall time,
+            output size and disk headroom, write the plan to plan_path and
+            return it without running anything
+        plan_path: Where a dry run writes its plan (default: PLAN_NAME in output_folder)
+        from_plan: A loaded dry-run plan to execute (see run_plan) instead of
+            scanning input_folder and drawing new params
+    Returns:
+        list of registered results (the plan dict for a dry run)
+    Raises:
+        engine.JobCancelled if get_engine().cancel_all() stopped the batch;
+        finished jobs are still saved to the manifest and registry first
+    """
 
     # Setup
     os.makedirs(output_folder, exist_ok=True)
     log_file = setup_logging(output_folder)
-    source_videos = get_video_files(input_folder)
+    if from_plan is not None:
+        # Sources were scanned and deduplicated when the plan was made
+        source_videos = list(dict.fromkeys(job["input_path"] for job in from_plan["jobs"]))
+    else:
+        source_videos = get_video_files(input_folder)
+    
+    # Identical copies of a source would only produce more of the same variations
+    duplicate_sources = find_duplicate_files(source_videos) if dedupe_sources and from_plan is None else {}
+    source_videos = [path for path in source_videos if path not in duplicate_sources]
+    
+    # Probe sources in parallel (cached) and drop anything ffprobe can't read
+    probes = probe_many(source_videos)
+    invalid = [path for path in source_videos if probes[path] is None]
+    source_videos = [path for path in source_videos if probes[path] is not None]
+    source_seconds = sum((summarize_probe(probes[path])["duration"] or 0) for path in source_videos)
     
     total_videos = len(source_videos) * variations_per_video
-    mode = "re-encode" if reencode else "copy"
+    plan = plan_streams(reencode, use_filter, use_audio)
+    mode = "re-encode" if reencode else ("partial re-encode" if plan["video"] != "copy" or plan["audio"] != "copy" else "copy")
     filter_status = "ON" if use_filter else "OFF"
     audio_status = "ON" if use_audio else "OFF"
+    if not jobs:
+        jobs = default_jobs(plan["video"] != "copy")
+    threads = encoder_thread_budget(jobs) if plan["video"] != "copy" else None
+    if from_plan is None:
+        use_cache = output_cache_enabled(use_cache, seed)
 
     # Print header
     logging.info("=" * 50)
     logging.info("BATCH VIDEO VARIATION")
     logging.info("=" * 50)
-    logging.info(f"Source videos: {len(source_videos)}")
+    logging.info(f"Source videos: {len(source_videos)} ({source_seconds / 60:.1f} min)")
+    if invalid:
+        logging.warning(f"Skipped unreadable sources: {len(invalid)}")
+        for path in invalid:
+            logging.warning(f"  {path}")
+    if duplicate_sources:
+        logging.info(f"Skipped duplicate sources: {len(duplicate_sources)}")
+        for path, original in duplicate_sources.items():
+            logging.info(f"  {os.path.basename(path)} = {os.path.basename(original)}")
     logging.info(f"Variations each: {variations_per_video}")
     logging.info(f"Total to create: {total_videos}")
+    if single_decode and plan["video"] != "copy":
+        mode += " (single decode per source)"
+    elif segment_seconds and plan["video"] != "copy":
+        mode += f" (long sources in ~{segment_seconds:g}s parallel chunks)"
     logging.info(f"Mode: {mode}")
+    logging.info(f"Stream plan: {describe_plan(plan)}")
     logging.info(f"Visual filter: {filter_status}")
     logging.info(f"Audio filter: {audio_status}")
+    logging.info(f"Parallel jobs: {jobs}" + (f" x {threads} encoder threads" if threads else ""))
+    if seed is not None:
+        logging.info(f"Seed: {seed}")
+    if use_cache:
+        logging.info(f"Output cache: {cache_dir or default_cache_root(output_folder)}")
+    if from_plan is not None:
+        logging.info(f"Plan: {from_plan['path']} ({len(from_plan['jobs'])} jobs)")
+    if dry_run:
+        logging.info("Dry run: planning only")
     logging.info(f"Log file: {log_file}")
     logging.info("=" * 50)
     
     # Process videos
-    all_hashes = []
+    from data import DedupIndex, get_registry
+    all_hashes = DedupIndex(get_registry())
     results = []
     duplicates = 0
-    current = 0
     
-    for video_path in source_videos:
-        filename = os.path.basename(video_path)
-        name_without_ext = os.path.splitext(filename)[0]
-        
-        for i in range(variations_per_video):
-            current += 1
-            progress = (current / total_videos) * 100
-            
-            logging.info(f"[{current}/{total_videos}] ({progress:.1f}%)")
-            
-            output_path = f"{output_folder}/{name_without_ext}_var_{i+1:03d}.mp4"
-            result = create_variation(video_path, output_path, reencode=reencode, use_filter=use_filter, use_audio=use_audio)
-            
-            if result:
-                if is_duplicate_hash(result["hash"], all_hashes):
-                    logging.warning("  ⚠ DUPLICATE DETECTED!")
-                    duplicates += 1
-                else:
-                    all_hashes.append(result["hash"])
-                    results.append(result)
-    
-    # Save hashes to database
-    from data import load_hashes, save_hashes
-    hashes_dict = load_hashes()
-    for r in results:
-        video_id = os.path.basename(r["path"])
-        hashes_dict[video_id] = r["hash"]
-    save_hashes(hashes_dict)
+    # A dry run reads an earlier run's manifest (with resume) but never writes it
+    manifest = JobManifest(output_folder, resume=resume, read_only=dry_run)
+    if from_plan is not None:
+        valid = set(source_videos)
+        planned = [{key: job[key] for key in ("input_path", "output_path", "params")} for job in from_plan["jobs"] if job["input_path"] in valid]
+    else:
+        planned = plan_variation_jobs(source_videos, output_folder, variations_per_video, reencode=reencode, use_filter=use_filter, use_audio=use_audio, seed=seed, reference=reference)
+    
+    # Split into finished jobs (from an earlier run) and jobs still to run
+    skipped = {}
+    finished = [(job, state) for job, state in apply_manifest(manifest, planned) if os.path.exists(job["output_path"])]
+    
+    # A finished job only counts if its output still has the recorded hash
+    digests = hash_many([job["output_path"] for job, _ in finished])
+    for job, state in finished:
+        if digests[job["output_path"]] == state["hash"]:
+            skipped[job["output_path"]] = {"path": job["output_path"], "hash": state["hash"], "title": job["params"]["title"]}
+    pending = [job for job in planned if job["output_path"] not in skipped]
+    if resume:
+        logging.info(f"Resuming: {len(skipped)} jobs already done, {len(pending)} to run")
+    
+    # Fit presets/CRF to the time budget using speeds measured on past runs
+    speed_model = tuning.SpeedModel()
+    shapes = [tuning.job_shape(summarize_probe(probes[job["input_path"]])) for job in pending]
+    encoder_threads = threads or os.cpu_count() or 1
+    if plan["video"] != "copy" and (deadline or min_speed):
+        before = [(job["params"]["preset"], job["params"]["crf"]) for job in pending]
+        predicted = tuning.apply_budget(pending, shapes, jobs, encoder_threads, speed_model, deadline=deadline, min_speed=min_speed)
+        changed = 0
+        for job, (preset, crf) in zip(pending, before):
+            if (job["params"]["preset"], job["params"]["crf"]) != (preset, crf):
+                manifest.record_plan(os.path.basename(job["output_path"]), job)
+                changed += 1
+        budget = f"deadline {format_eta(deadline)}" if deadline else ""
+        if min_speed:
+            budget += (", " if budget else "") + f"min {min_speed}x realtime"
+        logging.info(f"Budget: {budget} -> predicted {format_eta(predicted)}, {changed} jobs adjusted")
+    
+    # Cost of the jobs still to run, from the same calibrated model
+    infos = [summarize_probe(probes[job["input_path"]]) for job in pending]
+    estimates, estimated = tuning.estimate_batch(pending, infos, jobs, encoder_threads, speed_model, free_bytes=shutil.disk_usage(output_folder).free)
+    logging.info(f"Estimate: {format_eta(estimated['wall_seconds'])} wall at {jobs} jobs, "
+                 f"{format_eta(estimated['cpu_seconds'])} CPU, {estimated['output_bytes'] / 1024 ** 3:.2f} GB output "
+                 f"({estimated['free_bytes'] / 1024 ** 3:.2f} GB free)")
+    if estimates and estimates[-1]["headroom_bytes"] < 0:
+        short = next(i for i, e in enumerate(estimates) if e["headroom_bytes"] < 0)
+        logging.warning(f"Estimated output exceeds free disk space from job {short + 1} ({os.path.basename(pending[short]['output_path'])})")
+    
+    if dry_run:
+        plan_path = plan_path or os.path.join(output_folder, PLAN_NAME)
+        options = {
+            "input_folder": input_folder, "output_folder": output_folder, "variations_per_video": variations_per_video,
+            "reencode": reencode, "use_filter": use_filter, "use_audio": use_audio, "jobs": jobs,
+            "single_decode": single_decode, "stream_hash": stream_hash, "segment_seconds": segment_seconds,
+            "seed": seed, "use_cache": use_cache, "cache_bytes": cache_bytes, "cache_dir": cache_dir,
+        }
+        new_plan = {
+            "version": PLAN_VERSION,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "options": options,
+            "encoder_threads": encoder_threads,
+            # Jobs already done in the manifest were left out, so the run must resume it
+            "resume": resume,
+            "skipped_sources": {"unreadable": invalid, "duplicates": duplicate_sources},
+            "jobs": [dict(job, estimate=estimate) for job, estimate in zip(pending, estimates)],
+            "totals": estimated,
+        }
+        save_plan(plan_path, new_plan)
+        logging.info("")
+        for job, estimate in zip(pending, estimates):
+            logging.info(f"  {os.path.basename(job['output_path'])}: {format_eta(estimate['wall_seconds'])} "
+                         f"(starts +{format_eta(estimate['start'])}), {estimate['output_bytes'] / 1024 ** 2:.1f} MB, "
+                         f"{estimate['headroom_bytes'] / 1024 ** 3:.2f} GB headroom")
+        logging.info(f"Plan written to {plan_path}")
+        return new_plan
+    
+    actual_seconds = {}
+    
+    # Outputs are registered as their jobs finish, so a crash or cancel
+    # keeps every registration made so far (one small commit per job is
+    # noise next to an ffmpeg run)
+    writer = get_registry().writer(batch_size=1)
+    registered = set()
+    
+    def register(result):
+        video_id = os.path.basename(result["path"])
+        if all_hashes.claim(result["hash"], video_id=video_id):
+            writer.add(video_id, result["hash"], file_fingerprint(result["path"]))
+            registered.add(result["path"])
+    
+    # Outputs kept from an earlier run come first, in planned order
+    for job in planned:
+        if job["output_path"] in skipped:
+            register(skipped[job["output_path"]])
+    
+    def record(index, result, started, elapsed):
+        job = pending[index]
+        job_id = os.path.basename(job["output_path"])
+        if result and result["hash"]:
+            manifest.mark_done(job_id, result["hash"], started, elapsed)
+            register(result)
+            # Cache hits ran no encode, and single-decode runs share one process
+            # between outputs, so neither timing says anything about speed
+            if result.get("cached") or single_decode:
+                return
+            actual_seconds[index] = elapsed
+            size = os.path.getsize(result["path"])
+            if job["params"]["plan"]["video"] != "copy":
+                duration, width, height, fps = shapes[index]
+                speed_model.record(job["params"]["preset"], width, height, fps, encoder_threads, job["params"]["crf"], duration, elapsed)
+                speed_model.record_output(job["params"], infos[index], size)
+            elif job["params"]["plan"]["audio"] == "copy":
+                speed_model.record_copy(infos[index]["size"], elapsed)
+        else:
+            manifest.mark_failed(job_id, started, elapsed)
+    
+    # Live progress: weight each job by its source duration
+    durations = {index: summarize_probe(probes[job["input_path"]])["duration"] for index, job in enumerate(pending)}
+    metrics_file = os.path.splitext(log_file)[0] + ".metrics.jsonl"
+    
+    def log_progress(snapshot):
+        if progress_callback:
+            progress_callback(snapshot)
+    
+    telemetry = BatchTelemetry(durations, metrics_path=metrics_file, on_update=log_progress)
+    
+    audio_sources = {path for path in source_videos if summarize_probe(probes[path])["audio_codec"]}
+    cache = None
+    if use_cache:
+        from data import get_output_cache
+        cache = get_output_cache(cache_dir or default_cache_root(output_folder), cache_bytes)
+        # Hash each source once up front rather than in every job's worker
+        for path in source_videos:
+            cached_file_hash(path)
+    run_started = time.perf_counter()
+    cpu_before = os.times()
+    try:
+        outcomes = run_variation_jobs(pending, reencode=reencode, use_filter=use_filter, use_audio=use_audio, max_workers=jobs, single_decode=single_decode, audio_sources=audio_sources, stream_hash=stream_hash, compute_hash=True, on_result=record, telemetry=telemetry, timeout=timeout, segment_seconds=segment_seconds, cache=cache)
+    finally:
+        writer.flush()
+    run_seconds = time.perf_counter() - run_started
+    cpu_after = os.times()
+    run_cpu = (cpu_after.children_user - cpu_before.children_user) + (cpu_after.children_system - cpu_before.children_system)
+    run_bytes = sum(os.path.getsize(result["path"]) for result in outcomes if result and os.path.exists(result["path"]))
+    manifest.close()
+    throughput = telemetry.close()
+    speed_model.save()
+    
+    # How far off the per-job predictions were (actual / estimated)
+    ratios = sorted(actual_seconds[i] / estimates[i]["wall_seconds"] for i in actual_seconds if estimates[i]["wall_seconds"] > 0)
+    
+    # Report in planned order; registration already decided which outputs
+    # were new (of two identical outputs, the one that finished first)
+    outcome_by_path = {job["output_path"]: result for job, result in zip(pending, outcomes)}
+    for job in planned:
+        result = skipped.get(job["output_path"]) or outcome_by_path.get(job["output_path"])
+        if not result or not result["hash"]:
+            continue
+        if result["path"] in registered:
+            results.append(result)
+        else:
+            logging.warning(f"  ⚠ DUPLICATE DETECTED: {result['path']}")
+            duplicates += 1
     
     # Print summary
     logging.info("")
@@ -297,18 +1390,41 @@ def batch_create_variations(input_folder, output_folder, variations_per_video=3,
     logging.info(f"Total created: {len(results)}")
     logging.info(f"Duplicates: {duplicates}")
     logging.info(f"Unique videos: {len(all_hashes)}")
-    logging.info(f"Saved to hashes.json")
+    if throughput["realtime_factor"] is not None:
+        logging.info(f"Throughput: {throughput['videos_per_minute']} videos/min, {throughput['realtime_factor']}x realtime")
+    logging.info(f"Estimated vs actual: wall {format_eta(estimated['wall_seconds'])} / {format_eta(run_seconds)}, "
+                 f"CPU {format_eta(estimated['cpu_seconds'])} / {format_eta(run_cpu)}, "
+                 f"output {estimated['output_bytes'] / 1024 ** 3:.2f} / {run_bytes / 1024 ** 3:.2f} GB")
+    if ratios:
+        logging.info(f"Job time vs estimate: median {ratios[len(ratios) // 2]:.2f}x (range {ratios[0]:.2f}x-{ratios[-1]:.2f}x)")
+    logging.info(f"Metrics file: {metrics_file}")
+    logging.info(f"Saved to hash registry")
+    logging.info(f"Job manifest: {manifest.path}")
     logging.info(f"Log file: {log_file}")
     logging.info("=" * 50)
     
+    if get_engine().cancelled.is_set():
+        logging.warning("Batch cancelled")
+        raise JobCancelled()
     return results
 
-def random_filter():
+
+def run_plan(plan_path, resume=False, progress_callback=None, timeout=None):
+    """Execute a plan written by a dry run, with exactly its jobs and params
+
+    A plan made with resume always resumes, since it leaves out the jobs
+    the manifest already has as done.
+    """
+    plan = load_plan(plan_path)
+    plan["path"] = plan_path
+    return batch_create_variations(**plan["options"], resume=resume or plan.get("resume", False), progress_callback=progress_callback, timeout=timeout, from_plan=plan)
+
+def random_filter(rng=random):
     """Generate random subtle visual filter settings"""
-    brightness = round(random.uniform(-0.05, 0.05), 3)
-    contrast = round(random.uniform(0.95, 1.05), 3)
-    saturation = round(random.uniform(0.95, 1.05), 3)
-    gamma = round(random.uniform(0.95, 1.05), 3)
+    brightness = round(rng.uniform(-0.05, 0.05), 3)
+    contrast = round(rng.uniform(0.95, 1.05), 3)
+    saturation = round(rng.uniform(0.95, 1.05), 3)
+    gamma = round(rng.uniform(0.95, 1.05), 3)
 
     return {
         "brightness": brightness,
@@ -318,19 +1434,65 @@ def random_filter():
         "filter_string": f"eq=brightness={brightness}:contrast={contrast}:saturation={saturation}"
     }
 
-def random_audio():
+def random_audio(rng=random):
     """Generate random subtle audio settings"""
     # Volume: 0.9 to 1.1 (±10%)
-    volume = round(random.uniform(0.9, 1.1), 2)
+    volume = round(rng.uniform(0.9, 1.1), 2)
     
     # Tempo: 0.98 to 1.02 (±2% speed, subtle)
-    tempo = round(random.uniform(0.98, 1.02), 2)
+    tempo = round(rng.uniform(0.98, 1.02), 2)
     
     return {
         "volume": volume,
         "tempo": tempo,
         "filter_string": f"volume={volume},atempo={tempo}"
     }
+# ============================================================
+# COMMAND LINE
+# ============================================================
+
+def add_variation_arguments(parser):
+    """Options shared by the batch and pipeline command lines"""
+    parser.add_argument("-n", "--number", type=int, default=3, help="Variations per video (default: 3)")
+    parser.add_argument("-r", "--reencode", action="store_true", help="Re-encode videos (slower but deeper uniqueness)")
+    parser.add_argument("-f", "--filter", action="store_true", help="Apply visual filters (re-encodes video, copies audio)")
+    parser.add_argument("-a", "--audio", action="store_true", help="Apply audio variations (re-encodes audio, copies video)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Parallel ffmpeg jobs, 0 = auto from CPU cores (default: 1)")
+    parser.add_argument("-s", "--single-decode", action="store_true", help="Decode each source once for all its re-encoded variations")
+    parser.add_argument("-t", "--timeout", type=float, default=None, help="Kill any ffmpeg job running longer than this many seconds")
+    parser.add_argument("--segment", type=float, default=None, metavar="SECONDS", help="Encode long sources as parallel chunks of about this many seconds")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted run from the output folder's job manifest")
+    parser.add_argument("--keep-duplicate-sources", action="store_true", help="Process byte-identical source files separately")
+    parser.add_argument("--seed", help="Derive every job's parameters from this seed (reproducible runs)")
+    parser.add_argument("--reference-date", type=datetime.fromisoformat, default=None, help="Date seeded creation dates count back from, e.g. 2026-01-31 (default: a date derived from the seed)")
+    parser.add_argument("--cache", action="store_true", help="Reuse identical earlier outputs from the output cache")
+    parser.add_argument("--cache-size", type=float, default=None, metavar="GB", help="Output cache size limit in GB (default: 50)")
+    parser.add_argument("--cache-dir", default=None, help="Output cache folder (default: .output_cache next to the output folder)")
+
+
+def variation_options(parser, args):
+    """Keyword arguments for batch_create_variations/run_pipeline from add_variation_arguments"""
+    if args.cache and args.seed is None:
+        parser.error("--cache needs --seed (unseeded params never repeat, so nothing could be reused)")
+    return {
+        "variations_per_video": args.number,
+        "reencode": args.reencode,
+        "use_filter": args.filter,
+        "use_audio": args.audio,
+        "jobs": args.jobs,
+        "single_decode": args.single_decode,
+        "timeout": args.timeout,
+        "segment_seconds": args.segment,
+        "resume": args.resume,
+        "dedupe_sources": not args.keep_duplicate_sources,
+        "seed": args.seed,
+        "reference": args.reference_date,
+        "use_cache": args.cache,
+        "cache_bytes": int(args.cache_size * 1024 ** 3) if args.cache_size else None,
+        "cache_dir": args.cache_dir,
+    }
+
+
 # ============================================================
 # MAIN
 # ============================================================
@@ -338,27 +1500,32 @@ def random_audio():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Video Variation System")
     
-    parser.add_argument("input", help="Input folder with source videos")
-    parser.add_argument("output", help="Output folder for variations")
-    parser.add_argument("-n", "--number", type=int, default=3, help="Variations per video (default: 3)")
-    parser.add_argument("-r", "--reencode", action="store_true", help="Re-encode videos (slower but deeper uniqueness)")
-    parser.add_argument("-f", "--filter", action="store_true", help="Apply visual filters (requires --reencode)")
-    parser.add_argument("-a", "--audio", action="store_true", help="Apply audio variations (requires --reencode)")
+    parser.add_argument("input", nargs="?", help="Input folder with source videos")
+    parser.add_argument("output", nargs="?", help="Output folder for variations")
+    add_variation_arguments(parser)
+    parser.add_argument("--stream-hash", action="store_true", help="Hash outputs while they are written (fragmented MP4)")
+    parser.add_argument("--deadline", type=tuning.parse_duration, default=None, help="Finish the batch within this time, e.g. 2h or 90m (picks faster presets as needed)")
+    parser.add_argument("--min-speed", type=float, default=None, help="Minimum realtime factor per re-encode, e.g. 3 for 3x realtime")
+    parser.add_argument("--plan", nargs="?", const="", default=None, metavar="FILE", help=f"Dry run: estimate time, CPU and disk per job and write the plan (default: OUTPUT/{PLAN_NAME})")
+    parser.add_argument("--run-plan", metavar="FILE", help="Execute a plan written by --plan (input, output and options come from the plan)")
 
     args = parser.parse_args()
 
-    # If filter is requested, reencode must be on
-    if args.filter and not args.reencode:
-        print("Warning: --filter requires --reencode. Enabling re-encode.")
-        args.reencode = True
+    if args.run_plan:
+        run_plan(args.run_plan, resume=args.resume, timeout=args.timeout)
+        raise SystemExit(0)
+    if not args.input or not args.output:
+        parser.error("input and output are required unless --run-plan is given")
 
     results = batch_create_variations(
         input_folder=args.input,
         output_folder=args.output,
-        variations_per_video=args.number,
-        reencode=args.reencode,
-        use_filter=args.filter,
-        use_audio=args.audio
+        **variation_options(parser, args),
+        stream_hash=args.stream_hash,
+        deadline=args.deadline,
+        min_speed=args.min_speed,
+        dry_run=args.plan is not None,
+        plan_path=args.plan or None
     )
 
     
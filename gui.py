@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import threading
 from ffmpeg_utils import batch_create_variations
+from progress import format_eta
+from engine import JobCancelled, get_engine
 
 class VideoVariationGUI:
     def __init__(self, root):
@@ -66,12 +68,15 @@ class VideoVariationGUI:
         self.progress_label.pack(pady=5)
         
         # Progress bar
-        self.progress_bar = ttk.Progressbar(main_frame, mode="indeterminate", length=300)
+        self.progress_bar = ttk.Progressbar(main_frame, mode="determinate", length=300, maximum=100)
         self.progress_bar.pack(pady=5)
         
-        # Start button
+        # Start / Cancel buttons
+        button_frame = tk.Frame(main_frame)
+        button_frame.pack(pady=15)
+        
         self.start_btn = tk.Button(
-            main_frame, 
+            button_frame, 
             text="START PROCESSING", 
             command=self.start_processing, 
             bg="#28a745", 
@@ -81,7 +86,20 @@ class VideoVariationGUI:
             height=2,
             cursor="hand2"
         )
-        self.start_btn.pack(pady=15)
+        self.start_btn.pack(side="left", padx=5)
+        
+        self.cancel_btn = tk.Button(
+            button_frame,
+            text="CANCEL",
+            command=self.cancel_processing,
+            bg="#dc3545",
+            fg="white",
+            font=("Arial", 11, "bold"),
+            width=10,
+            height=2,
+            state="disabled"
+        )
+        self.cancel_btn.pack(side="left", padx=5)
     
     def browse_input(self):
         folder = filedialog.askdirectory()
@@ -98,15 +116,15 @@ class VideoVariationGUI:
             messagebox.showerror("Error", "Please select input and output folders")
             return
         
-        # Enable reencode if filters are selected
+        # Filters only re-encode the stream they touch, so reencode stays as chosen
         reencode = self.reencode.get()
-        if (self.use_filter.get() or self.use_audio.get()) and not reencode:
-            reencode = True
         
         # Update UI
         self.progress_label.config(text="Processing...")
-        self.progress_bar.start(10)
+        self.progress_bar.config(value=0)
         self.start_btn.config(state="disabled", bg="gray")
+        self.cancel_btn.config(state="normal")
+        get_engine().reset()
         
         # Run in thread to prevent GUI freeze
         thread = threading.Thread(target=self.run_batch, args=(reencode,))
@@ -120,22 +138,45 @@ class VideoVariationGUI:
                 variations_per_video=self.variations.get(),
                 reencode=reencode,
                 use_filter=self.use_filter.get(),
-                use_audio=self.use_audio.get()
+                use_audio=self.use_audio.get(),
+                progress_callback=lambda snapshot: self.root.after(0, lambda: self.on_progress(snapshot))
             )
             self.root.after(0, lambda: self.on_complete(len(results)))
+        except JobCancelled:
+            self.root.after(0, self.on_cancelled)
         except Exception as e:
             self.root.after(0, lambda: self.on_error(str(e)))
     
+    def on_progress(self, snapshot):
+        self.progress_bar.config(value=snapshot["fraction"] * 100)
+        text = f"{snapshot['jobs_done']}/{snapshot['jobs_total']} done · ETA {format_eta(snapshot['eta_seconds'])}"
+        if snapshot["realtime_factor"]:
+            text += f" · {snapshot['realtime_factor']:.1f}x"
+        self.progress_label.config(text=text)
+    
+    def cancel_processing(self):
+        # Kills the running ffmpeg processes; run_batch sees JobCancelled
+        self.progress_label.config(text="Cancelling...")
+        self.cancel_btn.config(state="disabled")
+        get_engine().cancel_all()
+    
+    def on_cancelled(self):
+        self.progress_label.config(text="Cancelled")
+        self.start_btn.config(state="normal", bg="#28a745")
+        self.cancel_btn.config(state="disabled")
+    
     def on_complete(self, count):
-        self.progress_bar.stop()
+        self.progress_bar.config(value=100)
         self.progress_label.config(text=f"Done! Created {count} videos")
         self.start_btn.config(state="normal", bg="#28a745")
+        self.cancel_btn.config(state="disabled")
         messagebox.showinfo("Complete", f"Successfully created {count} unique videos!")
     
     def on_error(self, error):
-        self.progress_bar.stop()
+        self.progress_bar.config(value=0)
         self.progress_label.config(text="Error occurred")
         self.start_btn.config(state="normal", bg="#28a745")
+        self.cancel_btn.config(state="disabled")
         messagebox.showerror("Error", error)
 
 
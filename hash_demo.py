@@ -1,51 +1,480 @@
+import argparse
 import hashlib
 import json
+import mmap
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import data
 
+# Read size for streaming hashes (1 MiB keeps RSS flat even for multi-GB files)
+DEFAULT_BUFFER_SIZE = 1024 * 1024
 
-def get_video_hash(filepath):
+# hashlib releases the GIL on large updates, so threads hash files in parallel
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# Sampled digests read this many blocks spread evenly over the file
+DEFAULT_SAMPLE_BLOCKS = 16
+DEFAULT_SAMPLE_BLOCK_SIZE = 64 * 1024
+
+
+def get_video_hash(filepath, buffer_size=DEFAULT_BUFFER_SIZE, use_mmap=False):
+    """Stream a file through SHA-256 in fixed-size chunks
+
+    Args:
+        filepath: File to hash
+        buffer_size: Bytes fed to the hasher per step
+        use_mmap: If True, hash through a read-only memory map instead of read()
+    Returns:
+        hex digest string
+    """
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if use_mmap and size > 0:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, buffer_size):
+                        hasher.update(view[offset:offset + buffer_size])
+                finally:
+                    view.release()
+        else:
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                read = file.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+    return hasher.hexdigest()
+
+
+class HashingWriter:
+    """File writer that hashes every chunk it writes (tee to disk and SHA-256)"""
+
+    def __init__(self, filepath):
+        self.file = open(filepath, "wb")
+        self.hasher = hashlib.sha256()
+        self.written = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.written += len(chunk)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+    def close(self):
+        self.file.close()
+
+
+def hash_many(filepaths, max_workers=DEFAULT_HASH_WORKERS, buffer_size=DEFAULT_BUFFER_SIZE, use_mmap=False):
+    """Hash many files at once on a thread pool
+
+    Returns:
+        dict of filepath -> hex digest (None if the file could not be read)
+    """
+    filepaths = list(filepaths)
+
+    def _hash(filepath):
+        try:
+            return get_video_hash(filepath, buffer_size=buffer_size, use_mmap=use_mmap)
+        except OSError as e:
+            print(f"Error hashing {filepath}: {e}")
+            return None
+
+    if not filepaths:
+        return {}
+    workers = max(1, min(max_workers, len(filepaths)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(_hash, filepaths))
+    return dict(zip(filepaths, digests))
+
+def get_sample_hash(filepath, blocks=DEFAULT_SAMPLE_BLOCKS, block_size=DEFAULT_SAMPLE_BLOCK_SIZE):
+    """Cheap fingerprint from fixed-offset blocks plus the file size
+
+    Reads at most blocks * block_size bytes (1 MiB by default) whatever the
+    file size, always including the first and last block. Equal sample
+    hashes don't prove equal files; different ones prove they differ.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
     with open(filepath, "rb") as file:
-        content = file.read()
-        result = hashlib.sha256(content)
-    return result.hexdigest()
+        size = os.fstat(file.fileno()).st_size
+        hasher.update(size.to_bytes(8, "little"))
+        if size <= blocks * block_size:
+            offsets = range(0, size, block_size)
+        else:
+            step = (size - block_size) / (blocks - 1)
+            offsets = [int(i * step) for i in range(blocks)]
+        for offset in offsets:
+            hasher.update(os.pread(file.fileno(), block_size, offset))
+    return hasher.hexdigest()
+
+
+def cached_file_hash(filepath):
+    """SHA-256 of a file, reused from the fingerprint cache while unchanged"""
+    st = os.stat(filepath)
+    cache = data.get_fingerprint_cache()
+    entry = cache.get(filepath, st.st_size, st.st_mtime_ns)
+    if entry and entry["sha256"]:
+        return entry["sha256"]
+    digest = get_video_hash(filepath)
+    cache.put(filepath, st.st_size, st.st_mtime_ns, sha256=digest)
+    return digest
+
+
+def find_duplicate_files(filepaths, max_workers=DEFAULT_HASH_WORKERS, use_cache=True):
+    """Find byte-identical files, reading as little as possible
+
+    Files are compared by size first, then by sampled hash within equal
+    sizes, and only files that still collide get a full SHA-256. Digests
+    are cached by path/size/mtime, so rescans of unchanged files read
+    nothing.
+
+    Returns:
+        dict of duplicate path -> the earlier path (in filepaths order) it copies
+    """
+    cache = data.get_fingerprint_cache() if use_cache else None
+    stats = {}
+    for filepath in filepaths:
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            continue
+        stats[filepath] = (st.st_size, st.st_mtime_ns)
+
+    def cached(filepath, field):
+        if cache is None:
+            return None
+        entry = cache.get(filepath, *stats[filepath])
+        return entry[field] if entry else None
+
+    def colliding(groups):
+        return [paths for paths in groups.values() if len(paths) > 1]
+
+    def group_by(paths, key):
+        groups = {}
+        for filepath in paths:
+            groups.setdefault(key(filepath), []).append(filepath)
+        return groups
+
+    # 1. Size
+    candidates = colliding(group_by(stats, lambda filepath: stats[filepath][0]))
+
+    # 2. Sampled blocks (cheap even for huge files)
+    paths = [filepath for group in candidates for filepath in group]
+    samples = {filepath: cached(filepath, "sample") for filepath in paths}
+    misses = [filepath for filepath, sample in samples.items() if sample is None]
+    if misses:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(misses)))) as pool:
+            for filepath, sample in zip(misses, pool.map(get_sample_hash, misses)):
+                samples[filepath] = sample
+                if cache is not None:
+                    cache.put(filepath, *stats[filepath], sample=sample)
+    candidates = [group for paths in candidates for group in colliding(group_by(paths, samples.get))]
+
+    # 3. Full hash only where everything else matched
+    paths = [filepath for group in candidates for filepath in group]
+    digests = {filepath: cached(filepath, "sha256") for filepath in paths}
+    misses = [filepath for filepath, digest in digests.items() if digest is None]
+    for filepath, digest in hash_many(misses, max_workers=max_workers).items():
+        digests[filepath] = digest
+        if cache is not None and digest is not None:
+            cache.put(filepath, *stats[filepath], sha256=digest)
+
+    duplicates = {}
+    for group in candidates:
+        for paths in colliding(group_by(group, digests.get)):
+            if digests[paths[0]] is None:
+                continue
+            for filepath in paths[1:]:
+                duplicates[filepath] = paths[0]
+    return duplicates
+
+
+class DuplicateTracker:
+    """Streaming find_duplicate_files: check files one by one as they are found
+
+    Same tiers (size, sampled hash, full SHA-256) and the same cache, but
+    for discovery that can't wait for the whole listing. Keeps one path
+    and stat per distinct file seen (the tracker's memory grows with the
+    number of distinct sources); hashes are only computed on size
+    collisions, and with the cache they are kept there, not in memory.
+    """
+
+    def __init__(self, use_cache=True):
+        self.cache = data.get_fingerprint_cache() if use_cache else None
+        self.by_size = {}
+        self.stats = {}
+        self.samples = {}
+        self.digests = {}
+
+    def _digest(self, filepath, field, compute, memo):
+        if self.cache is not None:
+            entry = self.cache.get(filepath, *self.stats[filepath])
+            value = entry[field] if entry else None
+            if value is None:
+                value = compute(filepath)
+                self.cache.put(filepath, *self.stats[filepath], **{field: value})
+            return value
+        if filepath not in memo:
+            memo[filepath] = compute(filepath)
+        return memo[filepath]
+
+    def check(self, filepath):
+        """Return the earlier path filepath duplicates, or None if it is new"""
+        st = os.stat(filepath)
+        self.stats[filepath] = (st.st_size, st.st_mtime_ns)
+        earlier = self.by_size.setdefault(st.st_size, [])
+        for other in earlier:
+            if self._digest(other, "sample", get_sample_hash, self.samples) != self._digest(filepath, "sample", get_sample_hash, self.samples):
+                continue
+            if self._digest(other, "sha256", get_video_hash, self.digests) == self._digest(filepath, "sha256", get_video_hash, self.digests):
+                del self.stats[filepath]
+                return other
+        earlier.append(filepath)
+        return None
+
+
+def file_fingerprint(filepath, sample=True):
+    """Cheap identity of a file's current state for the fast integrity tiers
+
+    Returns:
+        dict with size, mtime_ns, inode and (if sample) the sampled-block hash
+    """
+    st = os.stat(filepath)
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "inode": st.st_ino,
+        "sample": get_sample_hash(filepath) if sample else None,
+    }
+
+
+def fingerprint_many(filepaths, max_workers=DEFAULT_HASH_WORKERS):
+    """file_fingerprint for many files on a thread pool
+
+    Returns:
+        dict of filepath -> fingerprint (None if the file could not be read)
+    """
+    filepaths = list(filepaths)
+
+    def _fingerprint(filepath):
+        try:
+            return file_fingerprint(filepath)
+        except OSError:
+            return None
+
+    if not filepaths:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(filepaths)))) as pool:
+        return dict(zip(filepaths, pool.map(_fingerprint, filepaths)))
+
 
 def register_video(video_id, filepath):
-    # Get the hash
+    # Get the hash and the fingerprints the fast integrity tiers compare against
     hash_value = get_video_hash(filepath)
+    fingerprint = file_fingerprint(filepath)
 
-    # Load existing data (or empty dict)
-    hashes_dict = data.load_hashes()
+    # Write just this entry to the registry
+    data.get_registry().add(video_id, hash_value, fingerprint)
 
-    # Add new entry
-    hashes_dict[video_id] = hash_value
+    print(f"Registered {video_id} with hash {hash_value}")
 
-    # Save back to file
-    data.save_hashes(hashes_dict)
+def register_videos(videos, max_workers=DEFAULT_HASH_WORKERS):
+    """Hash and register many videos in one pass
 
-    print(f"Registered {video_id} with hash {hash_value}")
+    Args:
+        videos: dict of video_id -> filepath
+    Returns:
+        dict of video_id -> hash for the videos that were registered
+    """
+    digests = hash_many(videos.values(), max_workers=max_workers)
+    fingerprints = fingerprint_many(videos.values(), max_workers=max_workers)
+
+    registered = {}
+    entries = []
+    for video_id, filepath in videos.items():
+        hash_value = digests.get(filepath)
+        if hash_value is None:
+            continue
+        registered[video_id] = hash_value
+        entries.append((video_id, hash_value, fingerprints.get(filepath)))
+    data.get_registry().add_many(entries)
+
+    print(f"Registered {len(registered)} videos")
+    return registered
+
+def verify_video(video_id, filepath, strict=False, sample=True, registry=None):
+    """Check a file against its registry entry, cheapest test first
+
+    Tiers:
+        stat:   size, mtime and inode match what was recorded at registration
+        sample: the sampled-block hash matches too (if sample)
+        sha256: full re-hash, used in strict mode, for entries registered
+                without fingerprints, or when a cheaper tier disagrees
+                (e.g. a file restored from backup has a new mtime and inode)
+    A different size fails straight away, since the content must differ.
+    When the full hash confirms a file, its fingerprint is refreshed so the
+    next check takes the fast path again.
+
+    Returns:
+        dict with video_id, status ("ok", "modified" or "missing") and tier
+    Raises:
+        KeyError if video_id isn't registered
+    """
+    registry = registry or data.get_registry()
+    record = registry.get_record(video_id)
+    if record is None:
+        raise KeyError(video_id)
+
+    try:
+        current = file_fingerprint(filepath, sample=False)
+    except FileNotFoundError:
+        return {"video_id": video_id, "status": "missing", "tier": "stat"}
 
-def check_integrity(video_id, filepath):
-    # Load stored data
-    hashes_dict = data.load_hashes()
-    
-    # Get the stored hash for this video
-    stored_hash = hashes_dict[video_id]
+    has_fingerprint = record["size"] is not None
+    if has_fingerprint and not strict:
+        if current["size"] != record["size"]:
+            return {"video_id": video_id, "status": "modified", "tier": "stat"}
+        unchanged = current["mtime_ns"] == record["mtime_ns"] and current["inode"] == record["inode"]
+        if unchanged and not (sample and record["sample"]):
+            return {"video_id": video_id, "status": "ok", "tier": "stat"}
+        if unchanged:
+            current["sample"] = get_sample_hash(filepath)
+            if current["sample"] == record["sample"]:
+                return {"video_id": video_id, "status": "ok", "tier": "sample"}
 
     # Calculate Current hash
     current_hash = get_video_hash(filepath)
+    if current_hash != record["hash"]:
+        return {"video_id": video_id, "status": "modified", "tier": "sha256"}
+    current["sample"] = current["sample"] or get_sample_hash(filepath)
+    registry.set_fingerprint(video_id, current)
+    return {"video_id": video_id, "status": "ok", "tier": "sha256"}
 
-    # Compare and Return result
-    return stored_hash == current_hash
+def check_integrity(video_id, filepath, strict=False, sample=True):
+    """True if filepath still matches video_id's registered hash
 
-def list_registered_videos():
-    hashes_dict = data.load_hashes()
-    results = []
-    for key, value in hashes_dict.items():
-        results.append({"id": key, "hash": value})
-    return results
+    Uses the fast tiers of verify_video unless strict is set.
 
+    Raises:
+        KeyError if video_id isn't registered
+        FileNotFoundError if filepath doesn't exist
+    """
+    result = verify_video(video_id, filepath, strict=strict, sample=sample)
+    if result["status"] == "missing":
+        raise FileNotFoundError(filepath)
+    return result["status"] == "ok"
 
+def list_registered_videos(pattern=None, hash_prefix=None, offset=0, limit=None):
+    """Lazily yield {"id", "hash"} for registered videos
 
+    Args:
+        pattern: Glob on the video id, e.g. "clip_*"
+        hash_prefix: Only hashes starting with this hex prefix
+        offset: Entries to skip (for paging)
+        limit: Maximum entries (None = all)
+    """
+    for key, value in data.get_registry().iter_entries(pattern=pattern, hash_prefix=hash_prefix, offset=offset, limit=limit):
+        yield {"id": key, "hash": value}
+
+
+def disk_parallelism(path):
+    """Concurrent readers worth running against the disk holding path
+
+    Spinning disks thrash with more than a couple of readers, SSDs and
+    network storage keep improving up to DEFAULT_HASH_WORKERS. Falls back
+    to the SSD figure wherever /sys doesn't tell (non-Linux, overlays).
+    """
+    try:
+        dev = os.stat(path).st_dev
+        block = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+        # Partitions keep their queue settings on the parent device
+        for candidate in (block, os.path.dirname(block)):
+            rotational = os.path.join(candidate, "queue", "rotational")
+            if os.path.exists(rotational):
+                with open(rotational) as f:
+                    return 2 if f.read().strip() == "1" else DEFAULT_HASH_WORKERS
+    except (OSError, ValueError):
+        pass
+    return DEFAULT_HASH_WORKERS
+
+
+def verify_registry(roots, strict=False, sample=True, max_workers=None, pattern=None, on_result=None):
+    """Check every registered video against its file on disk
+
+    Entries are streamed from the registry and at most a few batches of
+    checks are in flight, so memory stays flat for any registry size.
+    A video's file is looked up as <root>/<video_id> in each root in turn.
+
+    Args:
+        roots: Folders holding the registered files
+        strict: Fully re-hash every file instead of using the fast tiers
+        sample: Use the sampled-block tier (see verify_video)
+        max_workers: Parallel checks (default: from disk_parallelism of the first root)
+        pattern: Only verify video ids matching this glob
+        on_result: Called with each verify_video result dict
+    Returns:
+        summary dict with ok/modified/missing/error counts, tiers used and
+        throughput (a file that can't be read counts as an error, with
+        the reason in its result's "error")
+    """
+    registry = data.get_registry()
+    if isinstance(roots, str):
+        roots = [roots]
+    workers = max_workers or disk_parallelism(roots[0])
+
+    def locate(video_id):
+        for root in roots:
+            candidate = os.path.join(root, video_id)
+            if os.path.exists(candidate):
+                return candidate
+        return os.path.join(roots[0], video_id)
+
+    def check(video_id):
+        filepath = locate(video_id)
+        # One unreadable file (permissions, I/O error, a directory) is
+        # reported on its own instead of aborting the whole run
+        try:
+            result = verify_video(video_id, filepath, strict=strict, sample=sample, registry=registry)
+            result["bytes"] = os.path.getsize(filepath) if result["status"] != "missing" else 0
+        except OSError as e:
+            return {"video_id": video_id, "status": "error", "tier": None, "bytes": 0, "error": str(e)}
+        return result
+
+    summary = {"ok": 0, "modified": 0, "missing": 0, "error": 0, "checked": 0, "bytes": 0, "tiers": {}}
+    started = time.perf_counter()
+
+    def collect(future):
+        result = future.result()
+        summary[result["status"]] += 1
+        summary["checked"] += 1
+        summary["bytes"] += result["bytes"]
+        if result["tier"] is not None:
+            summary["tiers"][result["tier"]] = summary["tiers"].get(result["tier"], 0) + 1
+        if on_result:
+            on_result(result)
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for video_id, _ in registry.iter_entries(pattern=pattern):
+            in_flight.append(pool.submit(check, video_id))
+            # Bounded window: wait on the oldest check before queueing more
+            if len(in_flight) >= workers * 4:
+                collect(in_flight.popleft())
+        while in_flight:
+            collect(in_flight.popleft())
+
+    elapsed = time.perf_counter() - started
+    summary["seconds"] = round(elapsed, 3)
+    summary["files_per_second"] = round(summary["checked"] / elapsed, 1) if elapsed > 0 else None
+    summary["mb_per_second"] = round(summary["bytes"] / 1e6 / elapsed, 1) if elapsed > 0 else None
+    summary["workers"] = workers
+    return summary
 
 
 #register_video("video_001", "test.mp4")
@@ -58,3 +487,40 @@ def list_registered_videos():
 # reencoded = get_video_hash("video/reencode_test.mp4")
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Video hash registry tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    verify = sub.add_parser("verify", help="Check every registered video against its file")
+    verify.add_argument("roots", nargs="+", help="Folders holding the registered videos")
+    verify.add_argument("--strict", action="store_true", help="Full SHA-256 of every file")
+    verify.add_argument("--no-sample", action="store_true", help="Skip the sampled-block tier (stat only on the fast path)")
+    verify.add_argument("-j", "--jobs", type=int, default=None, help="Parallel checks (default: from the disk type)")
+    verify.add_argument("--pattern", help="Only video ids matching this glob")
+    verify.add_argument("-v", "--verbose", action="store_true", help="Print every video that isn't OK")
+
+    listing = sub.add_parser("list", help="List registered videos")
+    listing.add_argument("--pattern", help="Only video ids matching this glob")
+    listing.add_argument("--hash-prefix", help="Only hashes starting with this prefix")
+    listing.add_argument("--offset", type=int, default=0, help="Entries to skip")
+    listing.add_argument("--limit", type=int, default=None, help="Maximum entries")
+
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        def report(result):
+            if args.verbose and result["status"] != "ok":
+                print(f"{result['status'].upper():9s} {result['video_id']}" + (f" ({result['error']})" if result.get("error") else ""))
+
+        summary = verify_registry(args.roots, strict=args.strict, sample=not args.no_sample, max_workers=args.jobs, pattern=args.pattern, on_result=report)
+        print(f"Checked {summary['checked']} videos in {summary['seconds']}s with {summary['workers']} workers")
+        print(f"  OK:       {summary['ok']}")
+        print(f"  Modified: {summary['modified']}")
+        print(f"  Missing:  {summary['missing']}")
+        print(f"  Errors:   {summary['error']}")
+        print(f"  Tiers:    " + ", ".join(f"{tier}={count}" for tier, count in sorted(summary["tiers"].items())))
+        print(f"  Throughput: {summary['files_per_second']} files/s, {summary['mb_per_second']} MB/s")
+        raise SystemExit(1 if summary["modified"] or summary["missing"] or summary["error"] else 0)
+    else:
+        for entry in list_registered_videos(args.pattern, args.hash_prefix, args.offset, args.limit):
+            print(f"{entry['id']}\t{entry['hash']}")
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class JobManifest:
+    """Append-only record of every planned job in an output folder
+
+    Each line is one event (a job being planned, or a status change), so
+    writes are O(1) and a crash can at worst lose the last partial line.
+    Replaying the file gives the latest state of every job.
+
+    Statuses: planned -> done (with hash) or failed
+
+    A read_only manifest (dry runs) never touches the file: events only
+    update the in-memory state.
+    """
+
+    def __init__(self, output_folder, resume=False, read_only=False):
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.jobs = {}
+        if resume:
+            self._load()
+        self._file = None if read_only else open(self.path, "a" if resume else "w")
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash
+                        continue
+                    state = self.jobs.setdefault(event["job_id"], {})
+                    state.update({k: v for k, v in event.items() if k != "event"})
+        except FileNotFoundError:
+            pass
+
+    def _write(self, event):
+        if self._file is not None:
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        state = self.jobs.setdefault(event["job_id"], {})
+        state.update({k: v for k, v in event.items() if k != "event"})
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def record_plan(self, job_id, job):
+        self._write({
+            "event": "plan",
+            "job_id": job_id,
+            "status": "planned",
+            "input_path": job["input_path"],
+            "output_path": job["output_path"],
+            "params": job["params"],
+            "planned_at": time.time(),
+        })
+
+    def mark_done(self, job_id, hash_value, started, elapsed):
+        self._write({
+            "event": "status",
+            "job_id": job_id,
+            "status": "done",
+            "hash": hash_value,
+            "started": started,
+            "elapsed": round(elapsed, 3),
+        })
+
+    def mark_failed(self, job_id, started, elapsed):
+        self._write({
+            "event": "status",
+            "job_id": job_id,
+            "status": "failed",
+            "hash": None,
+            "started": started,
+            "elapsed": round(elapsed, 3),
+        })
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
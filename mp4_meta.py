@@ -0,0 +1,543 @@
+import os
+import shutil
+import struct
+from datetime import datetime, timezone
+from fractions import Fraction
+
+# ============================================================
+# NATIVE MP4 METADATA WRITER
+# ============================================================
+#
+# Rewrites the udta/meta/ilst tags of an MP4 without remuxing. The media
+# data (mdat) is cloned byte for byte and never moves, so every chunk
+# offset in the sample tables stays valid:
+#
+#   moov at the end   -> truncate at the old moov and append the new one
+#   moov before mdat  -> turn the old moov into a 'free' box of the same
+#                        size and append the new moov at the end
+
+# ffmpeg-style metadata keys -> iTunes ilst atoms
+ILST_KEYS = {
+    "title": b"\xa9nam",
+    "comment": b"\xa9cmt",
+    "artist": b"\xa9ART",
+    "author": b"\xa9aut",
+    "description": b"desc",
+    "copyright": b"cprt",
+    "date": b"\xa9day",
+    "album": b"\xa9alb",
+    "genre": b"\xa9gen",
+    "encoder": b"\xa9too",
+}
+
+# Seconds between the MP4 epoch (1904-01-01) and the Unix epoch
+MP4_EPOCH_OFFSET = 2082844800
+
+# Linux FICLONE ioctl (reflink on btrfs/xfs)
+FICLONE = 0x40049409
+
+
+class MP4Error(Exception):
+    """The file isn't an MP4 layout this writer can edit safely"""
+
+
+# ============================================================
+# BOX HELPERS
+# ============================================================
+
+def iter_boxes(f, start, end):
+    """Yield (type, offset, size, header_size) for boxes in [start, end)"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4Error(f"corrupt box {box_type!r} at {offset}")
+        yield box_type, offset, size, header_size
+        offset += size
+
+
+def iter_child_boxes(payload):
+    """Yield (type, raw box bytes) for boxes packed in a bytes payload"""
+    offset = 0
+    while offset + 8 <= len(payload):
+        size, box_type = struct.unpack(">I4s", payload[offset:offset + 8])
+        if size == 1:
+            size = struct.unpack(">Q", payload[offset + 8:offset + 16])[0]
+        elif size == 0:
+            size = len(payload) - offset
+        if size < 8 or offset + size > len(payload):
+            raise MP4Error(f"corrupt child box {box_type!r}")
+        yield box_type, payload[offset:offset + size]
+        offset += size
+
+
+def make_box(box_type, payload):
+    if len(payload) + 8 > 0xFFFFFFFF:
+        return struct.pack(">I4sQ", 1, box_type, len(payload) + 16) + payload
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def box_payload(raw):
+    size = struct.unpack(">I", raw[:4])[0]
+    return raw[16:] if size == 1 else raw[8:]
+
+
+# ============================================================
+# TAG BUILDING
+# ============================================================
+
+def build_ilst_item(atom, value):
+    # data box: type 1 (UTF-8), locale 0
+    data = make_box(b"data", struct.pack(">II", 1, 0) + value.encode("utf-8"))
+    return make_box(atom, data)
+
+
+def build_meta(items, header=b"\x00" * 4, children=()):
+    """meta box with the given ilst items
+
+    header is the version/flags of an ISO meta (empty for QuickTime meta)
+    and children are the old meta's other boxes (hdlr, keys, ...), kept
+    as they were; an iTunes hdlr is added only when there isn't one.
+    """
+    children = list(children)
+    if not any(box_type == b"hdlr" for box_type, _ in children):
+        hdlr = make_box(b"hdlr", struct.pack(">I", 0) + struct.pack(">I4s", 0, b"mdir") + b"appl" + bytes(8) + b"\x00")
+        children.insert(0, (b"hdlr", hdlr))
+    ilst = make_box(b"ilst", b"".join(items))
+    return make_box(b"meta", header + b"".join(raw for _, raw in children) + ilst)
+
+
+def split_meta(raw):
+    """Return (version/flags bytes, [(type, raw child)]) of a raw meta box"""
+    payload = box_payload(raw)
+    header = b""
+    # ISO meta is a full box (4 version/flag bytes); QuickTime meta isn't
+    if payload[4:8] not in (b"hdlr", b"ilst", b"keys"):
+        header, payload = payload[:4], payload[4:]
+    return header, list(iter_child_boxes(payload))
+
+
+def existing_ilst_items(udta_payload):
+    """Return raw ilst items already in udta/meta, keyed by atom"""
+    items = {}
+    for box_type, raw in iter_child_boxes(udta_payload):
+        if box_type != b"meta":
+            continue
+        for child_type, child in split_meta(raw)[1]:
+            if child_type == b"ilst":
+                for item_type, item in iter_child_boxes(box_payload(child)):
+                    items[item_type] = item
+    return items
+
+
+def build_udta(old_udta_payload, tags):
+    """New udta keeping unrelated children, the old meta's other boxes and untouched ilst items"""
+    items = existing_ilst_items(old_udta_payload) if old_udta_payload else {}
+    for key, value in tags.items():
+        atom = ILST_KEYS.get(key)
+        if atom is None:
+            continue
+        items[atom] = build_ilst_item(atom, str(value))
+
+    children = []
+    meta_header, meta_children = b"\x00" * 4, []
+    old_meta = None
+    if old_udta_payload:
+        for box_type, raw in iter_child_boxes(old_udta_payload):
+            if box_type != b"meta":
+                children.append(raw)
+            elif old_meta is None:
+                old_meta = raw
+    if old_meta is not None:
+        meta_header, meta_children = split_meta(old_meta)
+        meta_children = [(box_type, raw) for box_type, raw in meta_children if box_type != b"ilst"]
+    children.append(build_meta(items.values(), meta_header, meta_children))
+    return make_box(b"udta", b"".join(children))
+
+
+def patch_mvhd(raw, creation_time):
+    """Set mvhd creation/modification time (datetime) in a raw mvhd box"""
+    header = 16 if struct.unpack(">I", raw[:4])[0] == 1 else 8
+    raw = bytearray(raw)
+    version = raw[header]
+    stamp = int(creation_time.timestamp()) + MP4_EPOCH_OFFSET
+    if version == 1:
+        struct.pack_into(">QQ", raw, header + 4, stamp, stamp)
+    else:
+        stamp &= 0xFFFFFFFF
+        struct.pack_into(">II", raw, header + 4, stamp, stamp)
+    return bytes(raw)
+
+
+def parse_creation_time(value):
+    """Parse ffmpeg-style creation_time strings into an aware datetime"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    text = value.rstrip("Z")
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised creation_time: {value}")
+
+
+# ============================================================
+# FILE CLONING
+# ============================================================
+
+def clone_file(src, dst):
+    """Copy src to dst as cheaply as the filesystem allows
+
+    Tries a reflink (shares blocks, no data copied), then copy_file_range
+    (in-kernel copy), then a plain sequential copy.
+    """
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        try:
+            import fcntl
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+
+        size = os.fstat(fin.fileno()).st_size
+        if hasattr(os, "copy_file_range"):
+            try:
+                copied = 0
+                while copied < size:
+                    step = os.copy_file_range(fin.fileno(), fout.fileno(), size - copied, copied, copied)
+                    if step == 0:
+                        break
+                    copied += step
+                if copied == size:
+                    return "copy_file_range"
+            except OSError:
+                pass
+            fin.seek(0)
+            fout.seek(0)
+            fout.truncate()
+
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+        return "copy"
+
+
+# ============================================================
+# PUBLIC API
+# ============================================================
+
+def write_metadata(input_path, output_path, tags, creation_time=None):
+    """Write input_path to output_path with new tags, without remuxing
+
+    Args:
+        input_path: Source MP4/MOV (non-fragmented)
+        output_path: Destination file (must differ from input_path)
+        tags: dict of ffmpeg-style keys (title, comment, artist, ...) -> value
+        creation_time: Optional datetime or ISO string for mvhd timestamps
+    Returns:
+        name of the clone method used
+    Raises:
+        MP4Error if the layout isn't supported (caller should fall back to ffmpeg)
+    """
+    if os.path.abspath(input_path) == os.path.abspath(output_path):
+        raise MP4Error("input and output must differ")
+
+    with open(input_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        boxes = list(iter_boxes(f, 0, file_size))
+        types = [box[0] for box in boxes]
+        if b"moov" not in types or b"mdat" not in types:
+            raise MP4Error("no moov/mdat")
+        if b"moof" in types or types.count(b"moov") != 1:
+            raise MP4Error("fragmented or multi-moov file")
+
+        _, moov_offset, moov_size, moov_header = boxes[types.index(b"moov")]
+        # A size-0 box runs to the end of the file, so a new moov appended
+        # after it (e.g. a size-0 mdat following the moov) would be swallowed
+        last_type, last_offset = boxes[-1][:2]
+        f.seek(last_offset)
+        if last_type != b"moov" and struct.unpack(">I", f.read(4))[0] == 0:
+            raise MP4Error(f"size-0 {last_type!r} box would not be last")
+        f.seek(moov_offset + moov_header)
+        moov_payload = f.read(moov_size - moov_header)
+
+    # Rebuild moov: same children, new udta, patched mvhd
+    children = []
+    old_udta = None
+    for box_type, raw in iter_child_boxes(moov_payload):
+        if box_type == b"mvex":
+            raise MP4Error("fragmented file")
+        if box_type == b"udta":
+            old_udta = box_payload(raw)
+            continue
+        if box_type == b"mvhd" and creation_time is not None:
+            raw = patch_mvhd(raw, parse_creation_time(creation_time))
+        children.append(raw)
+    children.append(build_udta(old_udta, tags))
+    new_moov = make_box(b"moov", b"".join(children))
+
+    method = clone_file(input_path, output_path)
+    try:
+        with open(output_path, "r+b") as out:
+            if moov_offset + moov_size == file_size:
+                out.truncate(moov_offset)
+            else:
+                # Keep the old box's bytes in place (mdat offsets unchanged), just retype it
+                out.seek(moov_offset + 4)
+                out.write(b"free")
+            out.seek(0, os.SEEK_END)
+            out.write(new_moov)
+    except Exception:
+        os.remove(output_path)
+        raise
+    return method
+
+
+def read_tags(filepath):
+    """Return the ilst tags of an MP4 as a dict of ffmpeg-style keys"""
+    atoms = {atom: key for key, atom in ILST_KEYS.items()}
+    tags = {}
+    with open(filepath, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        for box_type, offset, size, header in iter_boxes(f, 0, file_size):
+            if box_type != b"moov":
+                continue
+            f.seek(offset + header)
+            for child_type, raw in iter_child_boxes(f.read(size - header)):
+                if child_type != b"udta":
+                    continue
+                for atom, item in existing_ilst_items(box_payload(raw)).items():
+                    for data_type, data in iter_child_boxes(box_payload(item)):
+                        if data_type == b"data" and atom in atoms:
+                            tags[atoms[atom]] = box_payload(data)[8:].decode("utf-8", errors="replace")
+    return tags
+
+
+# ============================================================
+# NATIVE PROBE
+# ============================================================
+#
+# Reads duration, codecs, resolution, frame rate, bitrates and tags from
+# the moov box without starting ffprobe. Only box headers are read while
+# walking the file (mdat is skipped by seeking), and inside moov only the
+# few boxes needed: mvhd, tkhd, mdhd, hdlr, stsd, stts and the udta tags.
+
+# Sample entry fourcc -> ffprobe codec_name
+CODEC_NAMES = {
+    b"avc1": "h264", b"avc3": "h264",
+    b"hvc1": "hevc", b"hev1": "hevc",
+    b"av01": "av1", b"vp09": "vp9", b"vp08": "vp8",
+    b"mp4v": "mpeg4", b"jpeg": "mjpeg",
+    b"apch": "prores", b"apcn": "prores", b"apcs": "prores", b"apco": "prores", b"ap4h": "prores",
+    b"mp4a": "aac", b".mp3": "mp3", b"ac-3": "ac3", b"ec-3": "eac3",
+    b"Opus": "opus", b"fLaC": "flac", b"alac": "alac",
+    b"sowt": "pcm_s16le", b"twos": "pcm_s16be", b"lpcm": "pcm_s16le",
+    b"tx3g": "mov_text", b"wvtt": "webvtt", b"tmcd": "tmcd",
+}
+
+# hdlr handler type -> ffprobe codec_type
+HANDLER_TYPES = {b"vide": "video", b"soun": "audio", b"text": "subtitle", b"sbtl": "subtitle", b"subt": "subtitle", b"tmcd": "data"}
+
+# esds objectTypeIndication values that aren't AAC
+MPEG_AUDIO_OBJECT_TYPES = {0x69: "mp3", 0x6B: "mp3"}
+
+# Containers may nest this deep under moov before reaching stbl
+CONTAINER_BOXES = {b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf"}
+
+
+def _read_box(f, offset, size, header):
+    f.seek(offset + header)
+    return f.read(size - header)
+
+
+def _children(f, offset, size, header):
+    """{type: (offset, size, header)} of a box's direct children (first of each type)"""
+    found = {}
+    for box_type, child_offset, child_size, child_header in iter_boxes(f, offset + header, offset + size):
+        found.setdefault(box_type, (child_offset, child_size, child_header))
+    return found
+
+
+def _full_box_times(payload):
+    """(creation, timescale, duration) from an mvhd/mdhd payload"""
+    if payload[0] == 1:
+        creation, _, timescale, duration = struct.unpack(">QQIQ", payload[4:32])
+    else:
+        creation, _, timescale, duration = struct.unpack(">IIII", payload[4:20])
+    return creation, timescale, duration
+
+
+def _esds_info(entry):
+    """(objectTypeIndication, avgBitrate) from the esds box of an mp4a entry"""
+    index = entry.find(b"esds")
+    if index < 4:
+        return None, None
+    data = entry[index + 8:]
+    pos = 0
+
+    def descriptor():
+        nonlocal pos
+        tag = data[pos]
+        pos += 1
+        length = 0
+        for _ in range(4):
+            byte = data[pos]
+            pos += 1
+            length = (length << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                break
+        return tag, length
+
+    try:
+        tag, _ = descriptor()
+        if tag != 0x03:
+            return None, None
+        flags = data[pos + 2]
+        pos += 3
+        if flags & 0x80:
+            pos += 2
+        if flags & 0x40:
+            pos += 1 + data[pos]
+        if flags & 0x20:
+            pos += 2
+        tag, _ = descriptor()
+        if tag != 0x04:
+            return None, None
+        object_type = data[pos]
+        avg_bitrate = struct.unpack(">I", data[pos + 9:pos + 13])[0]
+        return object_type, avg_bitrate or None
+    except (IndexError, struct.error):
+        return None, None
+
+
+def _parse_track(f, trak):
+    """ffprobe-style stream dict for one trak box (None if unusable)"""
+    boxes = _children(f, *trak)
+    mdia = boxes.get(b"mdia")
+    if mdia is None:
+        return None
+    mdia_boxes = _children(f, *mdia)
+    if b"hdlr" not in mdia_boxes or b"mdhd" not in mdia_boxes:
+        return None
+    handler = _read_box(f, *mdia_boxes[b"hdlr"])[8:12]
+    _, timescale, duration = _full_box_times(_read_box(f, *mdia_boxes[b"mdhd"]))
+    stream = {"codec_type": HANDLER_TYPES.get(handler, "data")}
+    if timescale:
+        stream["time_base"] = f"1/{timescale}"
+        stream["duration"] = f"{duration / timescale:.6f}"
+
+    minf = mdia_boxes.get(b"minf")
+    stbl = _children(f, *minf).get(b"stbl") if minf else None
+    if stbl is None:
+        return stream
+    stbl_boxes = _children(f, *stbl)
+
+    if b"stsd" in stbl_boxes:
+        stsd = _read_box(f, *stbl_boxes[b"stsd"])
+        if len(stsd) >= 16:
+            entry_size, fourcc = struct.unpack(">I4s", stsd[8:16])
+            entry = stsd[16:8 + entry_size]
+            stream["codec_tag_string"] = fourcc.decode("latin-1")
+            stream["codec_name"] = CODEC_NAMES.get(fourcc, fourcc.decode("latin-1").strip())
+            if stream["codec_type"] == "video" and len(entry) >= 28:
+                stream["width"], stream["height"] = struct.unpack(">HH", entry[24:28])
+                btrt = entry.find(b"btrt")
+                if btrt >= 4 and len(entry) >= btrt + 16:
+                    avg = struct.unpack(">I", entry[btrt + 12:btrt + 16])[0]
+                    if avg:
+                        stream["bit_rate"] = str(avg)
+            elif stream["codec_type"] == "audio" and len(entry) >= 28:
+                stream["channels"] = struct.unpack(">H", entry[16:18])[0]
+                rate = struct.unpack(">I", entry[24:28])[0] >> 16
+                stream["sample_rate"] = str(rate or timescale)
+                if fourcc == b"mp4a":
+                    object_type, avg = _esds_info(entry)
+                    stream["codec_name"] = MPEG_AUDIO_OBJECT_TYPES.get(object_type, "aac")
+                    if avg:
+                        stream["bit_rate"] = str(avg)
+
+    if stream["codec_type"] == "video" and b"stts" in stbl_boxes:
+        stts = _read_box(f, *stbl_boxes[b"stts"])
+        count = struct.unpack(">I", stts[4:8])[0]
+        frames = total = 0
+        for i in range(count):
+            sample_count, delta = struct.unpack(">II", stts[8 + i * 8:16 + i * 8])
+            frames += sample_count
+            total += sample_count * delta
+        stream["nb_frames"] = str(frames)
+        if frames and total and timescale:
+            rate = Fraction(frames * timescale, total)
+            stream["avg_frame_rate"] = f"{rate.numerator}/{rate.denominator}"
+            stream["r_frame_rate"] = stream["avg_frame_rate"]
+    return stream
+
+
+def probe(filepath):
+    """ffprobe-compatible info ({"format": ..., "streams": [...]}) read natively
+
+    Returns the subset of `ffprobe -show_format -show_streams` JSON that
+    ffmpeg_utils.summarize_probe uses, with values as strings like ffprobe.
+
+    Raises:
+        MP4Error for anything that isn't a plain (non-fragmented) MP4/MOV,
+        so the caller can fall back to ffprobe
+    """
+    with open(filepath, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        top = {}
+        for box_type, offset, size, header in iter_boxes(f, 0, file_size):
+            top.setdefault(box_type, (offset, size, header))
+            if box_type == b"moof":
+                raise MP4Error("fragmented file")
+        if b"moov" not in top or (b"ftyp" not in top and b"mdat" not in top):
+            raise MP4Error("no moov box")
+
+        moov = _children(f, *top[b"moov"])
+        if b"mvhd" not in moov or b"mvex" in moov:
+            raise MP4Error("fragmented or incomplete moov")
+        creation, timescale, duration = _full_box_times(_read_box(f, *moov[b"mvhd"]))
+        if not timescale or not duration:
+            raise MP4Error("no duration in mvhd")
+        seconds = duration / timescale
+
+        streams = []
+        for box_type, offset, size, header in iter_boxes(f, top[b"moov"][0] + top[b"moov"][2], top[b"moov"][0] + top[b"moov"][1]):
+            if box_type == b"trak":
+                stream = _parse_track(f, (offset, size, header))
+                if stream is not None:
+                    stream["index"] = len(streams)
+                    streams.append(stream)
+
+        tags = {}
+        if b"ftyp" in top:
+            ftyp = _read_box(f, *top[b"ftyp"])
+            tags["major_brand"] = ftyp[:4].decode("latin-1")
+            tags["minor_version"] = str(struct.unpack(">I", ftyp[4:8])[0])
+            tags["compatible_brands"] = ftyp[8:].decode("latin-1")
+        if creation:
+            stamp = datetime.fromtimestamp(creation - MP4_EPOCH_OFFSET, tz=timezone.utc)
+            tags["creation_time"] = stamp.strftime("%Y-%m-%dT%H:%M:%S.000000Z")
+        if b"udta" in moov:
+            atoms = {atom: key for key, atom in ILST_KEYS.items()}
+            for atom, item in existing_ilst_items(_read_box(f, *moov[b"udta"])).items():
+                for data_type, data in iter_child_boxes(box_payload(item)):
+                    if data_type == b"data" and atom in atoms:
+                        tags[atoms[atom]] = box_payload(data)[8:].decode("utf-8", errors="replace")
+
+    return {
+        "streams": streams,
+        "format": {
+            "format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+            "nb_streams": len(streams),
+            "duration": f"{seconds:.6f}",
+            "size": str(file_size),
+            "bit_rate": str(int(file_size * 8 / seconds)),
+            "tags": tags,
+        },
+    }
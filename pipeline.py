@@ -0,0 +1,420 @@
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+
+from data import DedupIndex, default_cache_root, get_output_cache, get_registry
+from engine import JobCancelled, JobTimeout, get_engine
+from ffmpeg_utils import (
+    add_variation_arguments,
+    apply_manifest,
+    create_variation,
+    create_variations_single_decode,
+    default_jobs,
+    describe_plan,
+    encoder_thread_budget,
+    get_video_info,
+    iter_video_files,
+    output_cache_enabled,
+    plan_streams,
+    plan_variation_jobs,
+    setup_logging,
+    staging_path,
+    summarize_probe,
+    variation_options,
+)
+from hash_demo import DEFAULT_HASH_WORKERS, DuplicateTracker, file_fingerprint, get_video_hash
+from manifest import JobManifest
+from progress import BatchTelemetry
+
+# ============================================================
+# PIPELINE SETTINGS
+# ============================================================
+#
+# discover -> probe -> encode -> hash -> persist
+#
+# Each arrow is a bounded queue, so a fast stage blocks once it is
+# QUEUE_SIZE items ahead of the next one: the work in flight (jobs,
+# results, open outputs) stays bounded however big the input tree is.
+# What still grows with the tree is a small record per source (source
+# dedup) and per job (manifest state, needed for resume). Encoding (CPU) and hashing (disk) run on
+# separate pools, so finished outputs are hashed while the next ones
+# are still encoding, and results reach the registry in small batches
+# as they come in instead of at the very end.
+
+QUEUE_SIZE = 64
+
+DEFAULT_PROBE_WORKERS = 4
+
+# Registry commit batch size and the longest a result waits to be committed
+PERSIST_BATCH = 50
+PERSIST_INTERVAL = 5.0
+
+_STOP = object()
+
+
+class Stage:
+    """A pool of threads turning items from inbox into items for outbox
+
+    func(item) returns an iterable of outputs (empty to drop the item).
+    When every upstream producer has finished, the last worker of this
+    stage to exit passes the stop signal on.
+    """
+
+    def __init__(self, name, func, workers, inbox, outbox=None):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._alive = workers
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                # Let sibling workers see it too
+                self.inbox.put(_STOP)
+                break
+            started = time.perf_counter()
+            try:
+                outputs = list(self.func(item))
+            except Exception as e:
+                logging.error(f"{self.name}: {e}")
+                outputs = []
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.processed += 1
+                self.busy_seconds += time.perf_counter() - started
+            if self.outbox is not None:
+                for output in outputs:
+                    self.outbox.put(output)
+        with self._lock:
+            self._alive -= 1
+            last = self._alive == 0
+        if last and self.outbox is not None:
+            self.outbox.put(_STOP)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+# ============================================================
+# PIPELINE
+# ============================================================
+
+def subfolder_prefix(input_folder, source_path):
+    """Output name prefix keeping a source's subfolder ("sub__" for sub/clip.mp4)"""
+    folder = os.path.dirname(os.path.relpath(source_path, input_folder))
+    return folder.replace(os.sep, "__") + "__" if folder else ""
+
+
+def run_pipeline(input_folder, output_folder, variations_per_video=3, reencode=False, use_filter=False, use_audio=False,
+                 jobs=1, probe_workers=DEFAULT_PROBE_WORKERS, hash_workers=DEFAULT_HASH_WORKERS, recursive=True,
+                 timeout=None, segment_seconds=None, single_decode=False, dedupe_sources=True, resume=False,
+                 seed=None, reference=None, use_cache=False, cache_bytes=None, cache_dir=None, progress_callback=None,
+                 queue_size=QUEUE_SIZE):
+    """Create, hash and register variations of every source under input_folder
+
+    The streaming counterpart of batch_create_variations: the first job
+    starts as soon as the first source is found and probed, and results
+    are committed to the registry while later jobs still run. It supports
+    the same source dedup, manifest/resume, seeded params, output cache,
+    single decode and telemetry, but not the options that need the whole
+    job list up front (deadline/min-speed budgets, --plan).
+
+    Queued work is bounded by queue_size per stage; memory still grows by
+    a small record per distinct source and per planned job.
+
+    Differences from batch_create_variations:
+        - sources in subfolders are found too and keep their relative path in
+          the output name ("sub__clip_var_001.mp4"; top-level names match)
+        - duplicate sources are detected as they arrive, so the first copy
+          found is kept rather than the first in listing order
+        - duplicate outputs are counted in completion order
+
+    Returns:
+        summary dict (sources, created, duplicates, failed, per-stage stats)
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    log_file = setup_logging(output_folder)
+    plan = plan_streams(reencode, use_filter, use_audio)
+    if not jobs:
+        jobs = default_jobs(plan["video"] != "copy")
+    threads = encoder_thread_budget(jobs) if plan["video"] != "copy" else None
+    single_decode = single_decode and plan["video"] != "copy"
+    use_cache = output_cache_enabled(use_cache, seed)
+
+    logging.info("=" * 50)
+    logging.info("PIPELINED VIDEO VARIATION")
+    logging.info("=" * 50)
+    logging.info(f"Input: {input_folder}" + (" (recursive)" if recursive else ""))
+    logging.info(f"Variations each: {variations_per_video}")
+    logging.info(f"Stream plan: {describe_plan(plan)}" + (" (single decode per source)" if single_decode else ""))
+    logging.info(f"Workers: probe {probe_workers}, encode {jobs}" + (f" x {threads} threads" if threads else "") + f", hash {hash_workers}")
+    if seed is not None:
+        logging.info(f"Seed: {seed}")
+    if use_cache:
+        logging.info(f"Output cache: {cache_dir or default_cache_root(output_folder)}")
+    logging.info(f"Log file: {log_file}")
+    logging.info("=" * 50)
+
+    probe_queue = queue.Queue(maxsize=queue_size)
+    encode_queue = queue.Queue(maxsize=queue_size)
+    hash_queue = queue.Queue(maxsize=queue_size)
+    persist_queue = queue.Queue(maxsize=queue_size)
+    counts = {"sources": 0, "invalid": 0, "duplicate_sources": 0, "failed": 0, "created": 0, "duplicates": 0, "resumed": 0, "persist_errors": 0}
+    counts_lock = threading.Lock()
+
+    def count(key):
+        with counts_lock:
+            counts[key] += 1
+
+    manifest = JobManifest(output_folder, resume=resume)
+    manifest_lock = threading.Lock()
+
+    def job_id(job):
+        return os.path.basename(job["output_path"])
+
+    metrics_file = os.path.splitext(log_file)[0] + ".metrics.jsonl"
+    telemetry = BatchTelemetry({}, metrics_path=metrics_file, on_update=progress_callback)
+    cache = None
+    if use_cache:
+        cache = get_output_cache(cache_dir or default_cache_root(output_folder), cache_bytes)
+
+    def probe(bundle):
+        source_path, planned = bundle
+        info = summarize_probe(get_video_info(source_path))
+        if info is None:
+            logging.warning(f"Skipped unreadable source: {source_path}")
+            count("invalid")
+            return []
+        for job in planned:
+            telemetry.add_job(job_id(job), info["duration"])
+        if single_decode:
+            fresh = [job for job in planned if "expected_hash" not in job]
+            reused = [job for job in planned if "expected_hash" in job]
+            return ([{"group": fresh, "has_audio": bool(info["audio_codec"])}] if fresh else []) + reused
+        return planned
+
+    def finish(job, result, started, elapsed):
+        """Route one encode outcome: results to hashing, failures to the manifest"""
+        telemetry.job_finished(job_id(job), ok=bool(result))
+        temp_path = staging_path(job["output_path"])
+        if not result:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            with manifest_lock:
+                manifest.mark_failed(job_id(job), started, elapsed)
+            count("failed")
+            return []
+        os.replace(temp_path, job["output_path"])
+        result.update(path=job["output_path"], started=started, elapsed=elapsed)
+        return [result]
+
+    def encode(item):
+        if get_engine().cancelled.is_set():
+            raise JobCancelled()
+        if "group" in item:
+            group = item["group"]
+            for job in group:
+                telemetry.job_started(job_id(job))
+
+            def on_progress(snapshot):
+                for job in group:
+                    telemetry.job_progress(job_id(job), snapshot)
+            started = time.time()
+            try:
+                outcomes = create_variations_single_decode(
+                    group[0]["input_path"], [staging_path(job["output_path"]) for job in group], [job["params"] for job in group],
+                    has_audio=item["has_audio"], compute_hash=False, on_progress=on_progress, timeout=timeout,
+                    # One encoder per output in the process, so they share this slot's threads
+                    threads=max(1, threads // len(group)) if threads else None,
+                )
+            except (JobTimeout, JobCancelled) as e:
+                logging.warning(f"  ⏱ {group[0]['input_path']}: {e}")
+                outcomes = [None] * len(group)
+            elapsed = time.time() - started
+            return [output for job, result in zip(group, outcomes) for output in finish(job, result, started, elapsed)]
+
+        job = item
+        # Resumed job: keep the earlier output if it still has the recorded hash
+        if "expected_hash" in job:
+            if os.path.exists(job["output_path"]) and get_video_hash(job["output_path"]) == job["expected_hash"]:
+                telemetry.job_finished(job_id(job))
+                count("resumed")
+                return [{"path": job["output_path"], "hash": job["expected_hash"], "title": job["params"]["title"], "resumed": True}]
+        telemetry.job_started(job_id(job))
+        started = time.time()
+        try:
+            result = create_variation(
+                job["input_path"], staging_path(job["output_path"]), reencode=reencode, use_filter=use_filter, use_audio=use_audio,
+                compute_hash=False, params=job["params"], threads=threads, timeout=timeout, segment_seconds=segment_seconds,
+                on_progress=lambda snapshot: telemetry.job_progress(job_id(job), snapshot), cache=cache,
+            )
+        except (JobTimeout, JobCancelled) as e:
+            logging.warning(f"  ⏱ {job_id(job)}: {e}")
+            result = None
+        return finish(job, result, started, time.time() - started)
+
+    def hash_output(result):
+        if not result.get("hash"):
+            result["hash"] = get_video_hash(result["path"])
+        result["fingerprint"] = file_fingerprint(result["path"])
+        if not result.get("resumed"):
+            with manifest_lock:
+                manifest.mark_done(os.path.basename(result["path"]), result["hash"], result["started"], result["elapsed"])
+        return [result]
+
+    stages = [
+        Stage("probe", probe, probe_workers, probe_queue, encode_queue),
+        Stage("encode", encode, jobs, encode_queue, hash_queue),
+        Stage("hash", hash_output, max(1, hash_workers), hash_queue, persist_queue),
+    ]
+    for stage in stages:
+        stage.start()
+
+    # Persist: a single writer thread, committing in small batches
+    dedup = DedupIndex(get_registry())
+
+    def persist():
+        """Drain persist_queue until _STOP; an error costs its items, never the thread
+
+        If this thread died the upstream stages would block on a full
+        queue and the run would hang, so every failure is caught here.
+        """
+        writer = get_registry().writer(batch_size=PERSIST_BATCH)
+
+        def commit(action, *args):
+            try:
+                action(*args)
+            except Exception as e:
+                # Drop the batch that failed rather than retrying it forever
+                logging.error(f"persist: registry commit failed, {len(writer.pending)} results not registered: {e}")
+                with counts_lock:
+                    counts["persist_errors"] += len(writer.pending)
+                writer.pending = []
+
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = persist_queue.get(timeout=PERSIST_INTERVAL)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                video_id = os.path.basename(item["path"])
+                try:
+                    duplicate = not dedup.claim(item["hash"], video_id=video_id)
+                except Exception as e:
+                    logging.error(f"persist: {video_id}: {e}")
+                    count("persist_errors")
+                    continue
+                if duplicate:
+                    logging.warning(f"  ⚠ DUPLICATE DETECTED: {item['path']}")
+                    count("duplicates")
+                else:
+                    commit(writer.add, video_id, item["hash"], item["fingerprint"])
+                    count("created")
+                    logging.info(f"[{counts['created']}] {video_id} {item['hash'][:16]}...")
+            if time.monotonic() - last_flush >= PERSIST_INTERVAL:
+                commit(writer.flush)
+                last_flush = time.monotonic()
+        commit(writer.flush)
+
+    persister = threading.Thread(target=persist, name="persist", daemon=True)
+    persister.start()
+
+    # Discover: params are drawn here, on one thread, so the random
+    # sequence doesn't depend on how the stages are scheduled
+    started = time.perf_counter()
+    output_root = os.path.abspath(output_folder) + os.sep
+    duplicates = DuplicateTracker() if dedupe_sources else None
+    for source_path in iter_video_files(input_folder, recursive=recursive):
+        if get_engine().cancelled.is_set():
+            break
+        # An output folder inside the input tree must not feed itself
+        if os.path.abspath(source_path).startswith(output_root):
+            continue
+        # Identical copies of a source would only produce more of the same variations
+        original = duplicates.check(source_path) if duplicates else None
+        if original is not None:
+            logging.info(f"Skipped duplicate source: {source_path} = {original}")
+            count("duplicate_sources")
+            continue
+        counts["sources"] += 1
+        planned = plan_variation_jobs([source_path], output_folder, variations_per_video, reencode=reencode, use_filter=use_filter,
+                                      use_audio=use_audio, seed=seed, reference=reference, name_prefix=subfolder_prefix(input_folder, source_path))
+        with manifest_lock:
+            done = apply_manifest(manifest, planned)
+        for job, state in done:
+            job["expected_hash"] = state["hash"]
+        probe_queue.put((source_path, planned))
+    probe_queue.put(_STOP)
+
+    for stage in stages:
+        stage.join()
+    persister.join()
+    manifest.close()
+    throughput = telemetry.close()
+    elapsed = time.perf_counter() - started
+
+    logging.info("")
+    logging.info("=" * 50)
+    logging.info("SUMMARY")
+    logging.info("=" * 50)
+    logging.info(f"Sources: {counts['sources']} ({counts['invalid']} unreadable, {counts['duplicate_sources']} duplicate copies skipped)")
+    logging.info(f"Total created: {counts['created']}" + (f" ({counts['resumed']} kept from the earlier run)" if resume else ""))
+    logging.info(f"Duplicates: {counts['duplicates']}")
+    logging.info(f"Failed: {counts['failed']}")
+    if counts["persist_errors"]:
+        logging.error(f"Not registered (registry errors): {counts['persist_errors']}")
+    for stage in stages:
+        logging.info(f"Stage {stage.name}: {stage.processed} items, {stage.busy_seconds:.1f}s busy, {stage.errors} errors")
+    if throughput["realtime_factor"] is not None:
+        logging.info(f"Throughput: {throughput['videos_per_minute']} videos/min, {throughput['realtime_factor']}x realtime")
+    logging.info(f"Metrics file: {metrics_file}")
+    logging.info(f"Job manifest: {manifest.path}")
+    logging.info("=" * 50)
+
+    counts["seconds"] = round(elapsed, 3)
+    counts["stages"] = {stage.name: {"items": stage.processed, "busy_seconds": round(stage.busy_seconds, 3), "errors": stage.errors} for stage in stages}
+    if get_engine().cancelled.is_set():
+        logging.warning("Pipeline cancelled")
+        raise JobCancelled()
+    return counts
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streamed discover/probe/encode/hash/persist pipeline")
+    parser.add_argument("input", help="Input folder with source videos (searched recursively)")
+    parser.add_argument("output", help="Output folder for variations")
+    add_variation_arguments(parser)
+    parser.add_argument("--hash-workers", type=int, default=DEFAULT_HASH_WORKERS, help=f"Parallel hashers (default: {DEFAULT_HASH_WORKERS})")
+    parser.add_argument("--no-recursive", action="store_true", help="Only the top level of the input folder")
+    args = parser.parse_args()
+
+    run_pipeline(
+        args.input, args.output,
+        **variation_options(parser, args),
+        hash_workers=args.hash_workers,
+        recursive=not args.no_recursive,
+    )
@@ -0,0 +1,207 @@
+import json
+import threading
+import time
+from collections import deque
+
+# ============================================================
+# FFMPEG -progress PARSING
+# ============================================================
+
+# Keys ffmpeg writes in each -progress block
+PROGRESS_KEYS = {
+    "frame", "fps", "bitrate", "total_size", "out_time_us", "out_time_ms",
+    "out_time", "dup_frames", "drop_frames", "speed", "progress",
+}
+
+
+def parse_progress_value(key, value):
+    """Convert one -progress value to a number where it has one"""
+    value = value.strip()
+    if key in ("frame", "total_size", "out_time_us", "out_time_ms", "dup_frames", "drop_frames"):
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    if key == "fps":
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if key == "speed":
+        # e.g. "2.35x" or "N/A"
+        try:
+            return float(value.rstrip("x"))
+        except ValueError:
+            return None
+    if key == "bitrate":
+        # e.g. "1234.5kbits/s"
+        try:
+            return float(value.replace("kbits/s", ""))
+        except ValueError:
+            return None
+    return value
+
+
+class ProgressParser:
+    """Line-by-line parser for ffmpeg stderr carrying -progress pipe:2 output
+
+    Calls on_progress(snapshot) at the end of every progress block with
+    frame, fps, speed, out_time (seconds), bitrate and total_size, and
+    keeps the last log_lines other lines (ffmpeg's own messages).
+    """
+
+    def __init__(self, on_progress=None, log_lines=50):
+        self.on_progress = on_progress
+        self.snapshot = {}
+        self.other = deque(maxlen=log_lines)
+
+    def feed(self, raw):
+        line = raw.decode(errors="replace") if isinstance(raw, bytes) else raw
+        line = line.strip()
+        key, sep, value = line.partition("=")
+        if not sep or key not in PROGRESS_KEYS:
+            if line:
+                self.other.append(line)
+            return
+        self.snapshot[key] = parse_progress_value(key, value)
+        if key == "progress":
+            us = self.snapshot.get("out_time_us")
+            if us is None:
+                us = self.snapshot.get("out_time_ms")
+            self.snapshot["out_seconds"] = us / 1_000_000 if us is not None and us >= 0 else None
+            if self.on_progress:
+                self.on_progress(dict(self.snapshot))
+            self.snapshot = {}
+
+    def log(self):
+        return "\n".join(self.other)
+
+
+# ============================================================
+# BATCH TELEMETRY
+# ============================================================
+
+class BatchTelemetry:
+    """Combine per-job progress into batch ETA and throughput
+
+    Jobs are weighted by their source duration, so one long video counts
+    for more than several short clips. Updates are thread-safe and are
+    passed to on_update (e.g. a GUI) and appended to a JSON-lines metrics
+    file at most once per interval.
+    """
+
+    def __init__(self, durations, metrics_path=None, on_update=None, interval=1.0):
+        """
+        Args:
+            durations: dict of job key -> source seconds (0/None if unknown)
+            metrics_path: JSON-lines file for snapshots (None to skip)
+            on_update: Called with the batch snapshot dict
+            interval: Minimum seconds between snapshots
+        """
+        self.durations = {key: (seconds or 0.0) for key, seconds in durations.items()}
+        self.total_seconds = sum(self.durations.values())
+        self.total_jobs = len(self.durations)
+        self.metrics_path = metrics_path
+        self.on_update = on_update
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_emit = 0.0
+        self.jobs = {}
+        self.finished = 0
+        self.failed = 0
+        self.done_seconds = 0.0
+        self._metrics = open(metrics_path, "a") if metrics_path else None
+
+    def add_job(self, key, seconds):
+        """Count a job discovered after the batch started (streaming runs)"""
+        with self.lock:
+            self.durations[key] = seconds or 0.0
+            self.total_seconds += seconds or 0.0
+            self.total_jobs += 1
+
+    def job_started(self, key):
+        with self.lock:
+            self.jobs[key] = {"out_seconds": 0.0, "speed": None, "fps": None, "bitrate": None, "frame": 0, "done": False}
+
+    def job_progress(self, key, snapshot):
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                # Already finished (or never started)
+                return
+            for field in ("frame", "fps", "speed", "bitrate", "out_seconds", "total_size"):
+                if snapshot.get(field) is not None:
+                    job[field] = snapshot[field]
+        self._emit()
+
+    def job_finished(self, key, ok=True):
+        with self.lock:
+            # Finished jobs only count towards the totals, so a long run's
+            # memory doesn't grow with every job it has completed
+            self.jobs.pop(key, None)
+            self.done_seconds += self.durations.pop(key, 0.0)
+            self.finished += 1
+            if not ok:
+                self.failed += 1
+        self._emit(force=True)
+
+    def snapshot(self):
+        """Current batch-level numbers"""
+        with self.lock:
+            elapsed = time.time() - self.started
+            if self.total_seconds > 0:
+                processed = self.done_seconds + sum(min(job.get("out_seconds") or 0.0, self.durations.get(key, 0.0)) for key, job in self.jobs.items())
+                fraction = processed / self.total_seconds
+            else:
+                processed = 0.0
+                fraction = self.finished / self.total_jobs if self.total_jobs else 1.0
+            fraction = min(fraction, 1.0)
+            eta = elapsed / fraction - elapsed if fraction > 0 else None
+            running = list(self.jobs.values())
+            return {
+                "time": time.time(),
+                "elapsed": round(elapsed, 2),
+                "jobs_total": self.total_jobs,
+                "jobs_done": self.finished,
+                "jobs_failed": self.failed,
+                "jobs_running": len(running),
+                "fraction": round(fraction, 4),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+                "media_seconds_done": round(processed, 2),
+                "realtime_factor": round(processed / elapsed, 3) if elapsed > 0 else None,
+                "videos_per_minute": round(self.finished / elapsed * 60, 2) if elapsed > 0 else None,
+                "fps": round(sum(job.get("fps") or 0 for job in running), 1),
+                "speed": [job.get("speed") for job in running],
+            }
+
+    def _emit(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_emit < self.interval:
+                return
+            self.last_emit = now
+        snap = self.snapshot()
+        if self._metrics:
+            with self.lock:
+                self._metrics.write(json.dumps(snap) + "\n")
+                self._metrics.flush()
+        if self.on_update:
+            self.on_update(snap)
+
+    def close(self):
+        snap = self.snapshot()
+        if self._metrics:
+            self._metrics.write(json.dumps(dict(snap, final=True)) + "\n")
+            self._metrics.close()
+            self._metrics = None
+        return snap
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
@@ -0,0 +1,79 @@
+import pytest
+
+from data import SQLiteJobQueue
+
+# A lease that has already run out when claim() returns
+EXPIRED = -1.0
+
+
+@pytest.fixture
+def queue(tmp_path):
+    jobs = SQLiteJobQueue(str(tmp_path / "jobs.db"), max_attempts=2)
+    yield jobs
+    jobs.close()
+
+
+def test_publish_ignores_known_ids_and_claims_in_order(queue):
+    assert queue.publish([("a", {"n": 1}), ("b", {"n": 2})]) == 2
+    assert queue.publish([("a", {"n": 99}), ("c", {"n": 3})]) == 1
+
+    assert queue.claim("w1") == ("a", {"n": 1})
+    assert queue.claim("w2") == ("b", {"n": 2})
+    assert queue.claim("w1") == ("c", {"n": 3})
+    assert queue.claim("w1") is None
+    assert queue.counts() == {"leased": 3}
+
+
+def test_expired_lease_is_requeued_and_old_owner_locked_out(queue):
+    queue.publish([("a", {})])
+    assert queue.claim("w1", lease_seconds=EXPIRED) == ("a", {})
+
+    # The next claim returns the lapsed job to the queue and hands it over
+    assert queue.claim("w2") == ("a", {})
+    assert not queue.heartbeat("a", "w1")
+    assert not queue.complete("a", "w1", {"hash": "stale"})
+    assert queue.heartbeat("a", "w2")
+    assert queue.complete("a", "w2", {"hash": "abc"})
+    assert queue.unregistered_results() == [("a", {"hash": "abc"})]
+
+
+def test_heartbeat_keeps_a_lease_alive(queue):
+    queue.publish([("a", {})])
+    queue.claim("w1", lease_seconds=EXPIRED)
+    assert queue.heartbeat("a", "w1", lease_seconds=60)
+    assert queue.requeue_expired() == 0
+    assert queue.claim("w2") is None
+
+
+def test_expired_leases_fail_after_max_attempts(queue):
+    queue.publish([("a", {})])
+    queue.claim("w1", lease_seconds=EXPIRED)
+    queue.claim("w2", lease_seconds=EXPIRED)
+
+    # Both attempts used up: the lapsed lease fails the job instead of requeueing it
+    assert queue.claim("w3") is None
+    assert queue.counts() == {"failed": 1}
+
+
+def test_fail_retries_until_max_attempts(queue):
+    queue.publish([("a", {})])
+    queue.claim("w1")
+    assert queue.fail("a", "w1", "ffmpeg exited 1")
+    assert queue.counts() == {"queued": 1}
+
+    queue.claim("w2")
+    assert not queue.fail("a", "w1", "not the owner")
+    assert queue.fail("a", "w2", "ffmpeg exited 1")
+    assert queue.counts() == {"failed": 1}
+    assert queue.claim("w3") is None
+
+
+def test_registered_results_are_not_returned_again(queue):
+    queue.publish([("a", {}), ("b", {})])
+    for worker in ("w1", "w2"):
+        job_id, _ = queue.claim(worker)
+        queue.complete(job_id, worker, {"hash": job_id})
+
+    queue.mark_registered(["a"])
+    assert queue.unregistered_results() == [("b", {"hash": "b"})]
+    assert queue.counts() == {"registered": 1, "done": 1}
@@ -0,0 +1,194 @@
+import struct
+
+import pytest
+
+import mp4_meta
+from mp4_meta import MP4Error, make_box, read_tags, write_metadata
+
+# ============================================================
+# SYNTHETIC FILES
+# ============================================================
+
+MDAT_PAYLOAD = bytes(range(256)) * 40
+
+
+def ftyp():
+    return make_box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso2avc1mp41")
+
+
+def mvhd(timescale=1000, duration=5000, creation=0):
+    return make_box(b"mvhd", bytes(4) + struct.pack(">IIII", creation, creation, timescale, duration) + bytes(80))
+
+
+def ilst_item(atom, value):
+    return make_box(atom, make_box(b"data", struct.pack(">II", 1, 0) + value.encode()))
+
+
+def mdta_udta():
+    """udta/meta in QuickTime mdta style: hdlr(mdta) + keys + index-keyed ilst"""
+    hdlr = make_box(b"hdlr", bytes(8) + b"mdta" + bytes(13))
+    keys = make_box(b"keys", struct.pack(">II", 0, 1) + make_box(b"mdta", b"com.apple.quicktime.make"))
+    ilst = make_box(b"ilst", ilst_item(struct.pack(">I", 1), "Acme"))
+    return make_box(b"udta", make_box(b"meta", bytes(4) + hdlr + keys + ilst))
+
+
+def build_file(path, moov_first=True, udta=b"", trailing_size0=False, tracks=b"", creation=0):
+    moov = make_box(b"moov", mvhd(creation=creation) + tracks + udta)
+    if trailing_size0:
+        mdat = struct.pack(">I4s", 0, b"mdat") + MDAT_PAYLOAD
+    else:
+        mdat = make_box(b"mdat", MDAT_PAYLOAD)
+    body = ftyp() + (moov + mdat if moov_first else mdat + moov)
+    path.write_bytes(body)
+    return body.index(MDAT_PAYLOAD)
+
+
+def top_level(path):
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        return [(box_type, offset) for box_type, offset, _, _ in mp4_meta.iter_boxes(f, 0, size)]
+
+
+# ============================================================
+# WRITE / READ TAGS
+# ============================================================
+
+@pytest.mark.parametrize("moov_first", [True, False])
+def test_round_trip_keeps_media_in_place(tmp_path, moov_first):
+    source, output = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    media_offset = build_file(source, moov_first=moov_first)
+
+    write_metadata(str(source), str(output), {"title": "Clip", "comment": "hello", "unknown_key": "dropped"})
+
+    assert read_tags(str(output)) == {"title": "Clip", "comment": "hello"}
+    data = output.read_bytes()
+    assert data[media_offset:media_offset + len(MDAT_PAYLOAD)] == MDAT_PAYLOAD
+    types = [box_type for box_type, _ in top_level(output)]
+    assert types.count(b"moov") == 1 and types[-1] == b"moov"
+    # moov-first: the old moov stays as padding so the mdat doesn't move
+    assert (b"free" in types) == moov_first
+
+
+def test_retag_keeps_untouched_items(tmp_path):
+    source, first, second = tmp_path / "in.mp4", tmp_path / "a.mp4", tmp_path / "b.mp4"
+    build_file(source)
+    write_metadata(str(source), str(first), {"title": "One", "artist": "Someone"})
+    write_metadata(str(first), str(second), {"title": "Two"})
+    assert read_tags(str(second)) == {"title": "Two", "artist": "Someone"}
+
+
+def test_keys_and_hdlr_survive_a_retag(tmp_path):
+    source, output = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    build_file(source, udta=mdta_udta())
+
+    write_metadata(str(source), str(output), {"title": "Clip"})
+
+    with open(output, "rb") as f:
+        moov_offset = [offset for box_type, offset in top_level(output) if box_type == b"moov"][0]
+        f.seek(moov_offset)
+        moov = f.read()
+    udta = dict(mp4_meta.iter_child_boxes(mp4_meta.box_payload(moov)))[b"udta"]
+    header, children = mp4_meta.split_meta(dict(mp4_meta.iter_child_boxes(mp4_meta.box_payload(udta)))[b"meta"])
+    children = dict(children)
+    assert header == bytes(4)
+    assert children[b"hdlr"][16:20] == b"mdta"
+    assert b"com.apple.quicktime.make" in children[b"keys"]
+    items = dict(mp4_meta.iter_child_boxes(mp4_meta.box_payload(children[b"ilst"])))
+    assert struct.pack(">I", 1) in items
+    assert read_tags(str(output)) == {"title": "Clip"}
+
+
+def test_trailing_size0_box_is_rejected(tmp_path):
+    source, output = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    build_file(source, moov_first=True, trailing_size0=True)
+    with pytest.raises(MP4Error):
+        write_metadata(str(source), str(output), {"title": "Clip"})
+    assert not output.exists()
+
+
+def test_size0_moov_at_the_end_is_rewritten(tmp_path):
+    source, output = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    body = ftyp() + make_box(b"mdat", MDAT_PAYLOAD) + struct.pack(">I4s", 0, b"moov") + mvhd()
+    source.write_bytes(body)
+    write_metadata(str(source), str(output), {"title": "Clip"})
+    assert read_tags(str(output)) == {"title": "Clip"}
+
+
+def test_same_input_and_output_is_refused(tmp_path):
+    source = tmp_path / "in.mp4"
+    build_file(source)
+    with pytest.raises(MP4Error):
+        write_metadata(str(source), str(source), {"title": "Clip"})
+
+
+def test_fragmented_file_is_refused(tmp_path):
+    source, output = tmp_path / "in.mp4", tmp_path / "out.mp4"
+    moov = make_box(b"moov", mvhd() + make_box(b"mvex", b""))
+    source.write_bytes(ftyp() + moov + make_box(b"moof", b"") + make_box(b"mdat", MDAT_PAYLOAD))
+    with pytest.raises(MP4Error):
+        write_metadata(str(source), str(output), {"title": "Clip"})
+
+
+# ============================================================
+# NATIVE PROBE
+# ============================================================
+
+def trak(handler, timescale, duration, entry_type, entry, stts=b""):
+    mdhd = make_box(b"mdhd", bytes(4) + struct.pack(">IIII", 0, 0, timescale, duration) + bytes(4))
+    hdlr = make_box(b"hdlr", bytes(8) + handler + bytes(13))
+    stsd = make_box(b"stsd", bytes(4) + struct.pack(">I", 1) + make_box(entry_type, entry))
+    stbl = make_box(b"stbl", stsd + (make_box(b"stts", bytes(4) + stts) if stts else b""))
+    return make_box(b"trak", make_box(b"mdia", mdhd + hdlr + make_box(b"minf", stbl)))
+
+
+def video_trak(width=1280, height=720, frames=150, timescale=15360, delta=512):
+    entry = bytes(24) + struct.pack(">HH", width, height) + bytes(50)
+    stts = struct.pack(">III", 1, frames, delta)
+    return trak(b"vide", timescale, frames * delta, b"avc1", entry, stts)
+
+
+def audio_trak(channels=2, rate=48000, seconds=5):
+    entry = bytes(16) + struct.pack(">H", channels) + bytes(6) + struct.pack(">I", rate << 16)
+    return trak(b"soun", rate, rate * seconds, b"mp4a", entry)
+
+
+def test_probe_reads_streams_and_format(tmp_path):
+    path = tmp_path / "clip.mp4"
+    # 2024-01-01T00:00:00Z in MP4 epoch seconds
+    creation = 1704067200 + mp4_meta.MP4_EPOCH_OFFSET
+    build_file(path, tracks=video_trak() + audio_trak(), creation=creation)
+    write_metadata(str(path), str(tmp_path / "tagged.mp4"), {"title": "Clip"})
+
+    info = mp4_meta.probe(str(tmp_path / "tagged.mp4"))
+
+    video, audio = info["streams"]
+    assert (video["codec_type"], video["codec_name"], video["width"], video["height"]) == ("video", "h264", 1280, 720)
+    assert video["avg_frame_rate"] == "30/1" and video["nb_frames"] == "150"
+    assert (audio["codec_type"], audio["codec_name"], audio["channels"], audio["sample_rate"]) == ("audio", "aac", 2, "48000")
+    assert [stream["index"] for stream in info["streams"]] == [0, 1]
+    assert float(info["format"]["duration"]) == 5.0
+    assert info["format"]["nb_streams"] == 2
+    assert info["format"]["tags"]["title"] == "Clip"
+    assert info["format"]["tags"]["creation_time"] == "2024-01-01T00:00:00.000000Z"
+    assert info["format"]["tags"]["major_brand"] == "isom"
+
+
+def test_probe_agrees_with_summarize_probe(tmp_path):
+    from ffmpeg_utils import summarize_probe
+    path = tmp_path / "clip.mp4"
+    build_file(path, tracks=video_trak(width=640, height=360) + audio_trak())
+    summary = summarize_probe(mp4_meta.probe(str(path)))
+    assert (summary["width"], summary["height"], summary["duration"]) == (640, 360, 5.0)
+    assert summary["audio_codec"] == "aac"
+
+
+def test_probe_refuses_fragmented_and_incomplete_files(tmp_path):
+    fragmented = tmp_path / "frag.mp4"
+    fragmented.write_bytes(ftyp() + make_box(b"moov", mvhd()) + make_box(b"moof", b"") + make_box(b"mdat", MDAT_PAYLOAD))
+    no_moov = tmp_path / "no_moov.mp4"
+    no_moov.write_bytes(ftyp() + make_box(b"mdat", MDAT_PAYLOAD))
+    no_duration = tmp_path / "no_duration.mp4"
+    no_duration.write_bytes(ftyp() + make_box(b"moov", mvhd(duration=0)) + make_box(b"mdat", MDAT_PAYLOAD))
+    for path in (fragmented, no_moov, no_duration):
+        with pytest.raises(MP4Error):
+            mp4_meta.probe(str(path))
@@ -0,0 +1,166 @@
+import logging
+import random
+
+import pytest
+
+import tuning
+from tuning import ALLOWED_PRESETS, CRF_RANGE, SpeedModel, apply_budget, predict_seconds
+
+THREADS = 4
+
+
+@pytest.fixture
+def model(tmp_path):
+    # No saved calibration: the DEFAULT_THROUGHPUT table only
+    return SpeedModel(str(tmp_path / "speed_model.json"))
+
+
+def job(preset="slow", crf=23, video="libx264"):
+    return {"params": {"plan": {"video": video, "audio": "copy"}, "preset": preset, "crf": crf}}
+
+
+def settings(jobs):
+    return [(j["params"]["preset"], j["params"]["crf"]) for j in jobs]
+
+
+def total_seconds(model, jobs, shapes, workers=1):
+    return sum(predict_seconds(model, j["params"], shape, THREADS) for j, shape in zip(jobs, shapes)) / workers
+
+
+# ============================================================
+# DEADLINE
+# ============================================================
+
+def test_no_budget_changes_nothing(model):
+    jobs, shapes = [job(), job("medium")], [(60, 1920, 1080, 30), (30, 1280, 720, 30)]
+    predicted = apply_budget(jobs, shapes, 2, THREADS, model)
+    assert settings(jobs) == [("slow", 23), ("medium", 23)]
+    assert predicted == pytest.approx(total_seconds(model, jobs, shapes, workers=2))
+
+
+def test_loose_deadline_changes_nothing(model):
+    jobs, shapes = [job()], [(60, 1920, 1080, 30)]
+    apply_budget(jobs, shapes, 1, THREADS, model, deadline=10 ** 6)
+    assert settings(jobs) == [("slow", 23)]
+
+
+def test_deadline_downgrades_the_biggest_saving_first(model):
+    # One long 4K job and one short small job: only the 4K one needs to get faster
+    jobs = [job(), job()]
+    shapes = [(60, 3840, 2160, 30), (5, 640, 360, 30)]
+    before = total_seconds(model, jobs, shapes)
+
+    predicted = apply_budget(jobs, shapes, 1, THREADS, model, deadline=before * 0.7)
+
+    assert predicted <= before * 0.7
+    assert predicted == pytest.approx(total_seconds(model, jobs, shapes))
+    assert jobs[0]["params"]["preset"] != "slow"
+    assert settings(jobs)[1] == ("slow", 23)
+
+
+def test_impossible_deadline_ends_at_the_floor_and_warns(model, caplog):
+    jobs, shapes = [job(), job("medium", None)], [(600, 3840, 2160, 60), (600, 1920, 1080, 30)]
+    with caplog.at_level(logging.WARNING):
+        predicted = apply_budget(jobs, shapes, 1, THREADS, model, deadline=1)
+    assert settings(jobs) == [(ALLOWED_PRESETS[0], CRF_RANGE[1])] * 2
+    assert predicted > 1
+    assert "Deadline can't be met" in caplog.text
+
+
+def test_copy_jobs_are_left_alone(model):
+    jobs, shapes = [job("slow", 23, video="copy")], [(600, 3840, 2160, 60)]
+    assert apply_budget(jobs, shapes, 1, THREADS, model, deadline=1) == 0
+    assert settings(jobs) == [("slow", 23)]
+
+
+def test_deadline_matches_a_full_rescan_greedy(model):
+    """The heap search picks the same downgrades as rescanning every job each step"""
+    rng = random.Random(7)
+    jobs = [job(rng.choice(ALLOWED_PRESETS), rng.choice([20, 23, None])) for _ in range(40)]
+    shapes = [(rng.uniform(5, 120), rng.choice([640, 1280, 1920]), rng.choice([360, 720, 1080]), 30) for _ in jobs]
+    deadline = total_seconds(model, jobs, shapes, workers=4) * 0.6
+    expected = [dict(j, params=dict(j["params"])) for j in jobs]
+
+    apply_budget(jobs, shapes, 4, THREADS, model, deadline=deadline)
+
+    # Reference: re-price every job on every step, take the largest saving
+    while total_seconds(model, expected, shapes, workers=4) > deadline:
+        best, best_saving, best_change = None, 0.0, None
+        for i, params in enumerate(j["params"] for j in expected):
+            rank = ALLOWED_PRESETS.index(params["preset"])
+            if rank > 0:
+                change = ("preset", ALLOWED_PRESETS[rank - 1])
+            elif (params["crf"] or 23) < CRF_RANGE[1]:
+                change = ("crf", min(CRF_RANGE[1], (params["crf"] or 23) + 2))
+            else:
+                continue
+            trial = dict(params, **{change[0]: change[1]})
+            saving = predict_seconds(model, params, shapes[i], THREADS) - predict_seconds(model, trial, shapes[i], THREADS)
+            if saving > best_saving:
+                best, best_saving, best_change = i, saving, change
+        if best is None:
+            break
+        expected[best]["params"][best_change[0]] = best_change[1]
+
+    assert settings(jobs) == settings(expected)
+
+
+# ============================================================
+# MIN SPEED
+# ============================================================
+
+def test_min_speed_picks_the_slowest_preset_that_is_fast_enough(model):
+    shape = (60, 1280, 720, 30)
+    jobs = [job("slow")]
+    # Between what medium and slow reach at 720p30
+    floor = (model.speed("medium", 1280, 720, 30, THREADS, 23) + model.speed("slow", 1280, 720, 30, THREADS, 23)) / 2
+    apply_budget(jobs, [shape], 1, THREADS, model, min_speed=floor)
+    assert settings(jobs) == [("medium", 23)]
+
+
+def test_min_speed_already_met_changes_nothing(model):
+    jobs = [job("slow")]
+    apply_budget(jobs, [(60, 640, 360, 30)], 1, THREADS, model, min_speed=0.01)
+    assert settings(jobs) == [("slow", 23)]
+
+
+def test_min_speed_raises_crf_when_presets_are_not_enough(model):
+    width, height, fps = 1920, 1080, 30
+    # Just above what the fastest preset reaches at CRF 23, below it at the top CRF
+    floor = model.speed("fast", width, height, fps, THREADS, 23) * 1.05
+    assert model.speed("fast", width, height, fps, THREADS, CRF_RANGE[1]) >= floor
+    jobs = [job("slow")]
+    apply_budget(jobs, [(60, width, height, fps)], 1, THREADS, model, min_speed=floor)
+    preset, crf = settings(jobs)[0]
+    assert preset == "fast" and 23 < crf <= CRF_RANGE[1]
+    assert model.speed(preset, width, height, fps, THREADS, crf) >= floor
+
+
+def test_unreachable_min_speed_ends_at_the_floor_and_warns(model, caplog):
+    jobs = [job("medium"), job("slow")]
+    shapes = [(60, 3840, 2160, 60), (60, 640, 360, 30)]
+    with caplog.at_level(logging.WARNING):
+        apply_budget(jobs, shapes, 1, THREADS, model, min_speed=3)
+    assert settings(jobs)[0] == ("fast", CRF_RANGE[1])
+    assert "1 jobs can't reach 3x realtime" in caplog.text
+
+
+# ============================================================
+# SPEED MODEL
+# ============================================================
+
+def test_record_takes_the_first_sample_then_averages(model):
+    # 1080p30 at 1 thread, CRF 23: 62.208 megapixel-frames per second of media
+    model.record("fast", 1920, 1080, 30, 1, 23, media_seconds=10, wall_seconds=20)
+    first = model.throughput["fast"]
+    assert first == pytest.approx(62.208 / 2)
+    model.record("fast", 1920, 1080, 30, 1, 23, media_seconds=10, wall_seconds=10)
+    assert model.throughput["fast"] == pytest.approx(first + tuning.EWMA_ALPHA * (62.208 - first))
+
+
+def test_model_round_trips_through_its_file(model):
+    model.record("medium", 1920, 1080, 30, 1, 23, media_seconds=10, wall_seconds=20)
+    model.save()
+    reloaded = SpeedModel(model.path)
+    assert reloaded.throughput["medium"] == pytest.approx(model.throughput["medium"])
+    assert reloaded.samples == {"medium": 1}
@@ -0,0 +1,332 @@
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+
+# ============================================================
+# ENCODE SPEED MODEL
+# ============================================================
+#
+# Speed is modelled as libx264 throughput in megapixel-frames per second
+# per encoder thread, per preset. A job's realtime factor is then
+#
+#     speed = throughput[preset] * threads * crf_factor / (width * height * fps / 1e6)
+#
+# The defaults are rough figures for a modern x86 core; every batch that
+# re-encodes feeds its measured timings back in, so the model converges
+# on the actual machine.
+
+model_path = os.path.join(os.path.dirname(__file__), "data", "speed_model.json")
+
+# Megapixel-frames / second / thread (1080p30 at 1 thread: fast ~0.35x realtime)
+DEFAULT_THROUGHPUT = {
+    "ultrafast": 60.0,
+    "superfast": 40.0,
+    "veryfast": 30.0,
+    "faster": 25.0,
+    "fast": 22.0,
+    "medium": 14.0,
+    "slow": 7.0,
+}
+
+# Presets create_variation may pick, fastest first
+ALLOWED_PRESETS = ["fast", "medium", "slow"]
+
+CRF_RANGE = (20, 28)
+
+# Weight of a new measurement in the running average
+EWMA_ALPHA = 0.3
+
+# Stream-copy (remux) rate; bound by the disk rather than the CPU
+DEFAULT_COPY_BYTES_PER_SECOND = 150e6
+
+# libx264 output bits per pixel at CRF 23; every +6 CRF roughly halves it
+DEFAULT_BITS_PER_PIXEL = {
+    "fast": 0.09,
+    "medium": 0.08,
+    "slow": 0.075,
+}
+
+# AAC encode realtime factor (one core) and the bitrate assumed for copied audio
+AUDIO_ENCODE_SPEED = 200.0
+DEFAULT_AUDIO_KBPS = 128
+
+
+def crf_factor(crf):
+    """Higher CRF spends fewer bits and encodes slightly faster (~2% per step)"""
+    return 1.0 + 0.02 * ((crf or 23) - 23)
+
+
+def crf_size_factor(crf):
+    """Output size relative to CRF 23"""
+    return 2 ** ((23 - (crf or 23)) / 6)
+
+
+def parse_duration(text):
+    """Parse '2h', '90m', '45s', '1h30m' or plain seconds into seconds"""
+    text = str(text).strip().lower()
+    if re.fullmatch(r"\d+(\.\d+)?", text):
+        return float(text)
+    parts = re.findall(r"(\d+(?:\.\d+)?)\s*([hms])", text)
+    if not parts or "".join(n + u for n, u in parts) != text.replace(" ", ""):
+        raise ValueError(f"invalid duration: {text}")
+    scale = {"h": 3600, "m": 60, "s": 1}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+class SpeedModel:
+    """Per-preset encode throughput, calibrated from past runs"""
+
+    def __init__(self, path=None):
+        # Looked up at call time so benchmarks can point model_path elsewhere
+        self.path = path or model_path
+        self.lock = threading.Lock()
+        self.throughput = dict(DEFAULT_THROUGHPUT)
+        self.samples = {}
+        self.copy_rate = DEFAULT_COPY_BYTES_PER_SECOND
+        self.bits_per_pixel = dict(DEFAULT_BITS_PER_PIXEL)
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.throughput.update(saved.get("throughput", {}))
+            self.samples = saved.get("samples", {})
+            self.copy_rate = saved.get("copy_bytes_per_second", self.copy_rate)
+            self.bits_per_pixel.update(saved.get("bits_per_pixel", {}))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def speed(self, preset, width, height, fps, threads, crf=None):
+        """Predicted realtime factor for one job"""
+        megapixels = max((width or 1920) * (height or 1080) * (fps or 30) / 1e6, 0.01)
+        return self.throughput.get(preset, DEFAULT_THROUGHPUT["medium"]) * max(threads, 1) * crf_factor(crf) / megapixels
+
+    def record(self, preset, width, height, fps, threads, crf, media_seconds, wall_seconds):
+        """Fold one finished encode into the model"""
+        if not media_seconds or not wall_seconds or preset is None:
+            return
+        megapixels = (width or 1920) * (height or 1080) * (fps or 30) / 1e6
+        measured = media_seconds / wall_seconds * megapixels / max(threads, 1) / crf_factor(crf)
+        with self.lock:
+            current = self.throughput.get(preset, measured)
+            count = self.samples.get(preset, 0)
+            # Take the first sample as is, then average
+            self.throughput[preset] = measured if count == 0 else current + EWMA_ALPHA * (measured - current)
+            self.samples[preset] = count + 1
+
+    def copy_seconds(self, size):
+        """Predicted wall time to remux size bytes"""
+        return (size or 0) / self.copy_rate
+
+    def record_copy(self, size, wall_seconds):
+        """Fold one finished stream copy into the model"""
+        if not size or not wall_seconds:
+            return
+        with self.lock:
+            count = self.samples.get("copy", 0)
+            measured = size / wall_seconds
+            self.copy_rate = measured if count == 0 else self.copy_rate + EWMA_ALPHA * (measured - self.copy_rate)
+            self.samples["copy"] = count + 1
+
+    def output_bytes(self, params, info):
+        """Predicted output size for one job (summarize_probe info of its source)"""
+        info = info or {}
+        duration, width, height, fps = job_shape(info)
+        if params["plan"]["video"] == "copy":
+            return info.get("size") or 0
+        bpp = self.bits_per_pixel.get(params["preset"], DEFAULT_BITS_PER_PIXEL["medium"])
+        video_bits = bpp * crf_size_factor(params["crf"]) * (width or 1920) * (height or 1080) * (fps or 30) * duration
+        audio_kbps = 0
+        if info.get("audio_codec"):
+            audio_kbps = params["audio_bitrate"] or DEFAULT_AUDIO_KBPS
+        return int((video_bits + audio_kbps * 1000 * duration) / 8)
+
+    def record_output(self, params, info, size):
+        """Fold one re-encoded output's measured size into the model"""
+        info = info or {}
+        duration, width, height, fps = job_shape(info)
+        preset = params["preset"]
+        if not size or not duration or preset is None:
+            return
+        audio_kbps = (params["audio_bitrate"] or DEFAULT_AUDIO_KBPS) if info.get("audio_codec") else 0
+        video_bits = max(size * 8 - audio_kbps * 1000 * duration, 0)
+        measured = video_bits / ((width or 1920) * (height or 1080) * (fps or 30) * duration) / crf_size_factor(params["crf"])
+        with self.lock:
+            key = f"size:{preset}"
+            count = self.samples.get(key, 0)
+            current = self.bits_per_pixel.get(preset, measured)
+            self.bits_per_pixel[preset] = measured if count == 0 else current + EWMA_ALPHA * (measured - current)
+            self.samples[key] = count + 1
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp = self.path + ".tmp"
+            with open(temp, "w") as f:
+                json.dump({
+                    "throughput": self.throughput,
+                    "samples": self.samples,
+                    "copy_bytes_per_second": self.copy_rate,
+                    "bits_per_pixel": self.bits_per_pixel,
+                }, f, indent=2)
+            os.replace(temp, self.path)
+
+
+# ============================================================
+# BUDGETED PARAMETER SELECTION
+# ============================================================
+
+def job_shape(info):
+    """(duration, width, height, fps) from summarize_probe output"""
+    info = info or {}
+    return info.get("duration") or 0.0, info.get("width"), info.get("height"), info.get("fps")
+
+
+def predict_seconds(model, params, shape, threads):
+    duration, width, height, fps = shape
+    if params["plan"]["video"] == "copy" or not duration:
+        return 0.0
+    return duration / model.speed(params["preset"], width, height, fps, threads, params["crf"])
+
+
+def apply_budget(jobs, shapes, max_workers, threads, model, deadline=None, min_speed=None):
+    """Adjust each job's preset (and CRF) so the batch meets its budget
+
+    Args:
+        jobs: Planned jobs (params are edited in place)
+        shapes: list of job_shape() tuples, one per job
+        max_workers: Parallel jobs
+        threads: Encoder threads per job
+        deadline: Wall-clock seconds the whole batch should finish within
+        min_speed: Minimum realtime factor every job must reach
+    Returns:
+        predicted wall-clock seconds after adjustment
+    """
+    encoded = [i for i, job in enumerate(jobs) if job["params"]["plan"]["video"] != "copy"]
+
+    if min_speed:
+        too_slow = []
+        for i in encoded:
+            params = jobs[i]["params"]
+            _, width, height, fps = shapes[i]
+            ok = [p for p in ALLOWED_PRESETS if model.speed(p, width, height, fps, threads, params["crf"]) >= min_speed]
+            if params["preset"] in ok:
+                continue
+            if ok:
+                # Slowest preset that still meets the floor
+                params["preset"] = ok[-1]
+                continue
+            # Even the fastest preset is too slow: raise CRF like the deadline search does
+            params["preset"] = ALLOWED_PRESETS[0]
+            while model.speed(params["preset"], width, height, fps, threads, params["crf"]) < min_speed and (params["crf"] or 23) < CRF_RANGE[1]:
+                params["crf"] = min(CRF_RANGE[1], (params["crf"] or 23) + 2)
+            speed = model.speed(params["preset"], width, height, fps, threads, params["crf"])
+            if speed < min_speed:
+                too_slow.append(speed)
+        if too_slow:
+            logging.warning(f"{len(too_slow)} jobs can't reach {min_speed}x realtime even with the fastest allowed settings "
+                            f"(slowest {min(too_slow):.2f}x)")
+
+    costs = {i: predict_seconds(model, jobs[i]["params"], shapes[i], threads) for i in encoded}
+    total = sum(costs.values())
+
+    def next_change(i):
+        """(saving, (key, value)) of job i's next downgrade, or None at the floor"""
+        params = jobs[i]["params"]
+        rank = ALLOWED_PRESETS.index(params["preset"]) if params["preset"] in ALLOWED_PRESETS else 0
+        if rank > 0:
+            change = ("preset", ALLOWED_PRESETS[rank - 1])
+        elif (params["crf"] or 23) < CRF_RANGE[1]:
+            change = ("crf", min(CRF_RANGE[1], (params["crf"] or 23) + 2))
+        else:
+            return None
+        trial = dict(params, **{change[0]: change[1]})
+        return costs[i] - predict_seconds(model, trial, shapes[i], threads), change
+
+    if deadline:
+        # Greedy: downgrade whichever job saves the most time, until it fits.
+        # The heap holds each job's next saving; only the job just changed
+        # is re-priced, so every step costs O(log n) instead of a full scan.
+        heap = []
+        for i in encoded:
+            step = next_change(i)
+            if step and step[0] > 0:
+                heap.append((-step[0], i, step[1]))
+        heapq.heapify(heap)
+        workers = max(max_workers, 1)
+        while total / workers > deadline:
+            if not heap:
+                logging.warning("Deadline can't be met even with the fastest allowed settings")
+                break
+            neg_saving, i, (key, value) = heapq.heappop(heap)
+            jobs[i]["params"][key] = value
+            costs[i] += neg_saving
+            total += neg_saving
+            step = next_change(i)
+            if step and step[0] > 0:
+                heapq.heappush(heap, (-step[0], i, step[1]))
+
+    return total / max(max_workers, 1)
+
+
+# ============================================================
+# COST ESTIMATES
+# ============================================================
+
+def estimate_job(model, params, info, threads):
+    """(cpu_seconds, wall_seconds, output_bytes) for one job"""
+    info = info or {}
+    shape = job_shape(info)
+    plan = params["plan"]
+    if plan["video"] != "copy":
+        wall = predict_seconds(model, params, shape, threads)
+        cpu = wall * max(threads, 1)
+    else:
+        # Remuxing keeps at most one core busy
+        wall = cpu = model.copy_seconds(info.get("size"))
+    if plan["audio"] != "copy" and info.get("audio_codec"):
+        audio = shape[0] / AUDIO_ENCODE_SPEED
+        wall += audio
+        cpu += audio
+    return cpu, wall, model.output_bytes(params, info)
+
+
+def estimate_batch(jobs, infos, max_workers, threads, model, free_bytes=None):
+    """Per-job and total cost of running jobs in order on max_workers workers
+
+    Jobs start in list order on whichever worker frees up first (like
+    the batch's thread pool), which gives each job's predicted start and
+    finish and the batch's wall time. Headroom is the free disk space
+    left once each job's output, and every earlier one, has been written.
+
+    Args:
+        infos: summarize_probe output of each job's source, one per job
+        free_bytes: Free space on the output filesystem (None = unknown)
+    Returns:
+        (list of per-job estimate dicts, totals dict)
+    """
+    workers = [0.0] * max(max_workers, 1)
+    estimates = []
+    written = 0
+    for job, info in zip(jobs, infos):
+        cpu, wall, size = estimate_job(model, job["params"], info, threads)
+        start = heapq.heappop(workers)
+        heapq.heappush(workers, start + wall)
+        written += size
+        estimates.append({
+            "cpu_seconds": round(cpu, 1),
+            "wall_seconds": round(wall, 1),
+            "start": round(start, 1),
+            "finish": round(start + wall, 1),
+            "output_bytes": size,
+            "headroom_bytes": None if free_bytes is None else free_bytes - written,
+        })
+    totals = {
+        "jobs": len(estimates),
+        "cpu_seconds": round(sum(e["cpu_seconds"] for e in estimates), 1),
+        "wall_seconds": round(max(workers), 1),
+        "output_bytes": written,
+        "free_bytes": free_bytes,
+    }
+    return estimates, totals
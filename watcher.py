@@ -0,0 +1,399 @@
+import argparse
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import logging
+import os
+import queue
+import select
+import struct
+import threading
+import time
+
+from data import DedupIndex, get_registry
+from ffmpeg_utils import create_source_variations, setup_logging
+
+# ============================================================
+# WATCH SETTINGS
+# ============================================================
+
+# Seconds a file's size and mtime must stay unchanged before it is queued
+DEFAULT_SETTLE_SECONDS = 5.0
+
+# Polling interval when inotify isn't available
+DEFAULT_POLL_SECONDS = 2.0
+
+# Sources waiting for the engine; a full queue pauses discovery
+DEFAULT_QUEUE_SIZE = 100
+
+# Seconds between full rescans of the watched folders, which catch files
+# whose events were lost (kernel queue overflow, time spent blocked on a
+# full source queue, network mounts that don't deliver events)
+DEFAULT_RESCAN_SECONDS = 300.0
+
+STATE_NAME = "watch_state.jsonl"
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_video(filename):
+    return filename.endswith(".mp4") and not filename.startswith(".")
+
+
+def folder_prefixes(folders):
+    """Output name prefix per watched folder (abspath -> prefix)
+
+    A single folder keeps plain names. With several, each folder's name
+    goes in front of its outputs so same-named sources in different
+    folders don't overwrite each other; folders that share a name also
+    get a short hash of their full path.
+    """
+    paths = [os.path.abspath(folder) for folder in folders]
+    if len(paths) == 1:
+        return {paths[0]: ""}
+    names = [os.path.basename(path) or "root" for path in paths]
+    prefixes = {}
+    for path, name in zip(paths, names):
+        if names.count(name) > 1:
+            name = f"{name}-{hashlib.sha1(path.encode()).hexdigest()[:8]}"
+        prefixes[path] = f"{name}__"
+    return prefixes
+
+
+# ============================================================
+# FOLDER WATCHERS
+# ============================================================
+
+class PollingWatcher:
+    """Finds new or changed videos by rescanning the folders"""
+
+    def __init__(self, folders, interval=DEFAULT_POLL_SECONDS):
+        self.folders = folders
+        self.interval = interval
+        self.seen = {}
+        # Every poll is a full scan, so nothing is ever missed
+        self.overflowed = False
+
+    def poll(self, timeout):
+        """Return paths that appeared or changed since the last scan"""
+        time.sleep(min(timeout, self.interval))
+        changed = []
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_file() or not is_video(entry.name):
+                    continue
+                st = entry.stat()
+                key = (st.st_size, st.st_mtime_ns)
+                if self.seen.get(entry.path) != key:
+                    self.seen[entry.path] = key
+                    changed.append(entry.path)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify watcher (no polling, events arrive as files land)
+
+    If the kernel's event queue overflows, events are lost; overflowed is
+    then set so the caller can rescan the folders.
+    """
+
+    def __init__(self, folders):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify not supported")
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.overflowed = False
+        self.folders = {}
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        for folder in folders:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"cannot watch {folder}")
+            self.folders[wd] = folder
+
+    def poll(self, timeout):
+        """Return paths with events, waiting up to timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+            elif name and is_video(name) and wd in self.folders:
+                paths.append(os.path.join(self.folders[wd], name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(folders, poll_interval=DEFAULT_POLL_SECONDS, force_polling=False):
+    if not force_polling:
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as e:
+            logging.info(f"inotify unavailable ({e}), polling every {poll_interval}s")
+    return PollingWatcher(folders, poll_interval)
+
+
+class StabilityTracker:
+    """Holds candidate files until they stop changing
+
+    A file counts as fully written once its size and mtime have been the
+    same for settle seconds (copies over SMB/rsync close and reopen files,
+    so close events alone aren't enough).
+    """
+
+    def __init__(self, settle=DEFAULT_SETTLE_SECONDS):
+        self.settle = settle
+        self.pending = {}
+
+    def touch(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        key = (st.st_size, st.st_mtime_ns)
+        current = self.pending.get(path)
+        if current is None or current[0] != key:
+            self.pending[path] = (key, time.monotonic())
+
+    def ready(self):
+        """Pop and return files that have been stable long enough"""
+        now = time.monotonic()
+        done = []
+        for path in list(self.pending):
+            self.touch(path)
+            if path not in self.pending:
+                continue
+            key, since = self.pending[path]
+            if key[0] > 0 and now - since >= self.settle:
+                done.append(path)
+                del self.pending[path]
+        return done
+
+
+# ============================================================
+# WATCH SERVICE
+# ============================================================
+
+class WatchService:
+    """Feeds sources dropped into watched folders to the variation engine"""
+
+    def __init__(self, folders, output_folder, variations_per_video=3, reencode=False, use_filter=False,
+                 use_audio=False, jobs=1, workers=1, queue_size=DEFAULT_QUEUE_SIZE,
+                 settle=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_SECONDS, force_polling=False,
+                 rescan_interval=DEFAULT_RESCAN_SECONDS):
+        self.folders = folders
+        self.output_folder = output_folder
+        self.options = {
+            "variations_per_video": variations_per_video,
+            "reencode": reencode,
+            "use_filter": use_filter,
+            "use_audio": use_audio,
+            "jobs": jobs,
+        }
+        self.prefixes = folder_prefixes(folders)
+        # One index for the daemon's lifetime: the registry is scanned into
+        # its Bloom filter once, not once per dropped file
+        self.dedup = DedupIndex(get_registry())
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.tracker = StabilityTracker(settle)
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self.rescan_interval = rescan_interval
+        self.stop_event = threading.Event()
+        self.state_path = os.path.join(output_folder, STATE_NAME)
+        self.state_lock = threading.Lock()
+        self.processed = self._load_state()
+        self.queued = set()
+
+    def _load_state(self):
+        processed = {}
+        try:
+            with open(self.state_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    processed[entry["path"]] = (entry["size"], entry["mtime_ns"])
+        except FileNotFoundError:
+            pass
+        return processed
+
+    def _mark_processed(self, path, key, outputs):
+        with self.state_lock:
+            self.processed[path] = key
+            with open(self.state_path, "a") as f:
+                f.write(json.dumps({"path": path, "size": key[0], "mtime_ns": key[1], "outputs": outputs, "time": time.time()}) + "\n")
+
+    def _is_new(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return self.processed.get(path) != (st.st_size, st.st_mtime_ns) and path not in self.queued
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            path, dropped_at = item
+            try:
+                st = os.stat(path)
+                prefix = self.prefixes.get(os.path.dirname(os.path.abspath(path)), "")
+                results = create_source_variations(path, self.output_folder, dedup=self.dedup, name_prefix=prefix, **self.options)
+                latency = time.time() - dropped_at
+                logging.info(f"Done: {os.path.basename(path)} -> {len(results)} variations ({latency:.1f}s after it settled)")
+                self._mark_processed(path, (st.st_size, st.st_mtime_ns), len(results))
+            except Exception as e:
+                logging.error(f"Failed: {path}: {e}")
+            finally:
+                with self.state_lock:
+                    self.queued.discard(path)
+                self.queue.task_done()
+
+    def _enqueue(self, path):
+        """Queue path for the workers; returns True if it had to wait for room"""
+        with self.state_lock:
+            self.queued.add(path)
+        # Blocks while the queue is full, which pauses discovery (backpressure)
+        waited = False
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put((path, time.time()), timeout=1.0)
+                logging.info(f"Queued: {path} ({self.queue.qsize()} waiting)")
+                break
+            except queue.Full:
+                waited = True
+        return waited
+
+    def _scan(self):
+        """Feed every new or changed video in the folders to the stability tracker"""
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError as e:
+                logging.warning(f"Cannot scan {folder}: {e}")
+                continue
+            for entry in entries:
+                if entry.is_file() and is_video(entry.name) and self._is_new(entry.path):
+                    self.tracker.touch(entry.path)
+
+    def run(self):
+        os.makedirs(self.output_folder, exist_ok=True)
+        setup_logging(self.output_folder)
+        watcher = make_watcher(self.folders, self.poll_interval, self.force_polling)
+        logging.info(f"Watching {', '.join(self.folders)} with {type(watcher).__name__}")
+
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        # Anything already in the folders counts as dropped at startup
+        self._scan()
+        last_scan = time.monotonic()
+
+        try:
+            while not self.stop_event.is_set():
+                timeout = min(1.0, self.tracker.settle) if self.tracker.pending else 1.0
+                for path in watcher.poll(timeout):
+                    if self._is_new(path):
+                        self.tracker.touch(path)
+                # Events may have been dropped: while blocked on a full queue
+                # the fd isn't read, and the kernel queue can overflow
+                rescan = watcher.overflowed or time.monotonic() - last_scan >= self.rescan_interval
+                for path in self.tracker.ready():
+                    if self._is_new(path) and self._enqueue(path):
+                        rescan = True
+                if rescan:
+                    if watcher.overflowed:
+                        logging.warning("inotify event queue overflowed, rescanning watched folders")
+                    watcher.overflowed = False
+                    self._scan()
+                    last_scan = time.monotonic()
+        except KeyboardInterrupt:
+            logging.info("Stopping...")
+        finally:
+            watcher.close()
+            self.stop_event.set()
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch folders and create variations as sources arrive")
+    parser.add_argument("inputs", nargs="+", help="Folders to watch")
+    parser.add_argument("-o", "--output", required=True, help="Output folder for variations")
+    parser.add_argument("-n", "--number", type=int, default=3, help="Variations per video (default: 3)")
+    parser.add_argument("-r", "--reencode", action="store_true", help="Re-encode videos (slower but deeper uniqueness)")
+    parser.add_argument("-f", "--filter", action="store_true", help="Apply visual filters (re-encodes video, copies audio)")
+    parser.add_argument("-a", "--audio", action="store_true", help="Apply audio variations (re-encodes audio, copies video)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Parallel ffmpeg jobs per source (default: 1)")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Sources processed at once (default: 1)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help=f"Max queued sources (default: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS, help=f"Seconds a file must stop changing (default: {DEFAULT_SETTLE_SECONDS})")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS, help=f"Polling interval without inotify (default: {DEFAULT_POLL_SECONDS})")
+    parser.add_argument("--force-polling", action="store_true", help="Poll even if inotify is available (e.g. network mounts)")
+    parser.add_argument("--rescan", type=float, default=DEFAULT_RESCAN_SECONDS, help=f"Seconds between full rescans that catch missed files (default: {DEFAULT_RESCAN_SECONDS})")
+    args = parser.parse_args()
+
+    WatchService(
+        args.inputs, args.output,
+        variations_per_video=args.number,
+        reencode=args.reencode,
+        use_filter=args.filter,
+        use_audio=args.audio,
+        jobs=args.jobs,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        settle=args.settle,
+        poll_interval=args.poll,
+        force_polling=args.force_polling,
+        rescan_interval=args.rescan,
+    ).run()